@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+'''
+Portfolio-level backtest of the squeeze buy rule and the sell rules.
+
+All stocks are aligned on one (trading days, stocks) grid, and the backtest
+steps day by day with finite capital. Each day's exits, entries, sizing
+and valuation are numpy operations across all stocks at once.
+'''
+
+import numpy as np
+import pandas as pd
+
+import stockbasic as sb
+from stockdates import days_to_dates, index_days
+
+
+#
+# build_signal_panel
+#
+
+
+def build_signal_panel(all_data_and_features, n_low = 10, rank_column = None):
+    ''' Function to align prices and signals of all stocks on one grid of days
+
+    Input
+    =====
+    all_data_and_features: MultiIndex DataFrame
+        indexed by 'code' and 'date', with 'close', 'ATR', 'LOW<n_low>',
+        'SQUEEZE', 'HIST5' and 'MACD6' in each row
+    n_low: int
+        N of the 'LOW<n>' column used by the N-bar low exit
+    rank_column: str, optional
+        feature to rank same-day buy-points by, highest first
+
+    Output
+    ======
+    Return: dict
+        'codes': list of str, one per column
+        'days': int32 array of trading days (days since 1970-01-01), one per row
+        'close', 'atr', 'nbar_low', 'rank': float (days, stocks) arrays,
+            NaN where a stock has no bar
+        'buy': bool (days, stocks) array of squeeze buy-points
+    '''
+    n_low_col_name = 'LOW' + str(n_low)
+    groups = list(all_data_and_features.groupby(level=0, sort=True))
+    stock_days = [index_days(stock_data.index) for _, stock_data in groups]
+    days = np.unique(np.concatenate(stock_days)) if groups else np.zeros(0, dtype=np.int32)
+
+    shape = (days.shape[0], len(groups))
+    panel = {'codes': [code for code, _ in groups],
+             'days': days.astype(np.int32),
+             'close': np.full(shape, np.nan),
+             'atr': np.full(shape, np.nan),
+             'nbar_low': np.full(shape, np.nan),
+             'rank': np.zeros(shape),
+             'buy': np.zeros(shape, dtype=bool)}
+
+    for stock, (code, stock_data) in enumerate(groups):
+        rows = np.searchsorted(days, stock_days[stock])
+        panel['close'][rows, stock] = stock_data['close'].values
+        panel['atr'][rows, stock] = stock_data['ATR'].values
+        panel['nbar_low'][rows, stock] = stock_data[n_low_col_name].values
+        panel['buy'][rows, stock] = sb.squeeze_buy_points(stock_data)
+        if rank_column is not None:
+            panel['rank'][rows, stock] = stock_data[rank_column].values
+
+    return panel
+
+
+#
+# run_backtest
+#
+
+
+def run_backtest(panel, initial_cash = 1e6, max_positions = 10, risk_per_trade = 0.01,
+                 max_position_weight = 0.2, multi_atr = 2., lot_size = 100, commission = 0.0003):
+    ''' Function to backtest the strategy on a portfolio, day by day
+
+    Explain
+    =======
+    Trades follow the same rules as the samples: buy at the close of a
+    squeeze buy-point, sell at the close of the first bar at or below the
+    ATR stop (buy price - multi_atr * ATR), or at or below the previous
+    n_low bars' low. Each day:
+        a) held stocks hitting an exit are sold,
+        b) buy-points of stocks not held (nor sold today) are ranked, by
+           the panel's 'rank' then by stock order,
+        c) each is sized so that hitting the stop loses risk_per_trade of
+           equity, at most max_position_weight of equity, in lots of
+           lot_size shares, and bought in rank order until the free slots
+           of max_positions are filled. A candidate the remaining cash
+           cannot pay for is skipped, and lower ranked ones still bought.
+           Buying as many shares as cash allows happens only through
+           max_position_weight, a candidate is never bought at a smaller
+           size.
+        d) the portfolio is valued at the last known close of each stock.
+    A stock with no bar on a day (eg. suspended) is neither bought nor sold.
+    commission is a fraction of traded value, paid on both sides.
+
+    Input
+    =====
+    panel: dict
+        as returned by build_signal_panel()
+
+    Output
+    ======
+    Return: tuple of DataFrame
+        equity: indexed by 'date', with 'cash', 'holdings', 'equity' and
+            'positions'
+        trades: one row per trade, with 'code', 'buy_date', 'sell_date',
+            'buy_price', 'sell_price', 'shares', 'profit', 'pnl' and
+            'sell_reason'. Positions still open at the end have sell_reason
+            CONST_SELL_REASON_NONE, and are valued at the last close.
+
+    Example
+    =======
+    >>> panel = build_signal_panel(all_data_and_features)
+    >>> equity, trades = run_backtest(panel, max_positions=20)
+    >>> equity['equity'].plot()
+    '''
+    close = panel['close']
+    atr = panel['atr']
+    nbar_low = panel['nbar_low']
+    buy = panel['buy']
+    rank = panel['rank']
+    n_days, n_stocks = close.shape
+
+    cash = float(initial_cash)
+    shares = np.zeros(n_stocks)
+    buy_prices = np.zeros(n_stocks)
+    stop_prices = np.zeros(n_stocks)
+    buy_rows = np.zeros(n_stocks, dtype=np.int64)
+    last_close = np.full(n_stocks, np.nan)
+
+    equity = np.zeros((n_days, 4))
+    trades = {'stock': [], 'buy_row': [], 'sell_row': [], 'buy_price': [], 'sell_price': [],
+              'shares': [], 'sell_reason': []}
+
+    def close_positions(stocks, row, sell_price, sell_reason):
+        trades['stock'].append(stocks)
+        trades['buy_row'].append(buy_rows[stocks])
+        trades['sell_row'].append(np.full(stocks.shape[0], row))
+        trades['buy_price'].append(buy_prices[stocks])
+        trades['sell_price'].append(sell_price)
+        trades['shares'].append(shares[stocks])
+        trades['sell_reason'].append(np.full(stocks.shape[0], sell_reason, dtype=np.int8))
+
+    for row in range(n_days):
+        today = close[row]
+        traded = ~np.isnan(today)
+        last_close[traded] = today[traded]
+        held = shares > 0
+
+        # a) exits
+        with np.errstate(invalid='ignore'):
+            stop_hit = held & traded & (today <= stop_prices)
+            n_low_hit = held & traded & ~stop_hit & (today <= nbar_low[row])
+        for hit, sell_reason in [(stop_hit, sb.CONST_SELL_REASON_STOP_LOSS),
+                                 (n_low_hit, sb.CONST_SELL_REASON_N_LOW)]:
+            stocks = np.flatnonzero(hit)
+            if stocks.shape[0] == 0:
+                continue
+            cash += np.sum(shares[stocks] * today[stocks]) * (1 - commission)
+            close_positions(stocks, row, today[stocks], sell_reason)
+            shares[stocks] = 0
+        sold = stop_hit | n_low_hit
+
+        # b) entries, by rank
+        slots = max_positions - np.count_nonzero(shares)
+        with np.errstate(invalid='ignore'):
+            candidates = np.flatnonzero(buy[row] & ~held & ~sold & traded & (atr[row] > 0))
+        if slots > 0 and candidates.shape[0] > 0:
+            candidates = candidates[np.argsort(-rank[row, candidates], kind='mergesort')]
+
+            # c) sizing
+            holdings = np.nansum(shares * last_close)
+            total = cash + holdings
+            price = today[candidates]
+            risk_shares = total * risk_per_trade / (atr[row, candidates] * multi_atr)
+            weight_shares = total * max_position_weight / price
+            lots = np.floor(np.minimum(risk_shares, weight_shares) / lot_size) * lot_size
+            cost = lots * price * (1 + commission)
+
+            # greedy in rank order: skip what the remaining cash cannot pay
+            affordable = np.zeros(candidates.shape[0], dtype=bool)
+            budget = cash
+            for i in np.flatnonzero(lots > 0):
+                if cost[i] <= budget:
+                    affordable[i] = True
+                    budget -= cost[i]
+                    slots -= 1
+                    if slots == 0:
+                        break
+            candidates = candidates[affordable]
+
+            cash -= np.sum(cost[affordable])
+            shares[candidates] = lots[affordable]
+            buy_prices[candidates] = price[affordable]
+            stop_prices[candidates] = price[affordable] - atr[row, candidates] * multi_atr
+            buy_rows[candidates] = row
+
+        # d) valuation
+        holdings = np.nansum(shares * last_close)
+        equity[row] = [cash, holdings, cash + holdings, np.count_nonzero(shares)]
+
+    still_open = np.flatnonzero(shares > 0)
+    if still_open.shape[0] > 0:
+        close_positions(still_open, n_days - 1, last_close[still_open], sb.CONST_SELL_REASON_NONE)
+
+    dates = days_to_dates(panel['days']).astype(object)
+    equity = pd.DataFrame(equity, columns=['cash', 'holdings', 'equity', 'positions'],
+                          index=pd.Index(dates, name='date'))
+    equity['positions'] = equity['positions'].astype(np.int64)
+
+    trades = {key: np.concatenate(values) if values else np.zeros(0) for key, values in trades.items()}
+    stocks = trades['stock'].astype(np.int64)
+    trades = pd.DataFrame({'code': np.asarray(panel['codes'], dtype=object)[stocks],
+                           'buy_date': dates[trades['buy_row'].astype(np.int64)],
+                           'sell_date': dates[trades['sell_row'].astype(np.int64)],
+                           'buy_price': trades['buy_price'],
+                           'sell_price': trades['sell_price'],
+                           'shares': trades['shares'],
+                           'profit': trades['sell_price'] / trades['buy_price'] - 1,
+                           'pnl': (trades['shares'] * trades['sell_price'] * (1 - commission) -
+                                   trades['shares'] * trades['buy_price'] * (1 + commission)),
+                           'sell_reason': trades['sell_reason'].astype(np.int8)},
+                          columns=['code', 'buy_date', 'sell_date', 'buy_price', 'sell_price',
+                                   'shares', 'profit', 'pnl', 'sell_reason'])
+    trades = trades.sort_values(['buy_date', 'code'], kind='mergesort').reset_index(drop=True)
+
+    return equity, trades
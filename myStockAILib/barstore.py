@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+'''
+Local on-disk bar store.
+
+Bars are kept per stock code, one binary file per column, under
+<root>/<code>/. Reads are memory-mapped, so any date range of a stock is a
+zero copy slice, and daily updates only append to the end of each file.
+'''
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from stockdates import dates_to_days, days_to_dates, days_to_mpl_dates
+
+
+# columns of the store, and their dtype on disk. 'date' is days since 1970-01-01
+CONST_BAR_COLUMNS = [('date', np.int32),
+                     ('open', np.float64),
+                     ('close', np.float64),
+                     ('high', np.float64),
+                     ('low', np.float64),
+                     ('volume', np.float64)]
+
+CONST_META_FILE = 'meta.json'
+
+
+#
+# BarStore
+#
+
+
+class BarStore(object):
+    ''' Memory-mapped, append-only columnar store of daily bars
+
+    Explain
+    =======
+    Layout on disk:
+        <root>/<code>/meta.json      {"rows": n}
+        <root>/<code>/<column>.bin   n raw values of the column's dtype
+    'rows' is written last on every append, so a half written append is
+    ignored, and overwritten by the next one.
+
+    on_append is a list of functions of a stock code, called after bars
+    were appended to that stock, eg. IndicatorCache.invalidate.
+
+    Example
+    =======
+    >>> store = BarStore('data/bars')
+    >>> store.append('000001', ts.get_k_data('000001', start='2010-01-01'))
+    >>> all_data = store.load_frame(start='2015-01-01')  # same layout as fetch_raw_data()
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        self.on_append = []
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def _path(self, code, name):
+        return os.path.join(self.root, code, name)
+
+    def codes(self):
+        ''' Return sorted list of stored stock codes
+        '''
+        return sorted(code for code in os.listdir(self.root)
+                      if os.path.isfile(self._path(code, CONST_META_FILE)))
+
+    def rows(self, code):
+        ''' Return number of stored bars of a stock, 0 if unknown
+        '''
+        try:
+            with open(self._path(code, CONST_META_FILE)) as f:
+                return json.load(f)['rows']
+        except (IOError, OSError):
+            return 0
+
+    def last_date(self, code):
+        ''' Return the last stored date of a stock as 'YYYY-MM-DD', or None
+        '''
+        rows = self.rows(code)
+        if rows == 0:
+            return None
+        return str(days_to_dates(self.read(code)['date'][-1:])[0])
+
+    def append(self, code, bars):
+        ''' Append new bars of one stock
+
+        Input
+        =====
+        code: str
+            stock code
+        bars: DataFrame
+            with 'date' as column or index ('YYYY-MM-DD'), and 'open',
+            'close', 'high', 'low', 'volume'. Bars on or before the last
+            stored date are ignored.
+
+        Output
+        ======
+        Return: int
+            number of bars appended
+        '''
+        if 'date' in bars.columns:
+            dates = bars['date'].values
+        else:
+            dates = bars.index.get_level_values(-1).values
+        days = dates_to_days(dates)
+
+        order = np.argsort(days, kind='mergesort')
+        rows = self.rows(code)
+        if rows > 0:
+            last_day = int(self.read(code)['date'][-1])
+            order = order[days[order] > last_day]
+        if order.shape[0] == 0:
+            return 0
+
+        stock_dir = os.path.join(self.root, code)
+        if not os.path.isdir(stock_dir):
+            os.makedirs(stock_dir)
+
+        for col, dtype in CONST_BAR_COLUMNS:
+            values = days if col == 'date' else bars[col].values
+            values = np.ascontiguousarray(values[order], dtype=dtype)
+            with open(self._path(code, col + '.bin'), 'ab') as f:
+                # drop what a failed append may have left after 'rows'
+                f.truncate(rows * np.dtype(dtype).itemsize)
+                f.write(values.tobytes())
+
+        self._write_meta(code, rows + order.shape[0])
+        for callback in self.on_append:
+            callback(code)
+
+        return order.shape[0]
+
+    def _write_meta(self, code, rows):
+        tmp_path = self._path(code, CONST_META_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'rows': rows}, f)
+        os.replace(tmp_path, self._path(code, CONST_META_FILE))
+
+    def read(self, code, start = None, end = None, mmap = True):
+        ''' Read bars of one stock, as column arrays
+
+        Input
+        =====
+        code: str
+            stock code
+        start, end: str, optional
+            first and last date, 'YYYY-MM-DD', both inclusive
+        mmap: bool
+            True to return read-only memory-mapped arrays (no copy), False
+            to read the range into plain arrays (faster for many stocks,
+            when a copy is needed anyway)
+
+        Output
+        ======
+        Return: dict
+            column name to numpy array
+        '''
+        rows = self.rows(code)
+        if rows == 0:
+            return {col: np.zeros(0, dtype=dtype) for col, dtype in CONST_BAR_COLUMNS}
+
+        if mmap:
+            days = np.memmap(self._path(code, 'date.bin'), dtype=np.int32, mode='r', shape=(rows,))
+        else:
+            days = np.fromfile(self._path(code, 'date.bin'), dtype=np.int32, count=rows)
+
+        first, last = 0, rows
+        if start is not None:
+            first = int(np.searchsorted(days, dates_to_days([start])[0], side='left'))
+        if end is not None:
+            last = int(np.searchsorted(days, dates_to_days([end])[0], side='right'))
+
+        columns = {'date': days[first:last]}
+        for col, dtype in CONST_BAR_COLUMNS[1:]:
+            path = self._path(code, col + '.bin')
+            if mmap:
+                columns[col] = np.memmap(path, dtype=dtype, mode='r', shape=(rows,))[first:last]
+            else:
+                with open(path, 'rb') as f:
+                    f.seek(first * np.dtype(dtype).itemsize)
+                    columns[col] = np.fromfile(f, dtype=dtype, count=last - first)
+
+        return columns
+
+    def write_frame(self, all_data):
+        ''' Append a MultiIndex'ed ('code', 'date') frame, such as fetch_raw_data()
+            output or the notebook's hs300 CSV, stock by stock
+        '''
+        for code, stock_data in all_data.groupby(level=0):
+            self.append(code, stock_data)
+
+    def load_frame(self, codes = None, start = None, end = None, mpl_date = True, compact = False):
+        ''' Load bars of many stocks, in fetch_raw_data() layout
+
+        Input
+        =====
+        codes: list of str, optional
+            stock codes, default all stored codes
+        start, end: str, optional
+            first and last date, 'YYYY-MM-DD', both inclusive
+        mpl_date: bool
+            add the 'mpl.date' column, like fetch_raw_data()
+        compact: bool
+            build the frame in dataprep's compact schema: float32 prices and
+            volume, categorical 'code', int day numbers as 'date' level, and
+            no 'mpl.date'
+
+        Output
+        ======
+        Return: MultiIndex DataFrame
+            indexed by 'code' and 'date', with columns 'open', 'close',
+            'high', 'low', 'volume', 'code' and 'mpl.date'
+        '''
+        if codes is None:
+            codes = self.codes()
+
+        parts = [self.read(code, start, end, mmap=False) for code in codes]
+        lengths = np.array([part['date'].shape[0] for part in parts], dtype=np.int64)
+
+        data = {}
+        for col, dtype in CONST_BAR_COLUMNS:
+            if parts:
+                data[col] = np.concatenate([part[col] for part in parts])
+            else:
+                data[col] = np.zeros(0, dtype=dtype)
+
+        # build the index from its levels, so only unique dates become strings
+        code_level = np.asarray(codes, dtype=object)
+        stock_codes = np.repeat(np.arange(len(codes)), lengths)
+        day_level, day_codes = np.unique(data['date'], return_inverse=True)
+        index = pd.MultiIndex(levels=[code_level, day_level if compact else days_to_dates(day_level).astype(object)],
+                              codes=[stock_codes, day_codes.ravel()],
+                              names=['code', 'date'],
+                              verify_integrity=False)
+
+        if compact:
+            code_values = pd.Categorical.from_codes(stock_codes, categories=code_level)
+        else:
+            code_values = np.repeat(code_level, lengths)
+        value_dtype = np.float32 if compact else np.float64
+
+        all_data = pd.DataFrame({'open': data['open'].astype(value_dtype, copy=False),
+                                 'close': data['close'].astype(value_dtype, copy=False),
+                                 'high': data['high'].astype(value_dtype, copy=False),
+                                 'low': data['low'].astype(value_dtype, copy=False),
+                                 'volume': data['volume'].astype(value_dtype, copy=False),
+                                 'code': code_values},
+                                index=index,
+                                columns=['open', 'close', 'high', 'low', 'volume', 'code'])
+        if mpl_date and not compact:
+            all_data['mpl.date'] = days_to_mpl_dates(data['date'])
+
+        return all_data
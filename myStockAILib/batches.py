@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+'''
+Streaming mini-batches of normalized sample windows, for model training.
+
+Batches are cut on the fly from a dataprep.SampleSet: only the windows of
+the batch being built are materialized and normalized, so training memory
+depends on the batch size, not on the number of samples.
+
+    >>> samples = dp.build_sample_set(all_data_and_features, lookback=60)
+    >>> labels = dp.label_samples(samples)['label'].values
+    >>> train_ids, val_ids = split_by_date(samples, '2016-01-01')
+    >>> train = BatchGenerator(samples, labels, train_ids, batch_size=32, balance=True)
+    >>> val = BatchGenerator(samples, labels, val_ids, batch_size=256, shuffle=False)
+    >>> model.fit_generator(train.flow(), steps_per_epoch=len(train), epochs=10,
+    ...                     validation_data=val.flow(), validation_steps=len(val))
+'''
+
+import queue
+import threading
+
+import numpy as np
+
+import dataprep as dp
+from stockdates import dates_to_days
+
+
+#
+# split_by_date
+#
+
+
+def sample_days(samples, column = 'buy_location'):
+    ''' Function to get the day number of a location column of every sample
+
+    Input
+    =====
+    samples: dataprep.SampleSet
+    column: str
+        'buy_location' or 'sell_location'
+
+    Output
+    ======
+    Return: numpy.ndarray of int32
+        day number (days since 1970-01-01), one per sample
+    '''
+    if len(samples.dates) == 0:
+        return np.zeros(0, dtype=np.int32)
+    lengths = np.array([days.shape[0] for days in samples.dates], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    days = np.concatenate(samples.dates)
+    rows = starts[samples.index['stock'].values.astype(np.int64)] + samples.index[column].values.astype(np.int64)
+    return days[rows]
+
+
+def split_by_date(samples, split_date, purge = True):
+    ''' Function to split samples into train and validation, by buy date
+
+    Explain
+    =======
+    Samples bought before split_date are for training, the others for
+    validation. With purge, a training sample whose trade is still open on
+    split_date is dropped, so no training label depends on bars of the
+    validation period.
+
+    Input
+    =====
+    samples: dataprep.SampleSet
+    split_date: str, or int day number
+        first day of the validation period, 'YYYY-MM-DD'
+    purge: bool
+        drop training samples sold on or after split_date
+
+    Output
+    ======
+    train_ids: numpy.ndarray of int
+        sample numbers for training
+    validation_ids: numpy.ndarray of int
+        sample numbers for validation
+    '''
+    split_day = dates_to_days([split_date])[0]
+    buy_days = sample_days(samples, 'buy_location')
+    validation = buy_days >= split_day
+    train = ~validation
+    if purge:
+        train &= sample_days(samples, 'sell_location') < split_day
+    return np.flatnonzero(train), np.flatnonzero(validation)
+
+
+#
+# BatchGenerator
+#
+
+
+class BatchGenerator(object):
+    ''' Shuffled mini-batches of normalized windows and labels of a SampleSet
+
+    Explain
+    =======
+    Each epoch draws its own sample order from (seed, epoch), so epochs are
+    reproducible. Before shuffling, the samples of an epoch are thinned:
+        a) one_out_of keeps one sample in every one_out_of, as
+           CONST_ONE_OUT_OF_NUMBER does in the notebook,
+        b) balance keeps, for each label, as many samples as the rarest
+           label has, drawn anew every epoch, so all samples are seen over
+           the epochs.
+    X of a batch is dataprep.normalize_samples() of its windows.
+
+    With prefetch > 0, iterating builds the next batches in a background
+    thread while the caller trains on the current one.
+
+    Also usable as a keras.utils.Sequence: len(), [i] and on_epoch_end().
+
+    Input
+    =====
+    samples: dataprep.SampleSet
+    labels: array-like
+        one label per sample of samples, eg. label_samples(samples)['label']
+    sample_ids: array of int, optional
+        sample numbers to draw from, eg. from split_by_date(). Default all.
+    batch_size: int
+        number of samples per batch. The last batch of an epoch may be
+        smaller.
+    shuffle: bool
+        shuffle the samples of each epoch
+    balance: bool
+        draw the same number of samples of each label, see Explain
+    one_out_of: int
+        keep one sample in every one_out_of, see Explain
+    groups: list of tuple
+        normalization groups, see dataprep.CONST_NORMALIZE_GROUPS
+    dtype: numpy dtype
+        dtype of X
+    prefetch: int
+        number of batches built ahead, 0 to build them on demand
+    seed: int, optional
+        seed of the epoch orders
+    '''
+
+    def __init__(self, samples, labels, sample_ids = None, batch_size = 32, shuffle = True, balance = False,
+                 one_out_of = 1, groups = dp.CONST_NORMALIZE_GROUPS, dtype = np.float32, prefetch = 2,
+                 seed = None):
+        self.samples = samples
+        self.labels = np.asarray(labels)
+        if self.labels.shape[0] != len(samples):
+            raise ValueError('labels has %d elements, SampleSet has %d samples' % (self.labels.shape[0], len(samples)))
+        if sample_ids is None:
+            sample_ids = np.arange(len(samples))
+        self.sample_ids = np.asarray(sample_ids, dtype=np.int64)[::one_out_of]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.balance = balance
+        self.groups = groups
+        self.dtype = dtype
+        self.prefetch = prefetch
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().entropy % (1 << 32))
+        self.epoch = 0
+        self._epoch_ids = {}
+
+        if balance:
+            classes, counts = np.unique(self.labels[self.sample_ids], return_counts=True)
+            self._classes = classes
+            self._epoch_size = int(counts.min()) * classes.shape[0] if classes.size else 0
+        else:
+            self._epoch_size = self.sample_ids.shape[0]
+
+    def __len__(self):
+        return (self._epoch_size + self.batch_size - 1) // self.batch_size
+
+    def epoch_ids(self, epoch = None):
+        ''' Return the sample numbers of an epoch, in batch order. Default
+            the current epoch.
+        '''
+        if epoch is None:
+            epoch = self.epoch
+        if epoch not in self._epoch_ids:
+            rng = np.random.default_rng([self.seed, epoch])
+            ids = self.sample_ids
+            if self.balance:
+                labels = self.labels[ids]
+                n_per_class = self._epoch_size // max(self._classes.shape[0], 1)
+                ids = np.concatenate([rng.choice(ids[labels == label], n_per_class, replace=False)
+                                      for label in self._classes]) if self._classes.size else ids
+                if not self.shuffle:
+                    ids = np.sort(ids)
+            if self.shuffle:
+                ids = rng.permutation(ids)
+            # only the current epoch is kept
+            self._epoch_ids = {epoch: ids}
+        return self._epoch_ids[epoch]
+
+    def batch(self, ids):
+        ''' Return (X, y) of sample numbers ids
+
+        Output
+        ======
+        X: numpy.ndarray
+            in shape (len(ids), lookback, n_columns), see
+            dataprep.normalize_samples()
+        y: numpy.ndarray
+            labels of ids
+        '''
+        windows = self.samples.to_tensor(ids, dtype=np.float64)
+        X = dp.normalize_samples(windows, feature_columns=self.samples.feature_columns, groups=self.groups,
+                                 dtype=self.dtype)
+        return X, self.labels[ids]
+
+    def __getitem__(self, index):
+        ids = self.epoch_ids()
+        return self.batch(ids[(index * self.batch_size):((index + 1) * self.batch_size)])
+
+    def on_epoch_end(self):
+        self.epoch += 1
+
+    def __iter__(self):
+        ''' Yield the batches of the current epoch, then move to the next epoch
+        '''
+        ids = self.epoch_ids()
+        batches = [ids[first:(first + self.batch_size)] for first in range(0, ids.shape[0], self.batch_size)]
+        for batch in _prefetched(self.batch, batches, self.prefetch):
+            yield batch
+        self.on_epoch_end()
+
+    def flow(self):
+        ''' Yield batches endlessly, epoch after epoch, as keras fit_generator() expects
+        '''
+        while True:
+            if len(self) == 0:
+                return
+            for batch in self:
+                yield batch
+
+
+def _prefetched(build, batches, prefetch):
+    ''' Yield build(ids) for each ids of batches, built up to prefetch ahead
+        in a background thread
+    '''
+    if prefetch <= 0:
+        for ids in batches:
+            yield build(ids)
+        return
+
+    done = object()
+    results = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def produce():
+        try:
+            for ids in batches:
+                if stop.is_set():
+                    return
+                put((build(ids), None))
+        except BaseException as error:
+            put((None, error))
+            return
+        put((done, None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            batch, error = results.get()
+            if error is not None:
+                raise error
+            if batch is done:
+                return
+            yield batch
+    finally:
+        # the consumer may stop early: let the producer quit
+        stop.set()
+        producer.join()
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+'''
+Reproducible benchmarks of stockbasic and dataprep.
+
+Every run works on a deterministic synthetic market, so timings of two
+runs (or two commits) are comparable. Results are written as JSON, and can
+be compared against a stored baseline.
+
+Usage
+=====
+    python benchmark.py --sizes 10,300 --out bench.json
+    python benchmark.py --sizes 10,300 --out new.json --baseline bench.json
+'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import stockbasic as sb
+import dataprep as dp
+from stockdates import dates_to_days, days_to_mpl_dates
+
+
+CONST_BENCHMARK_SIZES = [10, 300, 3000]
+
+CONST_BENCHMARK_BARS = 1500
+
+# relative slowdown, over the baseline, reported as a regression
+CONST_REGRESSION_TOLERANCE = 0.1
+
+# seconds a cold 'import dataprep' may take
+CONST_IMPORT_BUDGET = 1.0
+
+# modules the compute core must not import
+CONST_IMPORT_LAZY_MODULES = ['tushare', 'seaborn', 'matplotlib']
+
+
+#
+# synthetic_market
+#
+
+
+def synthetic_market(n_stocks, n_bars = CONST_BENCHMARK_BARS, seed = 0, start_date = '2010-01-04'):
+    ''' Function to generate a deterministic synthetic market
+
+    Explain
+    =======
+    Each stock is a random walk of log returns, whose volatility switches
+    between calm and busy regimes, so squeezes and breakouts do happen.
+    Stock i only depends on seed + i, so the first 10 stocks of a 300 stocks
+    market are the 10 stocks market.
+
+    Input
+    =====
+    n_stocks: int
+        number of stocks, coded '000000', '000001', ...
+    n_bars: int
+        number of bars per stock, on business days from start_date
+    seed: int
+        random seed
+
+    Output
+    ======
+    Return: MultiIndex DataFrame
+        in fetch_raw_data() layout: indexed by 'code' and 'date', with
+        'open', 'close', 'high', 'low', 'volume', 'code' and 'mpl.date'
+
+    Example
+    =======
+    >>> all_data = synthetic_market(300)
+    >>> all_data_and_features = dp.build_features(all_data)
+    '''
+    dates = pd.bdate_range(start_date, periods=n_bars).strftime('%Y-%m-%d').values.astype(object)
+    mpl_dates = days_to_mpl_dates(dates_to_days(dates))
+
+    columns = {col: np.zeros((n_stocks, n_bars)) for col in ['open', 'close', 'high', 'low', 'volume']}
+    for i in range(n_stocks):
+        rng = np.random.RandomState(seed + i)
+        busy = np.cumsum(rng.rand(n_bars) < 0.02) % 2 == 1
+        sigma = np.where(busy, 0.03, 0.012)
+        close = rng.uniform(5, 50) * np.exp(np.cumsum(rng.normal(0.0003, 1, n_bars) * sigma))
+        gap = 1 + rng.normal(0, 0.3, n_bars) * sigma
+        open_ = np.empty(n_bars)
+        open_[0] = close[0] * gap[0]
+        open_[1:] = close[:-1] * gap[1:]
+        columns['open'][i] = open_
+        columns['close'][i] = close
+        columns['high'][i] = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.5, n_bars)) * sigma)
+        columns['low'][i] = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.5, n_bars)) * sigma)
+        columns['volume'][i] = np.round(rng.lognormal(13, 0.5, n_bars) * (1 + busy))
+
+    codes = np.array(['%06d' % i for i in range(n_stocks)], dtype=object)
+    index = pd.MultiIndex(levels=[codes, dates],
+                          codes=[np.repeat(np.arange(n_stocks), n_bars), np.tile(np.arange(n_bars), n_stocks)],
+                          names=['code', 'date'],
+                          verify_integrity=False)
+
+    all_data = pd.DataFrame({col: values.ravel() for col, values in columns.items()},
+                            index=index,
+                            columns=['open', 'close', 'high', 'low', 'volume'])
+    all_data['code'] = np.repeat(codes, n_bars)
+    all_data['mpl.date'] = np.tile(mpl_dates, n_stocks)
+
+    return all_data
+
+
+#
+# benchmarks
+#
+
+
+def _per_stock(function):
+    ''' Benchmark of an indicator function, called on every stock
+    '''
+    def run(context):
+        for _, stock_data in context['all_data'].groupby(level=0):
+            function(stock_data)
+    return run
+
+
+def _features(context):
+    if 'features' not in context:
+        context['features'] = dp.build_features(context['all_data'], drop_threshold=0)
+    return context['features']
+
+
+def _samples(context):
+    if 'samples' not in context:
+        context['samples'] = dp.build_sample_set(_features(context))
+    return context['samples']
+
+
+def _bench_build_features(context):
+    dp.build_features(context['all_data'], drop_threshold=0)
+
+
+def _bench_generate_samples(context):
+    for _, stock_data in _features(context).groupby(level=0):
+        dp.generate_samples(stock_data)
+
+
+def _bench_build_sample_set(context):
+    dp.build_sample_set(_features(context))
+
+
+def _bench_normalize_samples(context):
+    dp.normalize_samples(_samples(context))
+
+
+def _bench_plot_stock_data(context):
+    # one stock, the last 250 bars: the cost does not depend on the market size
+    features = _features(context)
+    code = features.index.levels[0][0]
+    dp.plot_stock_data(features.loc[[code]].iloc[-250:])
+
+    import matplotlib.pyplot as plt
+    plt.close('all')
+
+
+# name to function(context). context holds 'all_data', and what earlier
+# benchmarks cached, so setup work is not timed twice.
+CONST_BENCHMARKS = [('ttm_propulsion', _per_stock(sb.ttm_propulsion)),
+                    ('ttm_squeeze', _per_stock(sb.ttm_squeeze)),
+                    ('ttm_wave', _per_stock(sb.ttm_wave)),
+                    ('talib_adx', _per_stock(sb.talib_adx)),
+                    ('talib_atr', _per_stock(sb.talib_atr)),
+                    ('talib_nbarlow', _per_stock(sb.talib_nbarlow)),
+                    ('stock_features', _per_stock(sb.stock_features)),
+                    ('build_features', _bench_build_features),
+                    ('generate_samples', _bench_generate_samples),
+                    ('build_sample_set', _bench_build_sample_set),
+                    ('normalize_samples', _bench_normalize_samples),
+                    ('plot_stock_data', _bench_plot_stock_data)]
+
+
+#
+# measure_import_time
+#
+
+
+def measure_import_time(module = 'dataprep', repeat = 5, budget = CONST_IMPORT_BUDGET):
+    ''' Function to measure the cold import time of a module
+
+    Explain
+    =======
+    Each import runs in a fresh interpreter, and the best of repeat runs is
+    kept. Also lists which of CONST_IMPORT_LAZY_MODULES the import loaded.
+
+    Output
+    ======
+    Return: dict
+        'name': 'import_' + module, 'seconds', 'budget', 'over_budget' and
+        'lazy_modules_loaded'
+    '''
+    code = ('import sys, time, json\n'
+            't = time.perf_counter()\n'
+            'import %s\n'
+            'seconds = time.perf_counter() - t\n'
+            'loaded = [m for m in %r if m in sys.modules]\n'
+            'print(json.dumps([seconds, loaded]))\n') % (module, CONST_IMPORT_LAZY_MODULES)
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=here)
+        seconds, loaded = json.loads(output.decode().strip().splitlines()[-1])
+        times.append(seconds)
+
+    return {'name': 'import_' + module,
+            'seconds': min(times),
+            'budget': budget,
+            'over_budget': min(times) > budget,
+            'lazy_modules_loaded': loaded}
+
+
+#
+# run_benchmarks
+#
+
+
+def run_benchmarks(sizes = CONST_BENCHMARK_SIZES, n_bars = CONST_BENCHMARK_BARS, names = None,
+                   repeat = 3, memory = True, seed = 0):
+    ''' Function to time and memory-profile the benchmarks, at several market sizes
+
+    Explain
+    =======
+    Each benchmark runs repeat times, and the best time is kept. Then it runs
+    once more under tracemalloc, for its peak of traced memory, unless
+    memory is False. tracemalloc only sees this process, so the peak of
+    build_features() excludes its worker processes. A failing benchmark is
+    recorded with its error, and the others still run.
+
+    Input
+    =====
+    sizes: list of int
+        numbers of stocks
+    n_bars: int
+        number of bars per stock
+    names: list of str, optional
+        benchmarks to run, default all CONST_BENCHMARKS
+    repeat: int
+        number of timed runs
+    memory: bool
+        measure peak memory
+    seed: int
+        seed of synthetic_market()
+
+    Output
+    ======
+    Return: dict
+        'meta': versions, platform and parameters of the run
+        'import': measure_import_time() of dataprep
+        'results': list of dict, with 'name', 'stocks', 'bars', 'seconds',
+            'peak_mb' and 'error' (None on success)
+    '''
+    import_time = measure_import_time()
+    print('%-20s %s  %9.4f s  (budget %.1f s)%s' % (import_time['name'], ' ' * 13, import_time['seconds'],
+                                                    import_time['budget'],
+                                                    '  OVER BUDGET' if import_time['over_budget'] else ''))
+
+    benchmarks = [(name, function) for name, function in CONST_BENCHMARKS
+                  if names is None or name in names]
+
+    results = []
+    for n_stocks in sizes:
+        context = {'all_data': synthetic_market(n_stocks, n_bars, seed)}
+        for name, function in benchmarks:
+            result = {'name': name, 'stocks': n_stocks, 'bars': n_bars,
+                      'seconds': None, 'peak_mb': None, 'error': None}
+            try:
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    function(context)
+                    times.append(time.perf_counter() - start)
+                result['seconds'] = min(times)
+
+                if memory:
+                    tracemalloc.start()
+                    try:
+                        function(context)
+                        result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2.**20
+                    finally:
+                        tracemalloc.stop()
+            except Exception as e:
+                result['error'] = repr(e)
+            results.append(result)
+            print('%-20s %6d stocks  %s' % (name, n_stocks, _format_result(result)))
+
+    meta = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'sizes': list(sizes),
+            'bars': n_bars,
+            'repeat': repeat,
+            'seed': seed}
+
+    return {'meta': meta, 'import': import_time, 'results': results}
+
+
+def _format_result(result):
+    if result['error'] is not None:
+        return 'ERROR ' + result['error']
+    text = '%9.4f s' % result['seconds']
+    if result['peak_mb'] is not None:
+        text += '  %9.1f MB' % result['peak_mb']
+    return text
+
+
+#
+# compare_results
+#
+
+
+def compare_results(results, baseline, tolerance = CONST_REGRESSION_TOLERANCE):
+    ''' Function to compare a benchmark run against a baseline run
+
+    Input
+    =====
+    results, baseline: dict
+        as returned by run_benchmarks(), or loaded from its JSON
+    tolerance: float
+        relative slowdown above which a benchmark is a regression
+
+    Output
+    ======
+    Return: DataFrame
+        one row per benchmark and size found in both runs, with
+        'name', 'stocks', 'seconds', 'baseline_seconds', 'ratio',
+        'peak_mb', 'baseline_peak_mb' and 'regression'
+    '''
+    base = {(r['name'], r['stocks']): r for r in baseline['results'] if r['error'] is None}
+    rows = []
+    for r in results['results']:
+        b = base.get((r['name'], r['stocks']))
+        if b is None or r['error'] is not None:
+            continue
+        ratio = r['seconds'] / b['seconds'] if b['seconds'] else np.nan
+        rows.append({'name': r['name'],
+                     'stocks': r['stocks'],
+                     'seconds': r['seconds'],
+                     'baseline_seconds': b['seconds'],
+                     'ratio': ratio,
+                     'peak_mb': r['peak_mb'],
+                     'baseline_peak_mb': b['peak_mb'],
+                     'regression': ratio > 1 + tolerance})
+
+    return pd.DataFrame(rows, columns=['name', 'stocks', 'seconds', 'baseline_seconds', 'ratio',
+                                       'peak_mb', 'baseline_peak_mb', 'regression'])
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Benchmark stockbasic and dataprep on a synthetic market')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in CONST_BENCHMARK_SIZES),
+                        help='comma separated numbers of stocks')
+    parser.add_argument('--bars', type=int, default=CONST_BENCHMARK_BARS, help='bars per stock')
+    parser.add_argument('--only', default=None, help='comma separated benchmark names')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark')
+    parser.add_argument('--no-memory', action='store_true', help='skip memory profiling')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='benchmark.json', help='JSON file for the results')
+    parser.add_argument('--baseline', default=None, help='JSON file of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=CONST_REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    # no display needed for plot_stock_data(); importers keep their own backend
+    import matplotlib
+    matplotlib.use('Agg')
+
+    results = run_benchmarks(sizes=[int(size) for size in args.sizes.split(',')],
+                             n_bars=args.bars,
+                             names=args.only.split(',') if args.only else None,
+                             repeat=args.repeat,
+                             memory=not args.no_memory,
+                             seed=args.seed)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    status = 1 if results['import']['over_budget'] or results['import']['lazy_modules_loaded'] else 0
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare_results(results, baseline, args.tolerance)
+        print(comparison.to_string(index=False))
+        if comparison['regression'].any():
+            status = 1
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
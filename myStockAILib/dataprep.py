@@ -6,21 +6,20 @@ Created on Wed Nov 22 16:21:36 2017
 """
 
 import pandas as pd
-import tushare as ts
 import stockbasic as sb
-from matplotlib.pylab import date2num
-import datetime
+import instrument
+from stockdates import dates_to_days, days_to_dates, days_to_mpl_dates, index_days, date_locations
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
-import tushare as ts
-import seaborn as sns
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-import matplotlib.finance as mpf
+from numpy.lib.stride_tricks import as_strided
 
-# Matplotlib 显示中文
-mpl.rcParams['font.sans-serif'] = ['SimHei']  #指定默认字体
-mpl.rcParams['axes.unicode_minus'] = False  #解决保存图像是负号'-'显示为方块的问题
+# tushare and matplotlib are only imported on first use, by fetch_raw_data()
+# and plot_stock_data(), so the compute core imports fast and headless.
+
+# Matplotlib 显示中文, applied while plot_stock_data() draws
+CONST_PLOT_RC = {'font.sans-serif': ['SimHei'],  #指定默认字体
+                 'axes.unicode_minus': False}  #解决保存图像是负号'-'显示为方块的问题
 
 #
 # printProgressBar
@@ -71,6 +70,9 @@ def fetch_raw_data(stock_list, start_date, end_date):
     Return: MultiIndex DataFrame
         indexed by 'code' and 'date'
     
+    Progress is reported to the current instrument.Instrument, as stage
+    'fetch'. Use instrument.progress_bar() for a progress bar.
+
     Example
     =======
     >>> import tushare as ts
@@ -79,20 +81,18 @@ def fetch_raw_data(stock_list, start_date, end_date):
     >>> print(stock_list_test)
     >>> a = fetch_raw_data(stock_list_test, '2010-01-01', '2017-12-20')
     '''
-    all_data = pd.DataFrame()
-    total = stock_list.shape[0]
-    i = 0
-    
-    # Initial call to print 0% progress
-    printProgressBar(0, total, prefix = 'Progress:', suffix = 'Complete', length = 60)
+    import tushare as ts
+
+    all_frames = []
+    ins = instrument.current()
 
     # go through each stock in the stock_lists
     # iterate the list
     for index, row in stock_list.iterrows():
-        i += 1
-        
         # fetch K data of each code
-        onestock = ts.get_k_data(row['code'], start=start_date, end=end_date)
+        with ins.stage('fetch', code=row['code']) as timer:
+            onestock = ts.get_k_data(row['code'], start=start_date, end=end_date)
+            timer.items = onestock.shape[0]
         
         # convert 'date' to matplotlib number
         onestock['mpl.date'] = date_to_num(onestock['date'].values)
@@ -101,9 +101,10 @@ def fetch_raw_data(stock_list, start_date, end_date):
         onestock.set_index('date', inplace=True)
         # print('this is '+row['code'])
         # print(onestock.head())
-        # pack it into one DataFrame
-        all_data = all_data.append(onestock)
-        printProgressBar(i, total, prefix = 'Fetching Progress:', suffix = 'Complete', length = 60)
+        # collect it, and pack all into one DataFrame at the end
+        all_frames.append(onestock)
+
+    all_data = pd.concat(all_frames)
 
     # set multiIndex, by 'code', and by 'date'
     all_data.set_index([all_data['code'], all_data.index], drop=True, inplace=True)
@@ -114,6 +115,229 @@ def fetch_raw_data(stock_list, start_date, end_date):
 def test_sync():
     print('exits 2.0')
 
+
+#
+# compact_frame
+#
+
+# compact schema: float columns as float32, these columns as small ints,
+# 'code' as category, the 'date' index level as int day numbers (days since
+# 1970-01-01), and no 'mpl.date' (see stockdates.days_to_mpl_dates())
+CONST_COMPACT_FLOAT = np.float32
+CONST_COMPACT_INT_COLUMNS = {'SQUEEZE': np.int8}
+
+
+def compact_frame(data):
+    ''' Function to convert a frame to the compact schema
+
+    Explain
+    =======
+    Roughly halves the memory of a feature panel. Every function of the
+    pipeline, from build_features() to normalize_samples(), also takes and
+    produces compact frames; build_features(compact=True) and
+    barstore.BarStore.load_frame(compact=True) build them directly.
+
+    Input
+    =====
+    data: DataFrame
+        indexed by 'code' and 'date', or by 'date', such as
+        fetch_raw_data() or build_features() output
+
+    Output
+    ======
+    Return: DataFrame
+        same rows and columns, without 'mpl.date', in the compact schema.
+        See expand_frame() for the way back.
+    '''
+    data = data.drop(columns=['mpl.date'], errors='ignore')
+
+    dtypes = {}
+    for col, dtype in data.dtypes.items():
+        if col in CONST_COMPACT_INT_COLUMNS:
+            dtypes[col] = CONST_COMPACT_INT_COLUMNS[col]
+        elif col == 'code':
+            dtypes[col] = 'category'
+        elif pd.api.types.is_float_dtype(dtype):
+            dtypes[col] = CONST_COMPACT_FLOAT
+    data = data.astype(dtypes)
+
+    if isinstance(data.index, pd.MultiIndex):
+        data.index = data.index.set_levels(dates_to_days(data.index.levels[-1].values),
+                                           level=-1, verify_integrity=False)
+    else:
+        data.index = pd.Index(dates_to_days(data.index.values), name=data.index.name)
+
+    return data
+
+
+def expand_frame(data):
+    ''' Function to convert a compact frame back to the default schema
+
+    Explain
+    =======
+    Inverse of compact_frame(): float64 columns, int64 'SQUEEZE', object
+    'code', 'YYYY-MM-DD' dates, and 'mpl.date' added back. Values lost to
+    float32 rounding are not recovered.
+    '''
+    dtypes = {}
+    for col, dtype in data.dtypes.items():
+        if col in CONST_COMPACT_INT_COLUMNS:
+            dtypes[col] = np.int64
+        elif col == 'code':
+            dtypes[col] = object
+        elif pd.api.types.is_float_dtype(dtype):
+            dtypes[col] = np.float64
+    data = data.astype(dtypes)
+
+    days = index_days(data.index)
+    if isinstance(data.index, pd.MultiIndex):
+        data.index = data.index.set_levels(days_to_dates(dates_to_days(data.index.levels[-1].values)).astype(object),
+                                           level=-1, verify_integrity=False)
+    else:
+        data.index = pd.Index(days_to_dates(days).astype(object), name=data.index.name)
+    if 'mpl.date' not in data.columns:
+        data['mpl.date'] = days_to_mpl_dates(days)
+
+    return data
+
+
+#
+# build_features
+#
+
+# skip a stock, if it has less than CONST_DROP_THRESHOLD bars
+CONST_DROP_THRESHOLD = 1000
+
+
+def build_features(all_data, drop_threshold = CONST_DROP_THRESHOLD, n_workers = None, use_threads = False,
+                   chunk_size = 8, feature_set = sb.CONST_FEATURE_SET_ALL, compact = False, **feature_params):
+    ''' Function to calculate stockbasic features of all stocks, over a pool of workers
+
+    Explain
+    =======
+    Calculate stockbasic.stock_features() for every stock of a MultiIndex'ed
+    (code, date) panel, like the per-stock loop of the notebook, but with
+    stocks spread over a pool of processes (or threads).
+
+    'high', 'low' and 'close' of all kept stocks are copied once into a
+    shared memory block, and workers write their features into a second
+    shared memory block, so no DataFrame is pickled between processes. Each
+    task covers chunk_size stocks. Results are ordered by stock code, whatever
+    the order in which workers finish.
+
+    Input
+    =====
+    all_data: MultiIndex DataFrame
+        indexed by 'code' and 'date', as returned by fetch_raw_data()
+    drop_threshold: int
+        skip a stock, if it has less than drop_threshold bars
+    n_workers: int, optional
+        number of workers. Default os.cpu_count().
+    use_threads: bool
+        use a thread pool instead of a process pool
+    chunk_size: int
+        number of stocks per task
+    feature_set: list of str
+        feature groups, see stockbasic.stock_features()
+    compact: bool
+        return the panel in the compact schema, see compact_frame()
+    feature_params:
+        extra parameters for stockbasic.stock_features(), eg. N_BAR_LOWEST=10
+
+    Output
+    ======
+    Return: MultiIndex DataFrame
+        indexed by 'code' and 'date', with all columns of all_data, then the
+        features, for the stocks which are not dropped. Dropped stocks are
+        counted as 'skip.short_history' by the current instrument.Instrument.
+
+    Example
+    =======
+    >>> all_data_and_features = build_features(all_data, n_workers=4)
+    '''
+    from multiprocessing.shared_memory import SharedMemory
+
+    ins = instrument.current()
+
+    # rows of each stock, ordered by code
+    stock_rows = all_data.groupby(level=0, sort=True).indices
+    kept_rows = []
+    for code in sorted(stock_rows):
+        rows = stock_rows[code]
+        # skip if stock_data has less than drop_threshold bars
+        if rows.shape[0] < drop_threshold:
+            ins.count('skip.short_history')
+            continue
+        kept_rows.append(rows)
+
+    lengths = [rows.shape[0] for rows in kept_rows]
+    stops = np.cumsum(lengths, dtype=np.int64)
+    ranges = list(zip((stops - lengths).tolist(), stops.tolist()))
+    all_rows = np.concatenate(kept_rows) if kept_rows else np.zeros(0, dtype=np.int64)
+    n_rows = all_rows.shape[0]
+
+    columns = sb.feature_columns(feature_set, feature_params.get('N_BAR_LOWEST', 10))
+
+    shm_in = SharedMemory(create=True, size=max(3 * n_rows * 8, 1))
+    shm_out = SharedMemory(create=True, size=max(len(columns) * n_rows * 8, 1))
+    try:
+        inputs = np.ndarray((3, n_rows), dtype=np.float64, buffer=shm_in.buf)
+        for i, col in enumerate(['high', 'low', 'close']):
+            inputs[i] = all_data[col].values[all_rows]
+
+        tasks = [(shm_in.name, shm_out.name, n_rows, ranges[i:(i + chunk_size)], feature_set, feature_params)
+                 for i in range(0, len(ranges), chunk_size)]
+
+        if use_threads:
+            executor = ThreadPoolExecutor(max_workers=n_workers)
+        else:
+            executor = ProcessPoolExecutor(max_workers=n_workers)
+        with ins.stage('features', items=n_rows), executor:
+            list(executor.map(_build_features_worker, tasks))
+
+        outputs = np.ndarray((len(columns), n_rows), dtype=np.float64, buffer=shm_out.buf)
+        all_data_and_features = all_data.iloc[all_rows].copy()
+        if compact:
+            all_data_and_features = compact_frame(all_data_and_features)
+        for i, col in enumerate(columns):
+            if col == 'SQUEEZE':
+                all_data_and_features[col] = outputs[i].astype(CONST_COMPACT_INT_COLUMNS[col] if compact else np.int64)
+            else:
+                all_data_and_features[col] = outputs[i].astype(CONST_COMPACT_FLOAT) if compact else outputs[i].copy()
+        del inputs, outputs
+    finally:
+        shm_in.close()
+        shm_in.unlink()
+        shm_out.close()
+        shm_out.unlink()
+
+    return all_data_and_features
+
+
+def _build_features_worker(task):
+    ''' Calculate features of a chunk of stocks, from and to shared memory
+    '''
+    from multiprocessing.shared_memory import SharedMemory
+
+    in_name, out_name, n_rows, ranges, feature_set, feature_params = task
+    columns = sb.feature_columns(feature_set, feature_params.get('N_BAR_LOWEST', 10))
+
+    shm_in = SharedMemory(name=in_name)
+    shm_out = SharedMemory(name=out_name)
+    try:
+        inputs = np.ndarray((3, n_rows), dtype=np.float64, buffer=shm_in.buf)
+        outputs = np.ndarray((len(columns), n_rows), dtype=np.float64, buffer=shm_out.buf)
+        for start, stop in ranges:
+            stock_data = pd.DataFrame({'high': inputs[0, start:stop],
+                                       'low': inputs[1, start:stop],
+                                       'close': inputs[2, start:stop]})
+            features = sb.stock_features(stock_data, feature_set, **feature_params)
+            outputs[:, start:stop] = features[columns].values.T
+        del inputs, outputs, stock_data, features
+    finally:
+        shm_in.close()
+        shm_out.close()
+
 #
 # generate_samples
 #
@@ -128,7 +352,9 @@ def generate_samples(stock_data):
     Explain
     ======= 
     Given a stock_data, generate buy/sell samples.
-        Currently, using is_squeeze_buy_point() to find buy points. And using get_sell_point() to find sell points
+        Currently, using squeeze_buy_points() to find buy points. And using get_sell_points() to find sell points
+        Skipped buy-points are counted by the current instrument.Instrument,
+        see generate_sample_index().
 
     Input
     =====
@@ -138,113 +364,796 @@ def generate_samples(stock_data):
     Output
     ======
     X_all: DataFrame
-        all samples' X part, concatenated, in DataFrame
+        all samples' X part, concatenated, in DataFrame. Empty if the stock
+        has no valid sample.
     Y_all: DataFrame
-        all samples' Y part, concatenated, in DataFrame
+        all samples' Y part, concatenated, in DataFrame. Empty if the stock
+        has no valid sample.
     '''
     # Initialize X_all and Y_all
     X_all = pd.DataFrame()
     Y_all = pd.DataFrame()
     X_frames = []
     Y_frames = []
-    
-    # debug
-    nb_samples = 0
-    verbose = False
-    verbose_l1 = False
-
-    for index, row in stock_data.iterrows():
-        # debug
-        # if (row['mpl.date'] >= 735218.0) and (row['mpl.date'] <= 735277.0):
-        #     verbose = True
-        # else:
-        #     verbose = False
-        
-        # is this row a buy-point?
-        if not sb.is_squeeze_buy_point(stock_data, index):
-            if verbose:
-                print(index, ' is NOT squeeze buypoint')
-            # check next row
-            continue
 
-        # Yes, it is a buy-point.
-        if verbose:
-            print(index, ' is squeeze buypoint')
-    
-        # Let's check when is the sell-point.
-        sell_index, sell_reason = sb.get_sell_point(stock_data, index)
+    # find the valid samples, as offsets into stock_data
+    sample_index = generate_sample_index(stock_data)
 
-        if verbose:
-            print('sellpoint: ', sell_index, ' reason: ', sell_reason)
+    with instrument.current().stage('windowing', items=sample_index.shape[0], code=_stock_code(stock_data)):
+        _generate_samples_frames(stock_data, sample_index, X_frames, Y_frames)
 
-        # Do we hit a sell point?
-        if sell_reason == 0: # No, skip it
-            print('No sell_point for. Skip ', index)
-            continue
+    # no sample: keep the empty X_all and Y_all
+    if X_frames:
+        # Add N-record to X_all
+        X_all = pd.concat(X_frames, ignore_index = False)
+        # Add sell-point information to Y_all.
+        Y_all = pd.concat(Y_frames, axis = 1)
+        Y_all = Y_all.T
+
+    return X_all, Y_all
 
-        ## print('=======')
-        ## print(index + ' is YES')
-        ## print(sell_index, 'is SELL POINT')
-        ## print(sell_reason, 'is SELL REASON')
-        ## print('Buy  @ ', stock_data['close'][index])
-        ## print('Sell @ ', stock_data['close'][sell_index])
-        ## print('=======')
 
-        # Back fetch N-record
-        location_of_buy_point = stock_data.index.get_loc(index)
-        first_location = location_of_buy_point - CONST_LOOKBACK_SAMPLES + 1
-        if first_location < 0: # there is no enough records to form a valid sample
-            # skip it
-            print('First location < 0, Skip ', index)
-            continue
+def _generate_samples_frames(stock_data, sample_index, X_frames, Y_frames):
+    ''' Copy X and Y of each sample of sample_index, into X_frames and Y_frames
+    '''
+    for location_of_buy_point, location_of_sell_point, sell_reason in zip(
+            sample_index['buy_location'].values,
+            sample_index['sell_location'].values,
+            sample_index['sell_reason'].values):
+        index = stock_data.index[location_of_buy_point]
+        sell_index = stock_data.index[location_of_sell_point]
 
         # Slicing. These are totally CONST_LOOKBACK_SAMPLES of records.
+        first_location = location_of_buy_point - CONST_LOOKBACK_SAMPLES + 1
         x_sample = stock_data.iloc[first_location:(location_of_buy_point + 1)]
-        # x_sample Validity check.
-        if x_sample.isnull().values.any():
-            # skip it
-            print('Null values in x_sample. Skip. ', index)
-            continue
 
         # create y_sample as a pandas.Series
-        y_raw_data = {'code': row['code'],
+        y_raw_data = {'code': stock_data['code'].iloc[location_of_buy_point],
                       'buy_date': index,
                       'buy_price': stock_data['close'][index],
                       'sell_date': sell_index,
                       'sell_price': stock_data['close'][sell_index],
                       'sell_reason': sell_reason}
         y_sample = pd.Series(y_raw_data)
-        # y_sample validity check
-        if y_sample.isnull().values.any():
-            # skip it
-            print('Null value in y_smaple. skip. ', index, sell_index)
-            continue
 
-        if verbose:
-            print('append x_sample, y_smaple to X/Y_frames')
-            print('y_sample: ', y_sample)
-            
-        if verbose_l1:
-            print(nb_samples, ' y_sample: ', index, sell_index)
-        
         # Add into X/Y_frames
         X_frames.append(x_sample)
         Y_frames.append(y_sample)
-        nb_samples += 1
 
-    #### END of for loop ####
 
-    # Add N-record to X_all
-    X_all = pd.concat(X_frames, ignore_index = False)
-    # Add sell-point information to Y_all.
-    Y_all = pd.concat(Y_frames, axis = 1)
-    Y_all = Y_all.T
-    
-    if verbose_l1:
-        print('number of samples for ', index, ': ', nb_samples)
-        print('shape of X/Y:', X_all.shape, Y_all.shape)
-    
-    return X_all, Y_all
+def _stock_code(stock_data):
+    ''' Return the stock code of one stock's data
+    '''
+    if 'code' in stock_data.columns and stock_data.shape[0] > 0:
+        return stock_data['code'].iloc[0]
+    if isinstance(stock_data.index, pd.MultiIndex):
+        return stock_data.index.get_level_values(0)[0] if stock_data.shape[0] > 0 else None
+    return None
+
+
+#
+# first_valid_locations
+#
+
+
+def first_valid_locations(stock_data):
+    ''' Function to find, for each bar, the first bar of the NaN free run
+        which ends at it
+
+    Explain
+    =======
+    A window of bars [first, last] has no null value when
+    first >= first_valid_locations(stock_data)[last]. So the null check of a
+    sample window is O(1), after this O(n) pass over the stock.
+
+    Input
+    =====
+    stock_data: DataFrame, or 2-D numpy.ndarray
+        one stock's data
+
+    Output
+    ======
+    Return: numpy.ndarray of int
+        one element per bar
+    '''
+    if isinstance(stock_data, pd.DataFrame):
+        row_has_null = stock_data.isnull().values.any(axis=1)
+    else:
+        row_has_null = np.isnan(stock_data).any(axis=1)
+
+    positions = np.arange(row_has_null.shape[0])
+    last_null = np.maximum.accumulate(np.where(row_has_null, positions, -1))
+
+    return last_null + 1
+
+
+#
+# generate_sample_index
+#
+
+
+def generate_sample_index(stock_data, lookback = CONST_LOOKBACK_SAMPLES, multi_atr = 2., n_low = 10):
+    ''' Function to find the valid samples of one stock, as offsets
+
+    Explain
+    =======
+    Same buy/sell rules and validity checks as generate_samples(), but
+    without copying any bar. Each sample is described by its buy-point and
+    sell-point positions in stock_data; its X part is the lookback bars
+    ending at the buy-point.
+
+    A sample is skipped when:
+        a) there is no sell-point before the end of data,
+        b) there are less than lookback bars up to the buy-point,
+        c) there is a null value in the X window,
+        d) the buy price or the sell price is null.
+    Skipped buy-points are counted by the current instrument.Instrument, as
+    'skip.no_sell_point', 'skip.no_lookback', 'skip.nan_window' and
+    'skip.nan_label'.
+
+    Input
+    =====
+    stock_data: DataFrame
+        stock_data with full features 'SQZ', WAVE C/B/A, ATR, ADX, etc.
+    lookback: int
+        number of bars to look back to form a sample
+    multi_atr, n_low:
+        sell rule parameters, see stockbasic.get_sell_points()
+
+    Output
+    ======
+    Return: DataFrame
+        with int columns 'buy_location', 'sell_location', 'sell_reason',
+        one row per valid sample
+    '''
+    ins = instrument.current()
+    code = _stock_code(stock_data) if ins.enabled else None
+
+    # find all buy-points in one pass
+    with ins.stage('buy_detection', items=stock_data.shape[0], code=code):
+        buy_locations = np.flatnonzero(sb.squeeze_buy_points(stock_data))
+    # resolve the sell-points of all buy-points together
+    with ins.stage('exit_resolution', items=buy_locations.shape[0], code=code):
+        sell_locations, sell_reasons = sb.get_sell_points(stock_data, buy_locations,
+                                                          multi_atr=multi_atr, n_low=n_low)
+
+    # a) Do we hit a sell point?
+    no_sell_point = sell_reasons == sb.CONST_SELL_REASON_NONE
+    # b) there is no enough records to form a valid sample
+    first_locations = buy_locations - lookback + 1
+    no_lookback = ~no_sell_point & (first_locations < 0)
+    # c) Null values in x_sample, O(1) per sample
+    first_valid = first_valid_locations(stock_data)
+    null_in_x = ~no_sell_point & ~no_lookback & (first_locations < first_valid[buy_locations])
+    # d) Null value in y_sample
+    close = stock_data['close'].values
+    null_in_y = (~no_sell_point & ~no_lookback & ~null_in_x &
+                 (np.isnan(close[buy_locations]) | np.isnan(close[sell_locations])))
+
+    if ins.enabled:
+        for mask, counter in [(no_sell_point, 'skip.no_sell_point'),
+                              (no_lookback, 'skip.no_lookback'),
+                              (null_in_x, 'skip.nan_window'),
+                              (null_in_y, 'skip.nan_label')]:
+            ins.count(counter, int(np.count_nonzero(mask)))
+
+    valid = ~(no_sell_point | no_lookback | null_in_x | null_in_y)
+
+    sample_index = pd.DataFrame({'buy_location': buy_locations[valid],
+                                 'sell_location': sell_locations[valid],
+                                 'sell_reason': sell_reasons[valid]},
+                                columns=['buy_location', 'sell_location', 'sell_reason'])
+
+    return sample_index
+
+
+#
+# SampleSet
+#
+
+
+class SampleSet(object):
+    ''' Samples of many stocks, stored as offsets into per-stock feature arrays
+
+    Explain
+    =======
+    Each stock's features are kept once, in one 2-D float array of
+    (bars, features). A sample is a (stock, buy_location) offset; its X part
+    is a read-only strided view of the lookback bars ending at buy_location,
+    so overlapping samples share memory. A 3-D
+    (n_samples, lookback, n_features) tensor is only built by to_tensor().
+
+    Attributes
+    ==========
+    codes: list of str
+        stock code, per stock id
+    dates: list of numpy.ndarray
+        int32 day numbers (days since 1970-01-01) of each stock's bars, per
+        stock id
+    features: list of numpy.ndarray
+        (bars, features) array, per stock id. float32 when built from a
+        compact frame, else float64.
+    feature_columns: list of str
+        column name of each feature
+    lookback: int
+        number of bars in each sample
+    index: DataFrame
+        one row per sample, with int columns 'stock', 'buy_location',
+        'sell_location', 'sell_reason'
+    params: dict
+        parameters the samples were generated with, eg. 'multi_atr', 'n_low'
+    '''
+
+    def __init__(self, codes, dates, features, feature_columns, lookback, index, params = None):
+        self.codes = codes
+        self.dates = dates
+        self.features = features
+        self.feature_columns = list(feature_columns)
+        self.lookback = lookback
+        self.index = index
+        self.params = dict(params or {})
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def stock_id(self, code):
+        ''' Return the stock id of a code, -1 if not in this SampleSet
+        '''
+        if not hasattr(self, '_stock_ids'):
+            self._stock_ids = {code: stock for stock, code in enumerate(self.codes)}
+        return self._stock_ids.get(code, -1)
+
+    def location(self, code, dates):
+        ''' Return bar position of date(s) of a stock, -1 where there is no bar.
+            dates are 'YYYY-MM-DD' strings or int day numbers.
+        '''
+        return date_locations(self.dates[self.stock_id(code)], dates)
+
+    def stock_windows(self, stock):
+        ''' Return all lookback windows of one stock, as a read-only view of
+            shape (bars - lookback + 1, lookback, n_features). Window i ends
+            at bar (i + lookback - 1).
+        '''
+        return sliding_windows(self.features[stock], self.lookback)
+
+    def window(self, sample):
+        ''' Return X part of one sample, as a (lookback, n_features) view
+        '''
+        stock = self.index['stock'].iat[sample]
+        buy_location = self.index['buy_location'].iat[sample]
+        return self.features[stock][(buy_location - self.lookback + 1):(buy_location + 1)]
+
+    def to_tensor(self, samples = None, dtype = None):
+        ''' Materialize X part of the samples, as a 3-D numpy array
+
+        Input
+        =====
+        samples: array of int, optional
+            sample numbers, in the order wanted. Default all samples.
+        dtype: numpy dtype, optional
+            dtype of the result. Default the dtype of the feature arrays.
+
+        Output
+        ======
+        Return: numpy.ndarray
+            in shape (n_samples, lookback, n_features)
+        '''
+        if dtype is None:
+            dtype = self.features[0].dtype if self.features else np.float64
+        if samples is None:
+            samples = np.arange(len(self))
+        samples = np.asarray(samples, dtype=np.int64)
+        stocks = self.index['stock'].values[samples]
+        buy_locations = self.index['buy_location'].values[samples]
+
+        tensor = np.empty((samples.shape[0], self.lookback, len(self.feature_columns)), dtype=dtype)
+        for stock in np.unique(stocks):
+            selected = np.flatnonzero(stocks == stock)
+            window_numbers = buy_locations[selected] - self.lookback + 1
+            tensor[selected] = self.stock_windows(stock)[window_numbers]
+
+        return tensor
+
+
+#
+# sliding_windows
+#
+
+
+def sliding_windows(values, lookback):
+    ''' Function to view a (bars, features) array as overlapping windows
+
+    Input
+    =====
+    values: 2-D numpy.ndarray
+        in shape (bars, features)
+    lookback: int
+        number of bars in each window
+
+    Output
+    ======
+    Return: numpy.ndarray
+        read-only view, in shape (bars - lookback + 1, lookback, features).
+        No data is copied.
+    '''
+    n_windows = max(values.shape[0] - lookback + 1, 0)
+    return as_strided(values,
+                      shape=(n_windows, lookback, values.shape[1]),
+                      strides=(values.strides[0], values.strides[0], values.strides[1]),
+                      writeable=False)
+
+
+#
+# build_sample_set
+#
+
+
+def build_sample_set(all_data_and_features, lookback = CONST_LOOKBACK_SAMPLES, feature_columns = None,
+                     multi_atr = 2., n_low = 10):
+    ''' Function to generate samples of all stocks, as a SampleSet
+
+    Explain
+    =======
+    Offset based counterpart of calling generate_samples() for each stock.
+    Same buy/sell rules and validity checks, but no window is copied.
+
+    Input
+    =====
+    all_data_and_features: MultiIndex DataFrame
+        indexed by 'code' and 'date', with full features
+    lookback: int
+        number of bars to look back to form a sample
+    feature_columns: list of str, optional
+        columns to keep in the feature arrays. Default all numeric columns.
+    multi_atr, n_low:
+        sell rule parameters, see stockbasic.get_sell_points()
+
+    Output
+    ======
+    Return: SampleSet
+        feature arrays are float32 when all feature columns fit in it, as
+        in a compact frame (see compact_frame()), else float64
+
+    Example
+    =======
+    >>> samples = build_sample_set(all_data_and_features)
+    >>> X = samples.to_tensor()  # (n_samples, 120, n_features)
+    '''
+    if feature_columns is None:
+        feature_columns = [col for col in all_data_and_features.columns
+                           if pd.api.types.is_numeric_dtype(all_data_and_features[col].dtype)]
+    dtype = np.result_type(np.float32, *[all_data_and_features[col].dtype for col in feature_columns])
+
+    ins = instrument.current()
+    codes = []
+    dates = []
+    features = []
+    index_frames = []
+
+    for code, stock_data in all_data_and_features.groupby(level=0, sort=False):
+        stock = len(codes)
+        codes.append(code)
+        sample_index = generate_sample_index(stock_data, lookback=lookback,
+                                             multi_atr=multi_atr, n_low=n_low)
+        with ins.stage('windowing', items=sample_index.shape[0], code=code):
+            dates.append(index_days(stock_data.index))
+            features.append(np.ascontiguousarray(stock_data[feature_columns].values, dtype=dtype))
+        sample_index.insert(0, 'stock', stock)
+        index_frames.append(sample_index)
+
+    index = pd.concat(index_frames, ignore_index=True) if index_frames else \
+        pd.DataFrame(columns=['stock', 'buy_location', 'sell_location', 'sell_reason'], dtype=np.int64)
+
+    return SampleSet(codes, dates, features, feature_columns, lookback, index,
+                     params={'multi_atr': multi_atr, 'n_low': n_low})
+
+
+#
+# save_sample_set
+#
+
+# on-disk layout of a saved SampleSet, see save_sample_set()
+CONST_SAMPLE_SET_FORMAT = 'myStockAILib.SampleSet'
+CONST_SAMPLE_SET_VERSION = 1
+CONST_SAMPLE_SET_META = 'meta.json'
+CONST_SAMPLE_SET_ARCHIVE = 'arrays.npz'
+
+
+def save_sample_set(samples, path, table = None, params = None, compress = False):
+    ''' Function to save a SampleSet, and its outcome table, to a directory
+
+    Explain
+    =======
+    Replaces the notebook's X_all / Y_all CSV round trip. Arrays are kept in
+    their own dtypes:
+        features.npy   all stocks' feature arrays, end to end
+        dates.npy      all stocks' int32 day numbers, end to end
+        offsets.npy    first row of each stock, and the total row count
+        index.<col>.npy, table.<col>.npy
+                       one file per column of samples.index and of table
+    With compress, all arrays go into one compressed arrays.npz instead,
+    which is smaller but cannot be memory-mapped. meta.json is written
+    last: it holds the lookback, feature columns, codes, generation
+    parameters, date range, and the dtype and shape of every array, which
+    load_sample_set() checks.
+
+    Input
+    =====
+    samples: SampleSet
+    path: str
+        directory, created if missing. Files of an earlier save are replaced.
+    table: DataFrame, optional
+        outcome table, as returned by label_samples(samples)
+    params: dict, optional
+        extra JSON-able parameters to record, eg. the squeeze parameters
+        given to build_features(). Added to samples.params.
+    compress: bool
+        write one compressed arrays.npz instead of .npy files
+
+    Example
+    =======
+    >>> save_sample_set(samples, 'data/hs300-120', table=label_samples(samples))
+    >>> samples, table = load_sample_set('data/hs300-120')
+    '''
+    import json
+    import os
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    n_features = len(samples.feature_columns)
+    lengths = np.array([features.shape[0] for features in samples.features], dtype=np.int64)
+    features_dtype = samples.features[0].dtype if samples.features else np.dtype(np.float64)
+
+    arrays = {'features': np.concatenate(samples.features).astype(features_dtype, copy=False)
+                          if samples.features else np.zeros((0, n_features), dtype=features_dtype),
+              'dates': np.concatenate(samples.dates).astype(np.int32, copy=False)
+                       if samples.dates else np.zeros(0, dtype=np.int32),
+              'offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)}
+    for col in samples.index.columns:
+        arrays['index.' + col] = samples.index[col].values
+
+    categories = {}
+    if table is not None:
+        for col in table.columns:
+            values = table[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                categories[col] = values.cat.categories.tolist()
+                values = values.cat.codes
+            arrays['table.' + col] = values.values
+
+    first_day = int(arrays['dates'].min()) if arrays['dates'].size else None
+    last_day = int(arrays['dates'].max()) if arrays['dates'].size else None
+    meta = {'format': CONST_SAMPLE_SET_FORMAT,
+            'version': CONST_SAMPLE_SET_VERSION,
+            'lookback': int(samples.lookback),
+            'feature_columns': samples.feature_columns,
+            'codes': list(samples.codes),
+            'n_samples': len(samples),
+            'params': dict(samples.params, **(params or {})),
+            'date_range': [str(days_to_dates([day])[0]) if day is not None else None
+                           for day in (first_day, last_day)],
+            'index_columns': samples.index.columns.tolist(),
+            'table_columns': table.columns.tolist() if table is not None else None,
+            'categories': categories,
+            'compressed': bool(compress),
+            'arrays': {name: {'dtype': values.dtype.str, 'shape': list(values.shape)}
+                       for name, values in arrays.items()}}
+
+    # remove what an earlier save left, then write meta.json last
+    for name in os.listdir(path):
+        if name == CONST_SAMPLE_SET_META or name == CONST_SAMPLE_SET_ARCHIVE or name.endswith('.npy'):
+            os.remove(os.path.join(path, name))
+    if compress:
+        np.savez_compressed(os.path.join(path, CONST_SAMPLE_SET_ARCHIVE), **arrays)
+    else:
+        for name, values in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(values))
+
+    tmp_path = os.path.join(path, CONST_SAMPLE_SET_META + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp_path, os.path.join(path, CONST_SAMPLE_SET_META))
+
+
+def read_sample_set_meta(path):
+    ''' Return the metadata of a saved SampleSet, see save_sample_set()
+    '''
+    import json
+    import os
+
+    with open(os.path.join(path, CONST_SAMPLE_SET_META)) as f:
+        meta = json.load(f)
+    if meta.get('format') != CONST_SAMPLE_SET_FORMAT:
+        raise ValueError(path + ' is not a saved SampleSet')
+    if meta.get('version') != CONST_SAMPLE_SET_VERSION:
+        raise ValueError('%s: unsupported SampleSet version %s' % (path, meta.get('version')))
+    return meta
+
+
+def load_sample_set(path, mmap = True, feature_columns = None, lookback = None):
+    ''' Function to load a SampleSet saved by save_sample_set()
+
+    Explain
+    =======
+    Every array is checked against the dtype and shape recorded in
+    meta.json, and ValueError is raised on any mismatch, or when
+    feature_columns or lookback are given and differ. Each stock's feature array is a view into one
+    (memory-mapped) array, so loading reads no bars until they are used.
+
+    Input
+    =====
+    path: str
+        directory written by save_sample_set()
+    mmap: bool
+        memory-map the .npy files, read-only. Ignored for a compressed save.
+    feature_columns: list of str, optional
+        expected feature columns, in order
+    lookback: int, optional
+        expected lookback
+
+    Output
+    ======
+    samples: SampleSet
+        with the saved params
+    table: DataFrame, or None
+        the saved outcome table, None if none was saved
+    '''
+    import os
+
+    meta = read_sample_set_meta(path)
+    if feature_columns is not None and list(feature_columns) != meta['feature_columns']:
+        raise ValueError('%s: feature columns %s, expected %s' % (path, meta['feature_columns'], list(feature_columns)))
+    if lookback is not None and lookback != meta['lookback']:
+        raise ValueError('%s: lookback %d, expected %d' % (path, meta['lookback'], lookback))
+
+    if meta['compressed']:
+        with np.load(os.path.join(path, CONST_SAMPLE_SET_ARCHIVE)) as archive:
+            arrays = {name: archive[name] for name in meta['arrays']}
+    else:
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+                  for name in meta['arrays']}
+    for name, expected in meta['arrays'].items():
+        if arrays[name].dtype.str != expected['dtype'] or list(arrays[name].shape) != expected['shape']:
+            raise ValueError('%s: array %s is %s %s, expected %s %s' % (
+                path, name, arrays[name].dtype.str, list(arrays[name].shape), expected['dtype'], expected['shape']))
+
+    offsets = arrays['offsets']
+    n_stocks = len(meta['codes'])
+    if offsets.shape[0] != n_stocks + 1 or offsets[-1] != arrays['features'].shape[0] or \
+            arrays['features'].shape[1:] != (len(meta['feature_columns']),):
+        raise ValueError(path + ': features do not match codes and feature columns')
+
+    features = [arrays['features'][offsets[i]:offsets[i + 1]] for i in range(n_stocks)]
+    dates = [arrays['dates'][offsets[i]:offsets[i + 1]] for i in range(n_stocks)]
+    index = pd.DataFrame({col: np.asarray(arrays['index.' + col]) for col in meta['index_columns']},
+                         columns=meta['index_columns'])
+    if index.shape[0] != meta['n_samples']:
+        raise ValueError(path + ': sample index does not match n_samples')
+
+    table = None
+    if meta['table_columns'] is not None:
+        table = pd.DataFrame({col: np.asarray(arrays['table.' + col]) for col in meta['table_columns']},
+                             columns=meta['table_columns'])
+        for col, categories in meta['categories'].items():
+            table[col] = pd.Categorical.from_codes(table[col].values, categories=categories)
+
+    samples = SampleSet(meta['codes'], dates, features, meta['feature_columns'], meta['lookback'], index,
+                        params=meta['params'])
+
+    return samples, table
+
+
+#
+# label_samples
+#
+
+# take any profit value less than or equal to this number as a LOSS
+CONST_PROFIT_THRESHOLD = 0.2239
+# sigmoid label is centered on this percentile of 'profit'
+CONST_SIGMOID_PERCENTILE = 90
+
+
+@instrument.timed('labeling', items=len)
+def label_samples(samples, profit_threshold = CONST_PROFIT_THRESHOLD, sigmoid_center = None, stock_list = None):
+    ''' Function to build the typed trade-outcome table of a SampleSet
+
+    Explain
+    =======
+    Array version of the notebook's Y_all post-processing. Everything is
+    computed from the sample offsets and the per-stock 'close' arrays, with
+    no per-row Python.
+
+    Input
+    =====
+    samples: SampleSet
+        with 'close' in its feature_columns
+    profit_threshold: float
+        'label' is 1 when profit is bigger than profit_threshold, else 0
+    sigmoid_center: float, optional
+        'sigmoid.profit' is sigmoid(profit * 100 - sigmoid_center * 100 + 2).
+        Default the CONST_SIGMOID_PERCENTILE'th percentile of profit.
+    stock_list: DataFrame, optional
+        with column 'code', such as ts.get_hs300s(). When given, 'code.sn'
+        is the row number of each sample's code in it, -1 if not listed.
+
+    Output
+    ======
+    Return: DataFrame
+        one row per sample, in SampleSet order, with columns
+        'stock' (int32), 'code' (category), ['code.sn' (int32)],
+        'buy_location', 'sell_location' (int32),
+        'buy_date', 'sell_date' (datetime64), 'mpl.buy_date', 'mpl.sell_date',
+        'buy_price', 'sell_price' (float64), 'sell_reason' (int8),
+        'hold_days' (float64, calendar days), 'hold_bars' (int32),
+        'profit', 'profit.per.day', 'sigmoid.profit' (float64), 'label' (int8)
+    '''
+    close_position = samples.feature_columns.index('close')
+
+    # all stocks' close and day numbers, end to end, and where each stock starts
+    lengths = np.array([features.shape[0] for features in samples.features], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    close = np.concatenate([features[:, close_position] for features in samples.features]).astype(np.float64) \
+        if lengths.size else np.zeros(0)
+    days = np.concatenate(samples.dates) if lengths.size else np.zeros(0, dtype=np.int32)
+
+    stocks = samples.index['stock'].values.astype(np.int64)
+    buy_locations = samples.index['buy_location'].values.astype(np.int64)
+    sell_locations = samples.index['sell_location'].values.astype(np.int64)
+    buy_rows = starts[stocks] + buy_locations
+    sell_rows = starts[stocks] + sell_locations
+
+    buy_days = days[buy_rows]
+    sell_days = days[sell_rows]
+    buy_price = close[buy_rows]
+    sell_price = close[sell_rows]
+
+    profit = sell_price / buy_price - 1
+    hold_days = (sell_days - buy_days).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profit_per_day = profit / hold_days
+
+    if sigmoid_center is None:
+        sigmoid_center = np.percentile(profit, CONST_SIGMOID_PERCENTILE) if profit.size else 0.
+    sigmoid_profit = 1. / (1. + np.exp(-(profit * 100 - sigmoid_center * 100 + 2)))
+
+    table = pd.DataFrame({'stock': stocks.astype(np.int32),
+                          'code': pd.Categorical.from_codes(stocks, categories=samples.codes)})
+    if stock_list is not None:
+        table['code.sn'] = pd.Index(stock_list['code'].values).get_indexer(table['code'].astype(object)).astype(np.int32)
+    table['buy_location'] = buy_locations.astype(np.int32)
+    table['sell_location'] = sell_locations.astype(np.int32)
+    table['buy_date'] = buy_days.astype('datetime64[D]').astype('datetime64[ns]')
+    table['sell_date'] = sell_days.astype('datetime64[D]').astype('datetime64[ns]')
+    table['mpl.buy_date'] = days_to_mpl_dates(buy_days)
+    table['mpl.sell_date'] = days_to_mpl_dates(sell_days)
+    table['buy_price'] = buy_price
+    table['sell_price'] = sell_price
+    table['sell_reason'] = samples.index['sell_reason'].values.astype(np.int8)
+    table['hold_days'] = hold_days
+    table['hold_bars'] = (sell_locations - buy_locations).astype(np.int32)
+    table['profit'] = profit
+    table['profit.per.day'] = profit_per_day
+    table['sigmoid.profit'] = sigmoid_profit
+    table['label'] = (profit > profit_threshold).astype(np.int8)
+
+    return table
+
+
+#
+# normalize_samples
+#
+
+# per-window scaling of the sample features, as the notebook's Conv1D model uses.
+# Each group is (method, columns) or (method, columns, reference_columns):
+#   'minmax': (x - min) / (max - min), 'maxabs': x / max(|x|), 'none': copied.
+# min / max are taken over the time axis of each window, and over all
+# reference columns together (default: the group's own columns).
+CONST_NORMALIZE_GROUPS = [('minmax', ['volume']),
+                          ('minmax', ['close', 'EMA8', 'EMA21'], ['close']),  # co-related, same scale as 'close'
+                          ('minmax', ['ADX']),
+                          ('none', ['SQUEEZE']),
+                          ('maxabs', ['MTMMA']),
+                          ('maxabs', ['HIST1']),
+                          ('maxabs', ['HIST2']),
+                          ('maxabs', ['HIST3']),
+                          ('maxabs', ['HIST4']),
+                          ('maxabs', ['HIST5']),
+                          ('maxabs', ['MACD6'])]
+
+
+def normalized_columns(groups = CONST_NORMALIZE_GROUPS):
+    ''' Return the feature columns of normalize_samples() output, in order
+    '''
+    return [col for group in groups for col in group[1]]
+
+
+@instrument.timed('normalization', items=len)
+def normalize_samples(samples, feature_columns = None, groups = CONST_NORMALIZE_GROUPS,
+                      chunk_size = 4096, dtype = np.float64, out = None):
+    ''' Function to scale every sample window, in vectorized chunks
+
+    Explain
+    =======
+    Batched replacement of the notebook's per-sample MinMaxScaler /
+    MaxAbsScaler loop. Statistics are computed along the time axis of each
+    window, for all windows of a chunk in one pass. Columns of a group share
+    one scale. A constant window scales to 0, as sklearn's scalers do.
+
+    Only chunk_size windows are materialized at a time, so memory stays
+    bounded by the output (which may be a numpy.memmap, passed as out).
+
+    Input
+    =====
+    samples: SampleSet, or numpy.ndarray
+        SampleSet, or a (n_samples, lookback, n_features) array
+    feature_columns: list of str
+        column names of the last axis. Default samples.feature_columns.
+    groups: list of tuple
+        scaling groups, see CONST_NORMALIZE_GROUPS
+    chunk_size: int
+        number of windows per chunk
+    dtype: numpy dtype
+        dtype of the output
+    out: numpy.ndarray, optional
+        preallocated output, in shape (n_samples, lookback, n_columns)
+
+    Output
+    ======
+    Return: numpy.ndarray
+        in shape (n_samples, lookback, n_columns), columns as
+        normalized_columns(groups)
+
+    Example
+    =======
+    >>> samples = build_sample_set(all_data_and_features, lookback=60)
+    >>> X = normalize_samples(samples)  # (n_samples, 60, 13)
+    '''
+    if feature_columns is None:
+        feature_columns = samples.feature_columns
+    if isinstance(samples, SampleSet):
+        n_samples, lookback = len(samples), samples.lookback
+        get_chunk = lambda first, last: samples.to_tensor(np.arange(first, last), dtype=np.float64)
+    else:
+        n_samples, lookback = samples.shape[0], samples.shape[1]
+        get_chunk = lambda first, last: np.asarray(samples[first:last], dtype=np.float64)
+
+    position = {col: i for i, col in enumerate(feature_columns)}
+    plan = []  # (method, input positions, reference positions, output positions)
+    out_position = 0
+    for group in groups:
+        method, columns = group[0], group[1]
+        reference = group[2] if len(group) > 2 else columns
+        plan.append((method,
+                     [position[col] for col in columns],
+                     [position[col] for col in reference],
+                     list(range(out_position, out_position + len(columns)))))
+        out_position += len(columns)
+
+    if out is None:
+        out = np.empty((n_samples, lookback, out_position), dtype=dtype)
+
+    for first in range(0, n_samples, chunk_size):
+        last = min(first + chunk_size, n_samples)
+        chunk = get_chunk(first, last)
+
+        for method, columns, reference, outputs in plan:
+            values = chunk[:, :, columns]
+            if method == 'minmax':
+                ref_values = chunk[:, :, reference]
+                low = ref_values.min(axis=(1, 2), keepdims=True)
+                scale = ref_values.max(axis=(1, 2), keepdims=True) - low
+                scale[scale == 0] = 1.
+                values = (values - low) / scale
+            elif method == 'maxabs':
+                scale = np.abs(chunk[:, :, reference]).max(axis=(1, 2), keepdims=True)
+                scale[scale == 0] = 1.
+                values = values / scale
+            elif method != 'none':
+                raise ValueError('unknown normalization method: ' + str(method))
+            out[first:last, :, outputs[0]:(outputs[-1] + 1)] = values
+
+    return out
 
 
 #
@@ -261,25 +1170,17 @@ def date_to_num(dates):
     
     Output
     ======
-    Return: list of float datetime value compatible to matplotlib: floating point 
-            numbers which represent time in days since 0001-01-01 UTC, plus 1. 
-            For example, 0001-01-01, 06:00 is 1.25, not 0.25.
+    Return: ndarray of float datetime value compatible to matplotlib: floating point 
+            numbers which represent time in days since matplotlib's epoch.
+            Same values as matplotlib.dates.date2num() of each date.
     
     Example
     =======
         stock_data['mpl.date'] = date_to_num(stock_data['date'].values)
 
     '''
-    num_time = []
-    for date in dates:
-        date_time = datetime.datetime.strptime(date,'%Y-%m-%d')
-        num_date = date2num(date_time)
-        '''
-            matplotlib.dates.date2num(d)
-                Converts datetime objects to Matplotlib dates
-        '''
-        num_time.append(num_date)
-    return num_time
+    # vectorized: parse all dates at once, then shift to matplotlib's epoch
+    return days_to_mpl_dates(dates_to_days(dates))
 
 
 #
@@ -297,79 +1198,15 @@ def plot_stock_data(stock_data, title_postfix=''):
     Output
     ======
     Return: None
+
+    Drawn by stockplot.plot_stock_chart(), with collections, and downsampled
+    when there are more bars than pixels.
     '''
-   
-    # make a local copy
-    sdata = stock_data.copy(deep=False)
-    # convert index 'date' to a column
-    sdata.reset_index(level=1, inplace=True)
-    
-    # convert date to num
-    sdata['mpl.date'] = date_to_num(sdata['date'].values)
+    import matplotlib as mpl
+    import stockplot
+
+    with mpl.rc_context(CONST_PLOT_RC):
+        stockplot.plot_stock_chart(stock_data, title_postfix)
 
-    fig, axes = plt.subplots(7, sharex=True, figsize=(15,14),
-                             gridspec_kw={'height_ratios':[3,1,1,1,1,1,1]})
-    
-    # axes[0]: k-line
-    mpf.candlestick_ochl(axes[0],
-                         sdata[['mpl.date', 'open', 'close', 'high', 'low']].values,
-                         width=1.0,
-                         colorup = 'g',
-                         colordown = 'r')
-    # axes[0]: EMA8, EMA21
-    axes[0].plot(sdata['mpl.date'].values, sdata['EMA8'].values, 'm', label='EMA8')
-    axes[0].plot(sdata['mpl.date'].values, sdata['EMA21'].values, 'c', label='EMA21')
-    axes[0].legend(loc=0)
-    axes[0].grid(True)
-    
-    axes[0].set_title(stock_data['code'].iloc[0] + ' ' + title_postfix)
-    axes[0].set_ylabel('Price')
-    axes[0].grid(True)
-    axes[0].xaxis_date()
-
-    # axes[1]: volume
-    axes[1].bar(sdata['mpl.date'].values-0.25, sdata['volume'].values, width= 0.5)
-    axes[1].set_ylabel('Volume')
-    axes[1].grid(True)
-    
-    # axes[2]: MTMMA
-    bars = axes[2].bar(sdata['mpl.date'].values-0.25, sdata['MTMMA'].values, width=0.8)
-    for bar in bars:
-        if bar.get_height() > 0:
-            bar.set_color('g')
-        else:
-            bar.set_color('r')
-        
-    # axes[2]: SQUEEZE
-    axes[2].plot(sdata['mpl.date'].values-0.25,
-                 [0 if x == sb.CONST_SQUEEZE_ONGOING else float('nan') for x in sdata['SQUEEZE'].values], # rescale
-                 'ko',
-                 label='SQUEEZE')
-    axes[2].set_ylabel('SQZ')
-    axes[2].grid(True)
-    
-    # axes[3]: TTM WAVE C
-    bars = axes[3].bar(sdata['mpl.date'].values-0.25, sdata['MACD6'].values, color='red', width=0.8, alpha=0.8)
-    bars = axes[3].bar(sdata['mpl.date'].values-0.25, sdata['HIST5'].values, color='orange', width=0.8, alpha=0.8)
-    axes[3].set_ylabel('WAVE C')
-    axes[3].grid(True)
-   
-    # axes[4]: TTM WAVE B
-    bars = axes[4].bar(sdata['mpl.date'].values-0.25, sdata['HIST4'].values, color='magenta', width=0.8, alpha=0.8)
-    bars = axes[4].bar(sdata['mpl.date'].values-0.25, sdata['HIST3'].values, color='teal', width=0.8, alpha=0.8)
-    axes[4].set_ylabel('WAVE B')
-    axes[4].grid(True)
-   
-    # axes[5]: TTM WAVE A
-    bars = axes[5].bar(sdata['mpl.date'].values-0.25, sdata['HIST2'].values, color='lawngreen', width=0.8, alpha=0.8)
-    bars = axes[5].bar(sdata['mpl.date'].values-0.25, sdata['HIST1'].values, color='yellow', width=0.8, alpha=0.8)
-    axes[5].set_ylabel('WAVE A')
-    axes[5].grid(True)
-    
-    # axes[6]: ADX
-    axes[6].plot(sdata['mpl.date'].values, sdata['ADX'].values, 'm', label='ADX')
-    axes[6].set_ylabel('ADX')
-    axes[6].grid(True)
-   
     return
     
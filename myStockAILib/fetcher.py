@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+'''
+Concurrent, rate-limited and resumable bar fetcher.
+
+Bars come from a DataSource (tushare, or local files for offline work), and
+go into a barstore.BarStore. Only the dates missing in the store are
+requested, and progress is checkpointed, so an interrupted run resumes
+where it stopped.
+'''
+
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import instrument
+
+
+# columns returned by DataSource.get_bars(), as tushare's get_k_data()
+CONST_K_DATA_COLUMNS = ['date', 'open', 'close', 'high', 'low', 'volume', 'code']
+
+
+#
+# data sources
+#
+
+
+class DataSource(object):
+    ''' Interface of a source of daily bars
+    '''
+
+    def get_bars(self, code, start_date, end_date):
+        ''' Return bars of one stock
+
+        Input
+        =====
+        code: str
+            stock code
+        start_date, end_date: str
+            'YYYY-MM-DD', both inclusive
+
+        Output
+        ======
+        Return: DataFrame
+            with columns CONST_K_DATA_COLUMNS, one row per bar, oldest first.
+            Empty if there is no bar in the range.
+        '''
+        raise NotImplementedError
+
+
+class TushareSource(DataSource):
+    ''' Bars from tushare's get_k_data()
+    '''
+
+    def __init__(self, **k_data_params):
+        self.k_data_params = k_data_params
+
+    def get_bars(self, code, start_date, end_date):
+        import tushare as ts
+        bars = ts.get_k_data(code, start=start_date, end=end_date, **self.k_data_params)
+        if bars is None or bars.shape[0] == 0:
+            return pd.DataFrame(columns=CONST_K_DATA_COLUMNS)
+        return bars[CONST_K_DATA_COLUMNS]
+
+
+class FileSource(DataSource):
+    ''' Bars from local CSV files, a stand-in for tushare when offline
+
+    Explain
+    =======
+    path is either
+        a directory, with one '<code>.csv' per stock in get_k_data() layout,
+        or a single CSV saved from a fetch_raw_data() frame, such as the
+        notebook's 'hs300_20100101-20171124.csv'.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._all_data = None
+        self._lock = threading.Lock()
+
+    def _load_all(self):
+        with self._lock:
+            if self._all_data is None:
+                all_data = pd.read_csv(self.path, dtype={'code': str, 'code.1': str})
+                self._all_data = {code: bars for code, bars in all_data.groupby('code')}
+        return self._all_data
+
+    def get_bars(self, code, start_date, end_date):
+        if os.path.isdir(self.path):
+            csv_path = os.path.join(self.path, code + '.csv')
+            if not os.path.isfile(csv_path):
+                return pd.DataFrame(columns=CONST_K_DATA_COLUMNS)
+            bars = pd.read_csv(csv_path, dtype={'code': str})
+        else:
+            bars = self._load_all().get(code)
+            if bars is None:
+                return pd.DataFrame(columns=CONST_K_DATA_COLUMNS)
+
+        if 'code' not in bars.columns:
+            bars = bars.assign(code=code)
+        in_range = (bars['date'] >= start_date) & (bars['date'] <= end_date)
+        return bars.loc[in_range, CONST_K_DATA_COLUMNS].reset_index(drop=True)
+
+
+#
+# RateLimiter
+#
+
+
+class RateLimiter(object):
+    ''' Thread-safe limiter, allowing at most `rate` calls per `per` seconds
+    '''
+
+    def __init__(self, rate, per = 1.0):
+        self.interval = float(per) / rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        ''' Block until the next call is allowed
+        '''
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(self.next_time, now) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+#
+# Fetcher
+#
+
+
+class Fetcher(object):
+    ''' Fetch bars of many stocks into a BarStore
+
+    Explain
+    =======
+    For each code, only the dates after the last stored bar are requested.
+    Requests run on a thread pool, under a shared rate limit, and failed
+    requests are retried with exponential back-off. Each stock's bars are
+    appended to the store as soon as they arrive, and the checkpoint file
+    records which codes are up to date for the requested range, so a
+    restarted run skips them, including codes with no new bars.
+
+    Input
+    =====
+    source: DataSource
+        where bars come from, eg. TushareSource() or FileSource(path)
+    store: barstore.BarStore
+        where bars go to
+    max_workers: int
+        number of concurrent requests
+    rate_limit: float
+        maximum requests per second, None for no limit
+    retries: int
+        number of retries of a failed request
+    backoff: float
+        seconds to wait before the first retry, doubled on each retry
+    checkpoint_path: str, optional
+        JSON file to record progress. Default '<store root>/fetch_checkpoint.json'
+
+    Example
+    =======
+    >>> store = barstore.BarStore('data/bars')
+    >>> fetcher = Fetcher(TushareSource(), store, max_workers=8, rate_limit=5)
+    >>> fetcher.fetch(ts.get_hs300s()['code'], '2010-01-01', '2017-12-20')
+    >>> all_data = store.load_frame()
+    '''
+
+    def __init__(self, source, store, max_workers = 4, rate_limit = None, retries = 3, backoff = 1.0,
+                 checkpoint_path = None):
+        self.source = source
+        self.store = store
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.retries = retries
+        self.backoff = backoff
+        if checkpoint_path is None:
+            checkpoint_path = os.path.join(store.root, 'fetch_checkpoint.json')
+        self.checkpoint_path = checkpoint_path
+        self._lock = threading.Lock()
+
+    def missing_range(self, code, start_date, end_date):
+        ''' Return (start, end) still to fetch for a stock, or None when up to date
+
+        Only dates after the last stored bar are missing: a start_date before
+        the first stored bar is never backfilled, as BarStore only appends.
+        '''
+        last_date = self.store.last_date(code)
+        if last_date is not None:
+            next_day = (np.datetime64(last_date, 'D') + 1).astype(datetime.date)
+            start_date = max(start_date, next_day.strftime('%Y-%m-%d'))
+        if start_date > end_date:
+            return None
+        return start_date, end_date
+
+    def _load_checkpoint(self, start_date, end_date):
+        if not os.path.isfile(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('range') != [start_date, end_date]:
+            return set()
+        return set(checkpoint['done'])
+
+    def _save_checkpoint(self, start_date, end_date, done):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'range': [start_date, end_date], 'done': sorted(done)}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _fetch_one(self, code, start_date, end_date):
+        ins = instrument.current()
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait()
+            try:
+                with ins.stage('fetch', code=code) as timer:
+                    bars = self.source.get_bars(code, start_date, end_date)
+                    timer.items = bars.shape[0]
+                break
+            except Exception:
+                ins.count('fetch.errors')
+                if attempt == self.retries:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+        with ins.stage('store', items=bars.shape[0], code=code):
+            return self.store.append(code, bars)
+
+    def fetch(self, codes, start_date, end_date):
+        ''' Fetch all missing bars of the codes, between the dates
+
+        Input
+        =====
+        codes: iterable of str
+            stock codes
+        start_date, end_date: str
+            'YYYY-MM-DD', both inclusive
+
+        Output
+        ======
+        Return: dict
+            'fetched': number of codes requested in this run
+            'bars': number of bars appended to the store
+            'skipped': number of codes already up to date
+            'failed': dict, code to error message, for codes which still
+                failed after all retries. Run fetch() again to resume them.
+        '''
+        done = self._load_checkpoint(start_date, end_date)
+        summary = {'fetched': 0, 'bars': 0, 'skipped': 0, 'failed': {}}
+
+        tasks = []
+        for code in codes:
+            missing = None if code in done else self.missing_range(code, start_date, end_date)
+            if missing is None:
+                summary['skipped'] += 1
+                continue
+            tasks.append((code,) + missing)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._fetch_one, *task): task[0] for task in tasks}
+            for future in as_completed(futures):
+                code = futures[future]
+                try:
+                    nb_bars = future.result()
+                except Exception as e:
+                    summary['failed'][code] = repr(e)
+                    continue
+                with self._lock:
+                    summary['fetched'] += 1
+                    summary['bars'] += nb_bars
+                    done.add(code)
+                    self._save_checkpoint(start_date, end_date, done)
+
+        return summary
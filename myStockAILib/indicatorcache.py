@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+'''
+Content-addressed cache of stockbasic indicators.
+
+An indicator result is keyed by the stock code, a fingerprint of the bars
+it was computed from, and the function with all its parameters (defaults
+included). The same ATR(20) of the same bars is computed once, whichever
+experiment asks for it; changed bars give a new fingerprint, so a stale
+result is never returned.
+
+    >>> cache = IndicatorCache(max_bytes=512 << 20, spill_dir='data/indicator_cache')
+    >>> ttm_squeeze = cache.cached(sb.ttm_squeeze)
+    >>> for code, stock_data in all_data.groupby(level=0):
+    ...     stock_data = stock_data.join(ttm_squeeze(stock_data, LENGTHKC=20))
+    >>> cache.stats()
+    {'hits': 290, 'disk_hits': 10, 'misses': 0, ...}
+
+Results live in a bounded in-memory LRU. With spill_dir, evicted results go
+to disk, and are found there by later sessions too.
+'''
+
+import collections
+import hashlib
+import inspect
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from stockdates import index_days
+
+
+# bar columns an indicator may read; other columns do not change the fingerprint
+CONST_FINGERPRINT_COLUMNS = ['open', 'close', 'high', 'low', 'volume']
+
+# default bound of the in-memory tier, in bytes
+CONST_CACHE_MAX_BYTES = 256 << 20
+
+
+#
+# fingerprint
+#
+
+
+def bar_fingerprint(stock_data, columns = CONST_FINGERPRINT_COLUMNS):
+    ''' Function to fingerprint the bars of one stock
+
+    Explain
+    =======
+    Hash of the dates and of the values of the bar columns of stock_data.
+    Columns added by joining indicators do not change it, any change of a
+    date or a bar does.
+
+    Input
+    =====
+    stock_data: DataFrame
+        bars of one stock, with some of 'open', 'close', 'high', 'low',
+        'volume'
+    columns: list of str
+        columns to hash, when present
+
+    Output
+    ======
+    Return: str
+        hex digest
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(index_days(stock_data.index), dtype=np.int32).tobytes())
+    for col in columns:
+        if col in stock_data.columns:
+            digest.update(col.encode('utf-8'))
+            digest.update(np.ascontiguousarray(stock_data[col].values, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def _stock_code(stock_data):
+    ''' Return the stock code of one stock's data, as dataprep does
+    '''
+    if 'code' in stock_data.columns and stock_data.shape[0] > 0:
+        return str(stock_data['code'].iloc[0])
+    if isinstance(stock_data.index, pd.MultiIndex) and stock_data.shape[0] > 0:
+        return str(stock_data.index.get_level_values(0)[0])
+    return None
+
+
+#
+# IndicatorCache
+#
+
+
+class IndicatorCache(object):
+    ''' LRU cache of indicator DataFrames, with an optional disk tier
+
+    Explain
+    =======
+    Key of a result: (code, bar fingerprint, function, parameters). The
+    parameters are bound to the function's signature with their defaults,
+    so ttm_squeeze(stock_data) and ttm_squeeze(stock_data, LENGTHKC=20)
+    share one entry.
+
+    Only the column arrays of a result are kept; a hit rebuilds the
+    DataFrame on the caller's index. Once the cached arrays exceed
+    max_bytes, least recently used results are evicted, and written to
+    spill_dir when given:
+        <spill_dir>/<code>/<key digest>.npz
+    A miss in memory looks on disk before computing, and moves the result
+    back to memory.
+
+    invalidate(code) drops all results of one stock, in memory and on
+    disk, eg. after new bars were appended to it:
+        >>> store.on_append.append(cache.invalidate)
+
+    Thread-safe. Two threads missing on the same key may both compute it.
+
+    Input
+    =====
+    max_bytes: int
+        bound of the in-memory tier, in bytes
+    spill_dir: str, optional
+        directory of the disk tier. Default no disk tier, evicted results
+        are dropped.
+
+    Example
+    =======
+    >>> cache = IndicatorCache()
+    >>> features = cache.call(sb.stock_features, stock_data, N_BAR_LOWEST=20)
+    '''
+
+    def __init__(self, max_bytes = CONST_CACHE_MAX_BYTES, spill_dir = None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        if spill_dir is not None and not os.path.isdir(spill_dir):
+            os.makedirs(spill_dir)
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    #
+    # keys
+    #
+
+    @staticmethod
+    def key(function, code, fingerprint, *args, **params):
+        ''' Return the cache key of function(stock_data, *args, **params)
+        '''
+        bound = inspect.signature(function).bind(None, *args, **params)
+        bound.apply_defaults()
+        arguments = tuple((name, repr(value)) for name, value in list(bound.arguments.items())[1:])
+        return (code, fingerprint, function.__module__ + '.' + function.__qualname__, arguments)
+
+    def _path(self, key):
+        digest = hashlib.blake2b(repr(key[1:]).encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.spill_dir, str(key[0]), digest + '.npz')
+
+    #
+    # lookups
+    #
+
+    def call(self, function, stock_data, *args, code = None, fingerprint = None, **params):
+        ''' Function to return function(stock_data, *args, **params), cached
+
+        Input
+        =====
+        function: callable
+            indicator of one stock's bars, returning a DataFrame on
+            stock_data's index, such as stockbasic.ttm_squeeze()
+        stock_data: DataFrame
+            bars of one stock
+        code: str, optional
+            stock code. Default from the 'code' column or the index.
+        fingerprint: str, optional
+            bar_fingerprint(stock_data), to skip hashing again when calling
+            several functions on the same bars
+
+        Output
+        ======
+        Return: DataFrame
+            function's output, on stock_data's index
+        '''
+        if code is None:
+            code = _stock_code(stock_data)
+        if fingerprint is None:
+            fingerprint = bar_fingerprint(stock_data)
+        key = self.key(function, code, fingerprint, *args, **params)
+
+        columns = self.get(key)
+        if columns is None:
+            result = function(stock_data, *args, **params)
+            self.put(key, result)
+            return result
+
+        return pd.DataFrame(collections.OrderedDict(columns), index=stock_data.index, copy=True)
+
+    def cached(self, function):
+        ''' Return function, with its results cached, eg.
+            ttm_squeeze = cache.cached(sb.ttm_squeeze)
+        '''
+        def cached_function(stock_data, *args, **params):
+            return self.call(function, stock_data, *args, **params)
+        cached_function.__name__ = function.__name__
+        cached_function.__doc__ = function.__doc__
+        return cached_function
+
+    def get(self, key):
+        ''' Return the cached [(column, values), ...] of key, or None
+        '''
+        with self._lock:
+            columns = self._entries.get(key)
+            if columns is not None:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return columns
+
+        columns = self._read(key) if self.spill_dir is not None else None
+        with self._lock:
+            if columns is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+        self._insert(key, columns)
+        return columns
+
+    def put(self, key, result):
+        ''' Cache the DataFrame result of key
+        '''
+        columns = []
+        for col in result.columns:
+            values = np.array(result[col].values)
+            values.setflags(write=False)
+            columns.append((col, values))
+        self._insert(key, columns)
+
+    def _insert(self, key, columns):
+        spilled = []
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= _nbytes(self._entries.pop(key))
+            self._entries[key] = columns
+            self._bytes += _nbytes(columns)
+            while self._bytes > self.max_bytes and self._entries:
+                old_key, old_columns = self._entries.popitem(last=False)
+                self._bytes -= _nbytes(old_columns)
+                self._stats['evictions'] += 1
+                spilled.append((old_key, old_columns))
+
+        # disk writes out of the lock
+        if self.spill_dir is not None:
+            for old_key, old_columns in spilled:
+                self._write(old_key, old_columns)
+
+    #
+    # disk tier
+    #
+
+    def _write(self, key, columns):
+        path = self._path(key)
+        if os.path.isfile(path):
+            return
+        stock_dir = os.path.dirname(path)
+        if not os.path.isdir(stock_dir):
+            os.makedirs(stock_dir, exist_ok=True)
+        arrays = {'column%d' % i: values for i, (col, values) in enumerate(columns)}
+        arrays['columns'] = np.array([col for col, values in columns], dtype=str)
+        tmp_path = path + '.%d.tmp' % threading.get_ident()
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._stats['spills'] += 1
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as arrays:
+                columns = []
+                for i, col in enumerate(arrays['columns'].tolist()):
+                    values = arrays['column%d' % i]
+                    values.setflags(write=False)
+                    columns.append((col, values))
+                return columns
+        except (IOError, OSError):
+            return None
+
+    def flush(self):
+        ''' Write all in-memory results to the disk tier, eg. at the end of a
+            session, so the next session finds them
+        '''
+        if self.spill_dir is None:
+            return
+        with self._lock:
+            entries = list(self._entries.items())
+        for key, columns in entries:
+            self._write(key, columns)
+
+    #
+    # invalidation and statistics
+    #
+
+    def invalidate(self, code):
+        ''' Drop all cached results of one stock, in memory and on disk
+
+        Output
+        ======
+        Return: int
+            number of in-memory results dropped
+        '''
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == code]
+            for key in keys:
+                self._bytes -= _nbytes(self._entries.pop(key))
+            self._stats['invalidations'] += len(keys)
+        if self.spill_dir is not None:
+            shutil.rmtree(os.path.join(self.spill_dir, str(code)), ignore_errors=True)
+        return len(keys)
+
+    def clear(self, disk = False):
+        ''' Drop all in-memory results, and with disk, the disk tier too
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if disk and self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            os.makedirs(self.spill_dir)
+
+    def stats(self):
+        ''' Return a dict of the cache statistics
+
+        Output
+        ======
+        Return: dict
+            'hits': results found in memory
+            'disk_hits': results found on disk
+            'misses': results computed
+            'evictions': results evicted from memory
+            'spills': results written to disk
+            'invalidations': results dropped by invalidate()
+            'entries': results in memory
+            'bytes': size of the results in memory
+            'hit_rate': (hits + disk_hits) / lookups
+        '''
+        with self._lock:
+            stats = {name: self._stats[name] for name in
+                     ['hits', 'disk_hits', 'misses', 'evictions', 'spills', 'invalidations']}
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.
+        return stats
+
+
+def _nbytes(columns):
+    return sum(values.nbytes for col, values in columns)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+'''
+Pipeline instrumentation: stage timers, counters and per-stock throughput.
+
+Pipeline functions report to the current instrument. By default it is a
+null instrument whose calls do nothing, so instrumentation costs close to
+nothing unless an Instrument is active:
+
+    >>> with Instrument() as ins:
+    ...     all_data_and_features = dp.build_features(all_data)
+    ...     samples = dp.build_sample_set(all_data_and_features)
+    >>> ins.to_json('run.json')
+
+Stages reported by the pipeline: 'fetch', 'store', 'features',
+'buy_detection', 'exit_resolution', 'windowing', 'labeling' and
+'normalization'. Skipped samples are counted as 'skip.no_sell_point',
+'skip.no_lookback', 'skip.nan_window' and 'skip.nan_label', stocks dropped
+by build_features() as 'skip.short_history', and failed requests of a
+fetcher.Fetcher as 'fetch.errors'.
+'''
+
+import functools
+import json
+import threading
+import time
+
+
+#
+# Instrument
+#
+
+
+class _StageTimer(object):
+    ''' Context manager timing one run of a stage
+    '''
+
+    __slots__ = ('instrument', 'name', 'items', 'code', 'start')
+
+    def __init__(self, instrument, name, items, code):
+        self.instrument = instrument
+        self.name = name
+        self.items = items
+        self.code = code
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrument._record(self.name, time.perf_counter() - self.start, self.items, self.code)
+        return False
+
+
+class Instrument(object):
+    ''' Collector of stage timings, counters and per-stock throughput
+
+    Explain
+    =======
+    stage() times a block of work, with the number of items (eg. bars) it
+    processed, and optionally the stock code it processed. count() adds to
+    a named counter. When given, callback(event) is called after each stage
+    run, and after each count(), with a dict event:
+        {'type': 'stage', 'stage': name, 'seconds': s, 'items': n, 'code': code}
+        {'type': 'count', 'counter': name, 'n': n, 'total': total}
+    Thread-safe.
+
+    Input
+    =====
+    callback: callable, optional
+        function of one event dict
+
+    Example
+    =======
+    >>> with Instrument(callback=print) as ins:
+    ...     X, Y = dp.generate_samples(stock_data)
+    >>> ins.report()['counters']
+    {'skip.no_sell_point': 3, 'skip.no_lookback': 1}
+    '''
+
+    enabled = True
+
+    def __init__(self, callback = None):
+        self.callback = callback
+        self.stages = {}
+        self.counters = {}
+        self.stocks = {}
+        self._lock = threading.Lock()
+        self._previous = None
+
+    def stage(self, name, items = 0, code = None):
+        ''' Return a context manager timing a run of stage name
+        '''
+        return _StageTimer(self, name, items, code)
+
+    def count(self, name, n = 1):
+        ''' Add n to counter name
+        '''
+        if n == 0:
+            return
+        with self._lock:
+            total = self.counters.get(name, 0) + n
+            self.counters[name] = total
+        if self.callback is not None:
+            self.callback({'type': 'count', 'counter': name, 'n': n, 'total': total})
+
+    def _record(self, name, seconds, items, code):
+        with self._lock:
+            stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0., 'items': 0})
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+            stage['items'] += items
+            if code is not None:
+                stock = self.stocks.setdefault(code, {})
+                stock_stage = stock.setdefault(name, {'seconds': 0., 'items': 0})
+                stock_stage['seconds'] += seconds
+                stock_stage['items'] += items
+        if self.callback is not None:
+            self.callback({'type': 'stage', 'stage': name, 'seconds': seconds, 'items': items, 'code': code})
+
+    def replay(self, events):
+        ''' Record events collected by the callback of another Instrument,
+            eg. one active in a worker process
+        '''
+        for event in events:
+            if event['type'] == 'stage':
+                self._record(event['stage'], event['seconds'], event['items'], event['code'])
+            else:
+                self.count(event['counter'], event['n'])
+
+    def report(self):
+        ''' Return all collected data, as a JSON-able dict
+
+        Output
+        ======
+        Return: dict
+            'stages': name to {'calls', 'seconds', 'items', 'items_per_second'}
+            'counters': name to total
+            'stocks': code to stage name to {'seconds', 'items', 'items_per_second'}
+        '''
+        def with_rate(stats):
+            stats = dict(stats)
+            stats['items_per_second'] = stats['items'] / stats['seconds'] if stats['seconds'] > 0 else None
+            return stats
+
+        with self._lock:
+            return {'stages': {name: with_rate(stats) for name, stats in self.stages.items()},
+                    'counters': dict(self.counters),
+                    'stocks': {code: {name: with_rate(stats) for name, stats in stages.items()}
+                               for code, stages in self.stocks.items()}}
+
+    def to_json(self, path = None):
+        ''' Return report() as a JSON string, and write it to path if given
+        '''
+        text = json.dumps(self.report(), indent=2, sort_keys=True)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def __enter__(self):
+        global _current
+        self._previous = _current
+        _current = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _current
+        _current = self._previous
+        self._previous = None
+        return False
+
+
+class _NullStageTimer(object):
+    __slots__ = ('items',)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class _NullInstrument(object):
+    ''' Instrument doing nothing, active when no Instrument is
+    '''
+
+    enabled = False
+    _timer = _NullStageTimer()
+
+    def stage(self, name, items = 0, code = None):
+        return self._timer
+
+    def count(self, name, n = 1):
+        pass
+
+    def replay(self, events):
+        pass
+
+
+NULL_INSTRUMENT = _NullInstrument()
+
+_current = NULL_INSTRUMENT
+
+
+def current():
+    ''' Return the active Instrument, or NULL_INSTRUMENT
+    '''
+    return _current
+
+
+def timed(stage, items = None):
+    ''' Decorator reporting each call of a function as a run of stage
+
+    Input
+    =====
+    stage: str
+        stage name
+    items: callable, optional
+        function of the first argument, returning the number of items, eg. len
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _current.enabled:
+                return function(*args, **kwargs)
+            with _current.stage(stage, items=items(args[0]) if items is not None else 0):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+#
+# progress_bar
+#
+
+
+def progress_bar(stage, total, prefix = 'Progress:', length = 60):
+    ''' Return an Instrument callback printing a progress bar of a stage
+
+    Explain
+    =======
+    Replaces the progress bar printed by fetch_raw_data(): pass it as the
+    callback of an Instrument, to get it back.
+
+    Example
+    =======
+    >>> with Instrument(callback=progress_bar('fetch', stock_list.shape[0])):
+    ...     all_data = dp.fetch_raw_data(stock_list, '2010-01-01', '2017-12-20')
+    '''
+    from dataprep import printProgressBar
+
+    done = [0]
+
+    def callback(event):
+        if event['type'] == 'stage' and event['stage'] == stage:
+            done[0] += 1
+            printProgressBar(done[0], total, prefix=prefix, suffix='Complete', length=length)
+
+    return callback
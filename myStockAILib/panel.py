@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+
+'''
+Aligned (stocks, trading days) panel of all stocks.
+
+Every field is a dense 2-D array over one common calendar, the union of
+all stocks' trading days, with a validity mask for the days a stock has no
+bar (not listed yet, suspended, delisted). Indicators, the buy rule and
+the exit resolution run over all stocks at once:
+
+    >>> panel = Panel.from_frame(all_data)
+    >>> panel.add_features()
+    >>> buy = panel.buy_points()  # (stocks, days) bool
+    >>> trades = panel.sell_points(buy)
+    >>> all_data_and_features = panel.to_frame()
+
+Time-series work is done on the packed layout (see Panel.pack()), where
+each stock's own bars are contiguous, so a suspension is skipped exactly
+as the per-stock functions skip it.
+'''
+
+import numpy as np
+import pandas as pd
+import talib
+
+import stockbasic as sb
+from stockdates import days_to_dates, index_days
+
+
+#
+# Panel
+#
+
+
+class Panel(object):
+    ''' Fields of all stocks, aligned on a common trading calendar
+
+    Attributes
+    ==========
+    codes: list of str
+        stock code, per row
+    days: numpy.ndarray of int32
+        day numbers (days since 1970-01-01) of the calendar, per column
+    valid: numpy.ndarray of bool
+        (stocks, days), True where a stock has a bar
+    fields: dict
+        column name to (stocks, days) float array, NaN where not valid
+    dtypes: dict
+        column name to the dtype to_frame() gives it back
+
+    Example
+    =======
+    >>> panel = Panel.from_frame(all_data_and_features)
+    >>> panel['close'][panel.codes.index('000001')]  # one stock, on the calendar
+    '''
+
+    def __init__(self, codes, days, valid, fields, dtypes = None, int_dates = False, code_dtype = None,
+                 frame_columns = None):
+        self.codes = list(codes)
+        self.days = np.asarray(days, dtype=np.int32)
+        self.valid = valid
+        self.fields = fields
+        self.dtypes = dict(dtypes or {})
+        # layout of to_frame(): int day numbers or 'YYYY-MM-DD' dates, dtype
+        # of the 'code' column (None for none), and the column order
+        self.int_dates = int_dates
+        self.code_dtype = code_dtype
+        self.frame_columns = list(frame_columns if frame_columns is not None else fields)
+
+    @classmethod
+    def from_frame(cls, all_data, columns = None):
+        ''' Function to build a Panel from a MultiIndex'ed (code, date) frame
+
+        Input
+        =====
+        all_data: MultiIndex DataFrame
+            indexed by 'code' and 'date', such as fetch_raw_data(),
+            build_features() or compact_frame() output
+        columns: list of str, optional
+            columns to keep. Default all numeric columns.
+
+        Output
+        ======
+        Return: Panel
+        '''
+        if columns is None:
+            columns = [col for col in all_data.columns
+                       if col != 'code' and pd.api.types.is_numeric_dtype(all_data[col].dtype)]
+
+        # codes and calendar, from the index levels
+        stock_codes, codes = pd.factorize(all_data.index.get_level_values(0), sort=True)
+        days, day_codes = np.unique(index_days(all_data.index), return_inverse=True)
+        day_codes = day_codes.ravel()
+
+        valid = np.zeros((len(codes), days.shape[0]), dtype=bool)
+        valid[stock_codes, day_codes] = True
+
+        fields = {}
+        dtypes = {}
+        for col in columns:
+            values = all_data[col].values
+            dtypes[col] = values.dtype
+            field = np.full(valid.shape, np.nan, dtype=np.result_type(values.dtype, np.float32))
+            field[stock_codes, day_codes] = values
+            fields[col] = field
+
+        code_dtype = all_data['code'].dtype if 'code' in all_data.columns else None
+        int_dates = np.issubdtype(all_data.index.levels[-1].dtype, np.integer)
+        frame_columns = [col for col in all_data.columns if col in fields or col == 'code']
+
+        return cls(list(codes), days, valid, fields, dtypes, int_dates, code_dtype, frame_columns)
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    @property
+    def shape(self):
+        return self.valid.shape
+
+    def to_frame(self, columns = None):
+        ''' Function to convert back to a MultiIndex'ed (code, date) frame
+
+        Input
+        =====
+        columns: list of str, optional
+            fields to include. Default all.
+
+        Output
+        ======
+        Return: MultiIndex DataFrame
+            indexed by 'code' and 'date', one row per valid cell, ordered by
+            code then date, with the 'code' column, date style and dtypes of
+            the frame the Panel was built from
+        '''
+        if columns is None:
+            columns = list(self.fields)
+
+        # valid cells in (stock, day) order
+        stock_codes, day_codes = np.nonzero(self.valid)
+        date_level = self.days if self.int_dates else days_to_dates(self.days).astype(object)
+        index = pd.MultiIndex(levels=[pd.Index(self.codes, dtype=object), date_level],
+                              codes=[stock_codes, day_codes],
+                              names=['code', 'date'],
+                              verify_integrity=False)
+
+        data = {}
+        for col in columns:
+            values = self.fields[col][self.valid]
+            dtype = self.dtypes.get(col, values.dtype)
+            data[col] = values if dtype == values.dtype else values.astype(dtype)
+        if self.code_dtype is not None:
+            if isinstance(self.code_dtype, pd.CategoricalDtype):
+                data['code'] = pd.Categorical.from_codes(stock_codes, categories=self.codes)
+            else:
+                data['code'] = np.asarray(self.codes, dtype=object)[stock_codes]
+
+        # columns of the source frame first, in their order, then new fields
+        order = [col for col in self.frame_columns if col in data] + \
+            [col for col in columns if col not in self.frame_columns]
+        return pd.DataFrame(data, index=index, columns=order)
+
+    #
+    # packed layout
+    #
+
+    def n_bars(self):
+        ''' Return the number of bars of each stock
+        '''
+        return np.count_nonzero(self.valid, axis=1)
+
+    def _packed_positions(self):
+        if not hasattr(self, '_positions'):
+            # position of each valid cell among its stock's own bars
+            self._positions = (np.cumsum(self.valid, axis=1) - 1)[self.valid]
+            self._stocks = np.nonzero(self.valid)[0]
+            self._max_bars = int(self.n_bars().max()) if self.valid.size else 0
+        return self._stocks, self._positions, self._max_bars
+
+    def pack(self, values, fill = np.nan):
+        ''' Function to move each stock's own bars to the left
+
+        Input
+        =====
+        values: numpy.ndarray
+            (stocks, days) aligned array, eg. panel['close']
+
+        Output
+        ======
+        Return: numpy.ndarray
+            (stocks, max bars) array: row i holds the bars of stock i, in
+            order, without the days it has no bar, then fill
+        '''
+        stocks, positions, max_bars = self._packed_positions()
+        packed = np.full((self.valid.shape[0], max_bars), fill, dtype=np.result_type(values.dtype, type(fill)))
+        packed[stocks, positions] = values[self.valid]
+        return packed
+
+    def unpack(self, packed, fill = np.nan):
+        ''' Function to put packed rows back on the calendar, inverse of pack()
+        '''
+        stocks, positions, _ = self._packed_positions()
+        values = np.full(self.valid.shape, fill, dtype=np.result_type(packed.dtype, type(fill)))
+        values[self.valid] = packed[stocks, positions]
+        return values
+
+    def packed_days(self):
+        ''' Return the calendar column of each packed bar, -1 after the last bar
+        '''
+        return self.pack(np.broadcast_to(np.arange(self.days.shape[0]), self.valid.shape), fill=-1)
+
+    #
+    # indicators, buy rule, exits
+    #
+
+    def add_features(self, feature_set = sb.CONST_FEATURE_SET_ALL, **feature_params):
+        ''' Function to calculate stockbasic features of all stocks, as new fields
+
+        Explain
+        =======
+        Same columns and values as stockbasic.stock_features() of each
+        stock, see panel_features().
+
+        Input
+        =====
+        feature_set: list of str
+            feature groups, see stockbasic.stock_features()
+        feature_params:
+            extra parameters for stockbasic.stock_features()
+
+        Output
+        ======
+        Return: Panel
+            self
+        '''
+        features = panel_features(self.pack(self['high']), self.pack(self['low']), self.pack(self['close']),
+                                  feature_set, **feature_params)
+        # a panel of a compact frame gets compact features
+        compact = self['close'].dtype == np.float32
+        for col, packed in features.items():
+            values = self.unpack(packed)
+            self.fields[col] = values.astype(np.float32) if compact else values
+            if col == 'SQUEEZE':
+                self.dtypes[col] = np.dtype(np.int8) if compact else packed.dtype
+            else:
+                self.dtypes[col] = self.fields[col].dtype
+        return self
+
+    def buy_points(self):
+        ''' Function to find the squeeze buy-points of all stocks
+
+        Output
+        ======
+        Return: numpy.ndarray of bool
+            (stocks, days), as stockbasic.squeeze_buy_points() of each stock
+        '''
+        packed = sb.squeeze_buy_mask(self.pack(self['HIST5']), self.pack(self['MACD6']), self.pack(self['SQUEEZE']))
+        return self.unpack(packed, fill=False)
+
+    def sell_points(self, buy = None, multi_atr = 2., n_low = 10, exit_rules = None):
+        ''' Function to resolve the sell-points of all buy-points of all stocks
+
+        Explain
+        =======
+        One stockbasic.resolve_sell_points() call for all stocks: their
+        packed bars are laid end to end, and a sell-point found past the
+        last bar of its stock is no sell-point.
+
+        Input
+        =====
+        buy: numpy.ndarray of bool, optional
+            (stocks, days) entries. Default buy_points().
+        multi_atr, n_low, exit_rules:
+            see stockbasic.get_sell_points()
+
+        Output
+        ======
+        Return: DataFrame
+            one row per entry, ordered by stock then day, with int columns
+            'stock' (row of codes), 'buy_day', 'sell_day' (column of days,
+            -1 when not sold before the end) and 'sell_reason'
+        '''
+        if buy is None:
+            buy = self.buy_points()
+        stocks, positions, max_bars = self._packed_positions()
+        n_low_col_name = 'LOW' + str(n_low)
+
+        buy_packed = self.pack(buy, fill=False)
+        buy_stocks, buy_positions = np.nonzero(buy_packed)
+        flat_buy = buy_stocks * max_bars + buy_positions
+
+        sell_flat, sell_reasons = sb.resolve_sell_points(self.pack(self['close']).ravel(),
+                                                         self.pack(self['ATR']).ravel(),
+                                                         self.pack(self[n_low_col_name]).ravel(),
+                                                         flat_buy,
+                                                         multi_atr=multi_atr,
+                                                         exit_rules=exit_rules)
+
+        # a hit past the stock's own bars belongs to the next stock
+        stock_ends = buy_stocks * max_bars + self.n_bars()[buy_stocks]
+        not_sold = (sell_reasons == sb.CONST_SELL_REASON_NONE) | (sell_flat >= stock_ends)
+        sell_reasons = np.where(not_sold, sb.CONST_SELL_REASON_NONE, sell_reasons)
+
+        packed_days = self.packed_days().ravel()
+        sell_days = np.where(not_sold, -1, packed_days[np.where(not_sold, 0, sell_flat)])
+
+        return pd.DataFrame({'stock': buy_stocks,
+                             'buy_day': packed_days[flat_buy],
+                             'sell_day': sell_days,
+                             'sell_reason': sell_reasons},
+                            columns=['stock', 'buy_day', 'sell_day', 'sell_reason'])
+
+    def signal_panel(self, n_low = 10, rank_column = None):
+        ''' Function to get the backtest inputs, without going through a frame
+
+        Output
+        ======
+        Return: dict
+            same as backtest.build_signal_panel() of to_frame()
+        '''
+        rank = np.zeros(self.valid.shape) if rank_column is None else \
+            np.where(self.valid, self[rank_column], 0.)
+        return {'codes': list(self.codes),
+                'days': self.days.copy(),
+                'close': self['close'].T.astype(np.float64),
+                'atr': self['ATR'].T.astype(np.float64),
+                'nbar_low': self['LOW' + str(n_low)].T.astype(np.float64),
+                'rank': rank.T.astype(np.float64),
+                'buy': self.buy_points().T.copy()}
+
+
+#
+# panel_features
+#
+
+
+def _rows(function, *arrays):
+    ''' Apply a 1-D function to each row of (stocks, bars) arrays. function
+        returns one array, or a tuple of arrays.
+    '''
+    outputs = None
+    for i in range(arrays[0].shape[0]):
+        result = function(*[np.ascontiguousarray(array[i], dtype=np.float64) for array in arrays])
+        results = result if isinstance(result, tuple) else (result,)
+        if outputs is None:
+            outputs = [np.empty(arrays[0].shape, dtype=np.float64) for _ in results]
+        for output, values in zip(outputs, results):
+            output[i] = values
+    if outputs is None:
+        outputs = [np.empty(arrays[0].shape, dtype=np.float64)]
+    return tuple(outputs) if len(outputs) > 1 else outputs[0]
+
+
+def panel_features(high, low, close, feature_set = sb.CONST_FEATURE_SET_ALL,
+                   MULTKC = 1.5, MULT = 1.5, LENGTHKC = 20, LENGTHBB = 20, LENGTHMOM = 12,
+                   SHORT = 8, MID_A = 34, LONG_A = 55, MID_B = 89, LONG_B = 144, MID_C = 233, LONG_C = 377,
+                   ADX_LENGTH = 14, ATR_LENGTH = 14, N_BAR_LOWEST = 10):
+    ''' Function to calculate stockbasic features of many stocks at once
+
+    Explain
+    =======
+    2-D version of stockbasic.stock_features(), same parameters, columns
+    and values. Bars are along the last axis, and each row is one stock's
+    own bars, such as Panel.pack() gives; trailing NaN padding is ignored.
+    Recursive indicators run TA-Lib once per row; everything else is one
+    numpy operation over all stocks.
+
+    Input
+    =====
+    high, low, close: numpy.ndarray
+        (stocks, bars) arrays
+
+    Output
+    ======
+    Return: dict
+        column name to (stocks, bars) array, columns as
+        stockbasic.feature_columns(feature_set, N_BAR_LOWEST)
+    '''
+    columns = sb.feature_columns(feature_set, N_BAR_LOWEST)
+    out = {}
+
+    # shared intermediates, computed on first use
+    cache = {}
+
+    def ema_close(period):
+        if ('EMA', period) not in cache:
+            cache[('EMA', period)] = _rows(lambda c: talib.EMA(c, timeperiod=period), close)
+        return cache[('EMA', period)]
+
+    def atr(period):
+        if ('ATR', period) not in cache:
+            cache[('ATR', period)] = _rows(lambda h, l, c: talib.ATR(h, l, c, timeperiod=period), high, low, close)
+        return cache[('ATR', period)]
+
+    if 'propulsion' in feature_set:
+        out['EMA8'] = ema_close(8)
+        out['EMA21'] = ema_close(21)
+
+    if 'squeeze' in feature_set:
+        UPPERBB, BOLL, LOWERBB = _rows(lambda c: talib.BBANDS(c, timeperiod=LENGTHBB, nbdevup=MULT, nbdevdn=MULT),
+                                       close)
+        MA = BOLL if LENGTHKC == LENGTHBB else _rows(lambda c: talib.MA(c, timeperiod=LENGTHKC), close)
+        ATR = atr(LENGTHKC)
+        UPPERKC = MA + ATR * MULTKC
+        LOWERKC = MA - ATR * MULTKC
+
+        with np.errstate(invalid='ignore'):
+            squeeze_true = (LOWERBB > LOWERKC) & (UPPERBB < UPPERKC)
+        out['SQUEEZE'] = np.where(squeeze_true, sb.CONST_SQUEEZE_ONGOING, sb.CONST_SQUEEZE_RELEASED).astype(np.int64)
+
+        MTM = np.full(close.shape, np.nan)
+        MTM[:, LENGTHMOM:] = close[:, LENGTHMOM:] - close[:, :-LENGTHMOM]
+        out['MTMMA'] = _rows(lambda m: talib.MA(m, timeperiod=LENGTHMOM), MTM)
+
+    if 'wave' in feature_set:
+        FASTMA = ema_close(SHORT)
+        for col, period in [('HIST1', MID_A), ('HIST2', LONG_A), ('HIST3', MID_B),
+                            ('HIST4', LONG_B), ('HIST5', MID_C)]:
+            MACD = FASTMA - ema_close(period)
+            out[col] = MACD - _rows(lambda m: talib.EMA(m, timeperiod=period), MACD)
+        out['MACD6'] = FASTMA - ema_close(LONG_C)
+
+    if 'adx' in feature_set:
+        out['ADX'] = _rows(lambda h, l, c: talib.ADX(h, l, c, timeperiod=ADX_LENGTH), high, low, close)
+
+    if 'atr' in feature_set:
+        out['ATR'] = atr(ATR_LENGTH)
+
+    if 'nbarlow' in feature_set:
+        # rolling minimum over all stocks at once, shifted by one bar
+        out['LOW' + str(N_BAR_LOWEST)] = sb.nbar_extreme_bank(np.asarray(low, dtype=np.float64).T,
+                                                              [N_BAR_LOWEST])[:, 0].T.copy()
+
+    return {col: out[col] for col in columns}
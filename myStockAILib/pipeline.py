@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+
+'''
+Resumable pipeline from bars to labeled, normalized samples.
+
+The notebook flow, as a graph of stages with explicit inputs and
+parameters:
+
+    fetch          bars of each stock, into a barstore.BarStore
+    features       stockbasic.stock_features() of each stock
+    samples        dataprep.generate_sample_index() of each stock
+    labels         dataprep.label_samples() of all samples, saved with the
+                   SampleSet by dataprep.save_sample_set()
+    normalization  dataprep.normalize_samples() of all samples, as X.npy
+
+Every stage output has a key: a hash of the stage parameters and of the
+keys of its inputs (for fetch, a fingerprint of the stock's bars). Outputs
+are checkpointed under the work directory with their key, so a run only
+computes what is missing or out of date: after appending bars to a few
+stocks, only their features and samples are rebuilt; after changing a
+label parameter, features and samples are all reused. Stocks run
+concurrently.
+
+Layout of the work directory:
+    features/<code>/<key>.npz, samples/<code>/<key>.npz
+    sample_set/       save_sample_set() output, with the label table
+    X.npy             normalized samples
+    <stage>.json      key of the last completed run of a whole-set stage
+
+Usage
+=====
+    python pipeline.py --store data/bars --work data/pipeline
+    python pipeline.py --store data/bars --work data/pipeline --tushare \\
+        --codes hs300.txt --start 2010-01-01 --end 2017-12-20 --params params.json
+'''
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import barstore
+import dataprep as dp
+import instrument
+import stockbasic as sb
+from indicatorcache import bar_fingerprint
+from stockdates import days_to_dates
+
+
+# stages, in order, with the stages they take as inputs
+CONST_PIPELINE_STAGES = [('fetch', []),
+                         ('features', ['fetch']),
+                         ('samples', ['features']),
+                         ('labels', ['samples']),
+                         ('normalization', ['labels'])]
+
+# default parameters of each stage. 'features' takes any extra
+# stockbasic.stock_features() parameter, eg. 'N_BAR_LOWEST'
+CONST_PIPELINE_PARAMS = {'fetch': {'start_date': None, 'end_date': None},
+                         'features': {'feature_set': sb.CONST_FEATURE_SET_ALL,
+                                      'drop_threshold': dp.CONST_DROP_THRESHOLD},
+                         'samples': {'lookback': dp.CONST_LOOKBACK_SAMPLES, 'multi_atr': 2., 'n_low': 10},
+                         'labels': {'profit_threshold': dp.CONST_PROFIT_THRESHOLD, 'sigmoid_center': None},
+                         'normalization': {'groups': dp.CONST_NORMALIZE_GROUPS, 'dtype': 'float32'}}
+
+# bar columns kept next to the features, as in build_features() output
+CONST_PIPELINE_BAR_COLUMNS = ['open', 'close', 'high', 'low', 'volume']
+
+
+def stage_key(stage, params, input_keys):
+    ''' Return the key of a stage output, from its parameters and the keys
+        of its inputs
+    '''
+    text = json.dumps([stage, params, input_keys], sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+#
+# Pipeline
+#
+
+
+class Pipeline(object):
+    ''' Stage graph from bars to labeled samples, checkpointed per stock
+
+    Explain
+    =======
+    run() goes through CONST_PIPELINE_STAGES in order:
+        fetch          only with a source: fetcher.Fetcher.fetch() of the
+                       missing bars, itself resumable
+        features,      per stock, over a pool of workers. A stock with less
+        samples        than drop_threshold bars is skipped, as
+                       build_features() does.
+        labels,        on all stocks' samples, rerun when any stock's
+        normalization  samples or the stage parameters changed
+    A stage whose output is checkpointed under its current key is not run
+    again. An interrupted run resumes from the last checkpoints.
+
+    Input
+    =====
+    store: barstore.BarStore, or str
+        bar store, or its root directory
+    work_dir: str
+        directory of the checkpoints and outputs, created if missing
+    params: dict, optional
+        per stage parameters, {stage: {name: value}}, overriding
+        CONST_PIPELINE_PARAMS
+    codes: list of str, optional
+        stock codes. Default all codes of the store.
+    source: fetcher.DataSource, optional
+        source of the fetch stage. Default no fetch, the store is used as is.
+    n_workers: int, optional
+        number of workers of the per-stock stages. Default os.cpu_count().
+    use_threads: bool
+        use a thread pool instead of a process pool
+    fetch_params: dict, optional
+        extra parameters for fetcher.Fetcher, eg. {'rate_limit': 5}
+
+    Example
+    =======
+    >>> pipeline = Pipeline('data/bars', 'data/pipeline', params={'samples': {'lookback': 60}})
+    >>> pipeline.run()
+    >>> samples, table = pipeline.sample_set()
+    >>> X = pipeline.normalized()
+    '''
+
+    def __init__(self, store, work_dir, params = None, codes = None, source = None, n_workers = None,
+                 use_threads = False, fetch_params = None):
+        self.store = store if isinstance(store, barstore.BarStore) else barstore.BarStore(store)
+        self.work_dir = work_dir
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+        self.params = copy.deepcopy(CONST_PIPELINE_PARAMS)
+        for stage, stage_params in (params or {}).items():
+            if stage not in self.params:
+                raise ValueError('unknown pipeline stage: ' + str(stage))
+            self.params[stage].update(stage_params)
+        self.codes = list(codes) if codes is not None else None
+        self.source = source
+        self.n_workers = n_workers
+        self.use_threads = use_threads
+        self.fetch_params = dict(fetch_params or {})
+
+    #
+    # checkpoints of whole-set stages
+    #
+
+    def _stamp_path(self, stage):
+        return os.path.join(self.work_dir, stage + '.json')
+
+    def _stamp(self, stage):
+        try:
+            with open(self._stamp_path(stage)) as f:
+                return json.load(f)['key']
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def _write_stamp(self, stage, key):
+        tmp_path = self._stamp_path(stage) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': key, 'params': self.params[stage]}, f, default=str)
+        os.replace(tmp_path, self._stamp_path(stage))
+
+    #
+    # run
+    #
+
+    def run(self, until = 'normalization', force = ()):
+        ''' Function to run the stages up to until, reusing checkpoints
+
+        Input
+        =====
+        until: str
+            last stage to run
+        force: list of str
+            stages to rerun even when checkpointed, with all stages after
+            them
+
+        Output
+        ======
+        Return: dict
+            stage name to {'run': n, 'reused': n, 'skipped': n}, counting
+            stocks for per-stock stages, and 0 or 1 for the others
+        '''
+        names = [stage for stage, inputs in CONST_PIPELINE_STAGES]
+        if until not in names:
+            raise ValueError('unknown pipeline stage: ' + str(until))
+        stages = names[:(names.index(until) + 1)]
+        first_forced = min([names.index(stage) for stage in force] or [len(names)])
+        forced = set(names[first_forced:])
+
+        summary = {stage: {'run': 0, 'reused': 0, 'skipped': 0} for stage in stages}
+
+        fetch = self.params['fetch']
+        if self.source is not None:
+            import fetcher
+            codes = self.codes if self.codes is not None else self.store.codes()
+            result = fetcher.Fetcher(self.source, self.store, **self.fetch_params).fetch(
+                codes, fetch['start_date'], fetch['end_date'])
+            if result['failed']:
+                raise RuntimeError('fetch failed for %d codes, run again to resume: %s'
+                                   % (len(result['failed']), sorted(result['failed'])))
+            summary['fetch'].update(run=result['fetched'], reused=result['skipped'])
+        if stages == ['fetch']:
+            return summary
+
+        # per-stock stages
+        codes = self.codes if self.codes is not None else self.store.codes()
+        # worker processes report to the parent's instrument through events
+        ins = instrument.current()
+        collect = ins.enabled and not self.use_threads
+        tasks = [(self.store.root, self.work_dir, code, self.params, 'samples' in stages, sorted(forced), collect)
+                 for code in codes]
+        if self.use_threads:
+            executor = ThreadPoolExecutor(max_workers=self.n_workers)
+        else:
+            executor = ProcessPoolExecutor(max_workers=self.n_workers)
+        with executor:
+            results = list(executor.map(_stock_task, tasks))
+
+        self._keys = {}
+        for code, keys, status, events in results:
+            ins.replay(events)
+            for stage, state in status.items():
+                summary[stage][state] += 1
+            if 'samples' in keys:
+                self._keys[code] = keys
+        if until in ['features', 'samples']:
+            return summary
+
+        # whole-set stages
+        labels_key = stage_key('labels', self.params['labels'],
+                               sorted((code, keys['samples']) for code, keys in self._keys.items()))
+        if 'labels' in forced or self._stamp('labels') != labels_key:
+            samples = self._assemble()
+            table = dp.label_samples(samples, self.params['labels']['profit_threshold'],
+                                     self.params['labels']['sigmoid_center'])
+            dp.save_sample_set(samples, os.path.join(self.work_dir, 'sample_set'), table=table,
+                               params={'pipeline': self.params, 'key': labels_key})
+            self._write_stamp('labels', labels_key)
+            summary['labels']['run'] = 1
+        else:
+            summary['labels']['reused'] = 1
+        if until == 'labels':
+            return summary
+
+        normalization_key = stage_key('normalization', self.params['normalization'], [labels_key])
+        if 'normalization' in forced or self._stamp('normalization') != normalization_key:
+            samples, table = self.sample_set()
+            normalization = self.params['normalization']
+            n_columns = len(dp.normalized_columns(normalization['groups']))
+            X_path = os.path.join(self.work_dir, 'X.npy')
+            tmp_path = os.path.join(self.work_dir, 'X.tmp.npy')
+            X = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.dtype(normalization['dtype']),
+                                          shape=(len(samples), samples.lookback, n_columns))
+            dp.normalize_samples(samples, groups=normalization['groups'], out=X)
+            X.flush()
+            del X
+            os.replace(tmp_path, X_path)
+            self._write_stamp('normalization', normalization_key)
+            summary['normalization']['run'] = 1
+        else:
+            summary['normalization']['reused'] = 1
+
+        return summary
+
+    def _assemble(self):
+        ''' Return the SampleSet of all checkpointed stocks, in code order
+        '''
+        codes = []
+        dates = []
+        features = []
+        index_frames = []
+        feature_columns = None
+        for code in sorted(self._keys):
+            keys = self._keys[code]
+            with np.load(_checkpoint_path(self.work_dir, 'features', code, keys['features'])) as arrays:
+                feature_columns = arrays['columns'].tolist()
+                dates.append(arrays['dates'])
+                features.append(arrays['values'])
+            with np.load(_checkpoint_path(self.work_dir, 'samples', code, keys['samples'])) as arrays:
+                sample_index = pd.DataFrame({col: arrays[col] for col in ['buy_location', 'sell_location', 'sell_reason']},
+                                            columns=['buy_location', 'sell_location', 'sell_reason'])
+            sample_index.insert(0, 'stock', len(codes))
+            index_frames.append(sample_index)
+            codes.append(code)
+
+        if feature_columns is None:
+            feature_columns = CONST_PIPELINE_BAR_COLUMNS + \
+                sb.feature_columns(self.params['features']['feature_set'], self.params['features'].get('N_BAR_LOWEST', 10))
+        index = pd.concat(index_frames, ignore_index=True) if index_frames else \
+            pd.DataFrame(columns=['stock', 'buy_location', 'sell_location', 'sell_reason'], dtype=np.int64)
+        samples = self.params['samples']
+        return dp.SampleSet(codes, dates, features, feature_columns, samples['lookback'], index,
+                            params={'multi_atr': samples['multi_atr'], 'n_low': samples['n_low']})
+
+    #
+    # outputs
+    #
+
+    def sample_set(self, mmap = True):
+        ''' Return (samples, table) of the last labels run, see
+            dataprep.load_sample_set()
+        '''
+        return dp.load_sample_set(os.path.join(self.work_dir, 'sample_set'), mmap=mmap)
+
+    def normalized(self, mmap = True):
+        ''' Return X of the last normalization run, rows in the order of
+            sample_set()
+        '''
+        return np.load(os.path.join(self.work_dir, 'X.npy'), mmap_mode='r' if mmap else None)
+
+
+#
+# per-stock stages
+#
+
+
+def _checkpoint_path(work_dir, stage, code, key):
+    return os.path.join(work_dir, stage, code, key + '.npz')
+
+
+def _write_checkpoint(work_dir, stage, code, key, arrays):
+    ''' Write the output of one stock's stage, then drop its older outputs
+    '''
+    stock_dir = os.path.join(work_dir, stage, code)
+    if os.path.isdir(stock_dir):
+        shutil.rmtree(stock_dir)
+    os.makedirs(stock_dir)
+    path = _checkpoint_path(work_dir, stage, code, key)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(path + '.tmp', path)
+
+
+def _stock_task(task):
+    ''' Run the features and samples stages of one stock, when not
+        checkpointed under their current key
+
+    Return (code, {stage: key}, {stage: 'run', 'reused' or 'skipped'},
+    events). With collect, the stage timings and counters of the stock are
+    recorded by an Instrument of this process, and returned as events for
+    Instrument.replay(), else events is empty.
+    '''
+    collect = task[-1]
+    events = []
+    if not collect:
+        return _stock_stages(*task[:-1]) + (events,)
+    with instrument.Instrument(callback=events.append):
+        return _stock_stages(*task[:-1]) + (events,)
+
+
+def _stock_stages(store_root, work_dir, code, params, with_samples, forced):
+    ''' Body of _stock_task()
+    '''
+    store = barstore.BarStore(store_root)
+    ins = instrument.current()
+
+    fetch = params['fetch']
+    bars = store.read(code, fetch['start_date'], fetch['end_date'])
+    stock_data = pd.DataFrame({col: bars[col] for col in CONST_PIPELINE_BAR_COLUMNS},
+                              index=pd.Index(days_to_dates(bars['date']).astype(object), name='date'),
+                              columns=CONST_PIPELINE_BAR_COLUMNS)
+
+    features = dict(params['features'])
+    drop_threshold = features.pop('drop_threshold')
+    feature_set = features.pop('feature_set')
+    if stock_data.shape[0] < drop_threshold:
+        ins.count('skip.short_history')
+        status = {'features': 'skipped'}
+        if with_samples:
+            status['samples'] = 'skipped'
+        return code, {}, status
+
+    keys = {'fetch': bar_fingerprint(stock_data)}
+    keys['features'] = stage_key('features', params['features'], [keys['fetch']])
+    keys['samples'] = stage_key('samples', params['samples'], [keys['features']])
+    status = {}
+
+    path = _checkpoint_path(work_dir, 'features', code, keys['features'])
+    if 'features' not in forced and os.path.isfile(path):
+        status['features'] = 'reused'
+        stock_data = None
+    else:
+        with ins.stage('features', items=stock_data.shape[0], code=code):
+            stock_data = stock_data.join(sb.stock_features(stock_data, feature_set, **features))
+        _write_checkpoint(work_dir, 'features', code, keys['features'],
+                          {'columns': np.array(stock_data.columns.tolist(), dtype=str),
+                           'dates': np.asarray(bars['date'], dtype=np.int32),
+                           'values': stock_data.values.astype(np.float64)})
+        status['features'] = 'run'
+    if not with_samples:
+        del keys['samples']
+        return code, keys, status
+
+    path = _checkpoint_path(work_dir, 'samples', code, keys['samples'])
+    if 'samples' not in forced and os.path.isfile(path):
+        status['samples'] = 'reused'
+        return code, keys, status
+
+    if stock_data is None:
+        with np.load(_checkpoint_path(work_dir, 'features', code, keys['features'])) as arrays:
+            stock_data = pd.DataFrame(arrays['values'], columns=arrays['columns'].tolist(),
+                                      index=pd.Index(days_to_dates(arrays['dates']).astype(object), name='date'))
+    samples = params['samples']
+    sample_index = dp.generate_sample_index(stock_data.assign(code=code), lookback=samples['lookback'],
+                                            multi_atr=samples['multi_atr'], n_low=samples['n_low'])
+    _write_checkpoint(work_dir, 'samples', code, keys['samples'],
+                      {col: sample_index[col].values.astype(np.int64) for col in sample_index.columns})
+    status['samples'] = 'run'
+
+    return code, keys, status
+
+
+#
+# command line
+#
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Build labeled, normalized samples from a bar store, resumably')
+    parser.add_argument('--store', required=True, help='root directory of the bar store')
+    parser.add_argument('--work', required=True, help='directory of the checkpoints and outputs')
+    parser.add_argument('--params', default=None, help='JSON file of per stage parameters, {stage: {name: value}}')
+    parser.add_argument('--codes', default=None, help='comma separated stock codes, or a file of one code per line')
+    parser.add_argument('--start', default=None, help='first date, YYYY-MM-DD')
+    parser.add_argument('--end', default=None, help='last date, YYYY-MM-DD')
+    parser.add_argument('--tushare', action='store_true', help='fetch missing bars from tushare')
+    parser.add_argument('--csv', default=None, help='fetch missing bars from a CSV file or directory')
+    parser.add_argument('--rate-limit', type=float, default=None, help='maximum fetch requests per second')
+    parser.add_argument('--until', default='normalization', help='last stage to run')
+    parser.add_argument('--force', default='', help='comma separated stages to rerun')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threads', action='store_true', help='use threads instead of processes')
+    parser.add_argument('--report', default=None, help='JSON file for the instrument report')
+    args = parser.parse_args(argv)
+
+    params = {}
+    if args.params:
+        with open(args.params) as f:
+            params = json.load(f)
+    if args.start or args.end:
+        params.setdefault('fetch', {}).update({'start_date': args.start, 'end_date': args.end})
+
+    codes = None
+    if args.codes:
+        if os.path.isfile(args.codes):
+            with open(args.codes) as f:
+                codes = [line.strip() for line in f if line.strip()]
+        else:
+            codes = args.codes.split(',')
+
+    source = None
+    if args.tushare or args.csv:
+        import fetcher
+        source = fetcher.FileSource(args.csv) if args.csv else fetcher.TushareSource()
+        if not (args.start and args.end):
+            parser.error('fetching needs --start and --end')
+        if codes is None:
+            parser.error('fetching needs --codes')
+
+    pipeline = Pipeline(args.store, args.work, params=params, codes=codes, source=source,
+                        n_workers=args.workers, use_threads=args.threads,
+                        fetch_params={'rate_limit': args.rate_limit})
+    with instrument.Instrument() as ins:
+        summary = pipeline.run(until=args.until, force=[stage for stage in args.force.split(',') if stage])
+    for stage, counts in summary.items():
+        print('%-14s run %6d   reused %6d   skipped %6d' % (stage, counts['run'], counts['reused'], counts['skipped']))
+    if args.report:
+        ins.to_json(args.report)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
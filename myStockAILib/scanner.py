@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+'''
+Cross-sectional scanner of the squeeze buy rule, bar by bar.
+
+The indicator states of all stocks are kept side by side, in (stocks,)
+arrays and (stocks, window) rings, so a new bar or quote snapshot of the
+whole universe is one vectorized pass: update the indicators, apply the
+buy rule of stockbasic.squeeze_buy_points(), and rank the candidates with
+their ATR stop prices.
+
+    >>> scanner = Scanner.from_frame(all_data)  # seeded from history, once
+    >>> quotes = ts.get_realtime_quotes(list(scanner.codes)).set_index('code')
+    >>> scanner.scan(quotes)  # intraday: today's bar so far, not committed
+    >>> scanner.scan(today_bars, commit=True)  # after the close
+'''
+
+import numpy as np
+import pandas as pd
+import talib
+
+import stockbasic as sb
+
+
+# features kept per stock, see Scanner.values
+CONST_SCANNER_COLUMNS = ['SQUEEZE', 'MTMMA', 'HIST5', 'MACD6', 'ATR']
+
+
+#
+# Scanner
+#
+
+
+class Scanner(object):
+    ''' Latest indicator values of many stocks, advanced one bar at a time
+
+    Explain
+    =======
+    Holds what the buy rule and the ATR stop need: 'SQUEEZE' and 'MTMMA'
+    as stockbasic.ttm_squeeze(), 'HIST5' and 'MACD6' (TTM Wave C) as
+    stockbasic.ttm_wave(), and 'ATR' as stockbasic.talib_atr(), plus the
+    recursions behind them (EMAs, Wilder ATRs, and the last bars of the
+    moving windows). They follow the same arithmetic as TA-Lib, so values
+    match the batch functions up to float rounding.
+
+    A stock with no bar (NaN price) in an update keeps its state. A stock
+    whose history was too short to seed an indicator stays NaN for it,
+    and is never a candidate, until seeded again with more history.
+
+    Attributes
+    ==========
+    codes: numpy.ndarray of str
+        stock code, per row
+    columns: list of str
+        CONST_SCANNER_COLUMNS
+    values: numpy.ndarray of float
+        (stocks, features) latest committed values, columns as columns
+    prev_squeeze: numpy.ndarray of float
+        'SQUEEZE' of the bar before the latest committed one
+
+    Example
+    =======
+    >>> scanner = Scanner.from_frame(all_data)
+    >>> candidates = scanner.scan(high, low, close)  # arrays, in scanner.codes order
+    >>> candidates[['code', 'close', 'stop_price']].head(10)
+    '''
+
+    def __init__(self, codes, MULTKC = 1.5, MULT = 1.5, LENGTHKC = 20, LENGTHBB = 20, LENGTHMOM = 12,
+                 SHORT = 8, MID_C = 233, LONG_C = 377, ATR_LENGTH = 14, multi_atr = 2.):
+        self.codes = np.asarray(codes, dtype=object)
+        self.columns = list(CONST_SCANNER_COLUMNS)
+        self.MULTKC = MULTKC
+        self.MULT = MULT
+        self.LENGTHKC = LENGTHKC
+        self.LENGTHBB = LENGTHBB
+        self.LENGTHMOM = LENGTHMOM
+        self.SHORT = SHORT
+        self.MID_C = MID_C
+        self.LONG_C = LONG_C
+        self.ATR_LENGTH = ATR_LENGTH
+        self.multi_atr = multi_atr
+
+        n = self.codes.shape[0]
+        # recursions, NaN until seeded
+        self.state = {name: np.full(n, np.nan)
+                      for name in ['prev_close', 'ema_fast', 'ema_mid', 'ema_long', 'ema_signal', 'atr_kc', 'atr']}
+        # last bars of the moving windows, oldest first
+        self.closes = np.full((n, max(LENGTHKC, LENGTHBB, LENGTHMOM + 1)), np.nan)
+        self.mtms = np.full((n, LENGTHMOM), np.nan)
+        self.values = np.full((n, len(self.columns)), np.nan)
+        self.prev_squeeze = np.full(n, np.nan)
+
+    @classmethod
+    def from_frame(cls, all_data, **params):
+        ''' Create a scanner, seeded with the history of every stock
+
+        Input
+        =====
+        all_data: MultiIndex DataFrame
+            indexed by 'code' and 'date', with 'high', 'low', 'close', such
+            as fetch_raw_data() or BarStore.load_frame() output
+        params:
+            parameters of Scanner()
+
+        Output
+        ======
+        Return: Scanner
+        '''
+        groups = list(all_data.groupby(level=0, sort=True))
+        scanner = cls([code for code, _ in groups], **params)
+        for row, (code, stock_data) in enumerate(groups):
+            scanner.seed(row, stock_data['high'].values, stock_data['low'].values, stock_data['close'].values)
+        return scanner
+
+    def seed(self, row, high, low, close):
+        ''' Set the state of one stock from its whole history, oldest bar first
+        '''
+        high = np.ascontiguousarray(high, dtype=np.float64)
+        low = np.ascontiguousarray(low, dtype=np.float64)
+        close = np.ascontiguousarray(close, dtype=np.float64)
+        if close.shape[0] == 0:
+            return
+
+        # same calls as stockbasic.stock_features()
+        ema_fast = talib.EMA(close, timeperiod=self.SHORT)
+        ema_mid = talib.EMA(close, timeperiod=self.MID_C)
+        ema_long = talib.EMA(close, timeperiod=self.LONG_C)
+        macd = ema_fast - ema_mid
+        ema_signal = talib.EMA(macd, timeperiod=self.MID_C) if np.any(~np.isnan(macd)) else np.full(close.shape, np.nan)
+        atr_kc = talib.ATR(high, low, close, timeperiod=self.LENGTHKC)
+        atr = talib.ATR(high, low, close, timeperiod=self.ATR_LENGTH)
+        for name, values in [('ema_fast', ema_fast), ('ema_mid', ema_mid), ('ema_long', ema_long),
+                             ('ema_signal', ema_signal), ('atr_kc', atr_kc), ('atr', atr), ('prev_close', close)]:
+            self.state[name][row] = values[-1]
+
+        window = self.closes.shape[1]
+        self.closes[row] = np.nan
+        self.closes[row, -min(window, close.shape[0]):] = close[-window:]
+        mtm = np.full(close.shape, np.nan)
+        mtm[self.LENGTHMOM:] = close[self.LENGTHMOM:] - close[:-self.LENGTHMOM]
+        self.mtms[row] = np.nan
+        self.mtms[row, -min(self.LENGTHMOM, close.shape[0]):] = mtm[-self.LENGTHMOM:]
+
+        features = sb.stock_features(pd.DataFrame({'high': high, 'low': low, 'close': close}),
+                                     feature_set=['squeeze', 'wave', 'atr'],
+                                     MULTKC=self.MULTKC, MULT=self.MULT, LENGTHKC=self.LENGTHKC,
+                                     LENGTHBB=self.LENGTHBB, LENGTHMOM=self.LENGTHMOM, SHORT=self.SHORT,
+                                     MID_C=self.MID_C, LONG_C=self.LONG_C, ATR_LENGTH=self.ATR_LENGTH)
+        self.values[row] = features[self.columns].values[-1]
+        self.prev_squeeze[row] = features['SQUEEZE'].values[-2] if close.shape[0] > 1 else np.nan
+
+    def _bar_arrays(self, high, low, close):
+        ''' Return high, low, close as float arrays in codes order
+        '''
+        if isinstance(high, pd.DataFrame):
+            bars = high.reindex(self.codes)
+            # realtime quotes carry the last price as 'price', and all values as strings
+            close_column = 'close' if 'close' in bars.columns else 'price'
+            high, low, close = [pd.to_numeric(bars[col], errors='coerce').values.astype(np.float64)
+                                for col in ['high', 'low', close_column]]
+            # a suspended stock is quoted at 0
+            no_quote = ~((high > 0) & (low > 0) & (close > 0))
+            high, low, close = [np.where(no_quote, np.nan, values) for values in (high, low, close)]
+        return (np.asarray(high, dtype=np.float64),
+                np.asarray(low, dtype=np.float64),
+                np.asarray(close, dtype=np.float64))
+
+    def _step(self, high, low, close):
+        ''' Return the state and values after one more bar, without keeping them
+        '''
+        state = self.state
+        traded = ~(np.isnan(high) | np.isnan(low) | np.isnan(close))
+
+        # Wilder ATRs, as stockstate.AtrState
+        prev_close = state['prev_close']
+        true_range = np.maximum(high - low, np.maximum(np.abs(prev_close - high), np.abs(prev_close - low)))
+        atr_kc = (state['atr_kc'] * (self.LENGTHKC - 1) + true_range) / self.LENGTHKC
+        atr = (state['atr'] * (self.ATR_LENGTH - 1) + true_range) / self.ATR_LENGTH
+
+        # EMAs, as stockstate.EmaState
+        def ema(value, prev, period):
+            return ((value - prev) * (2.0 / (period + 1))) + prev
+
+        ema_fast = ema(close, state['ema_fast'], self.SHORT)
+        ema_mid = ema(close, state['ema_mid'], self.MID_C)
+        ema_long = ema(close, state['ema_long'], self.LONG_C)
+        macd = ema_fast - ema_mid
+        ema_signal = ema(macd, state['ema_signal'], self.MID_C)
+
+        # moving windows
+        closes = np.concatenate([self.closes[:, 1:], close[:, None]], axis=1)
+        mtm = close - closes[:, -(self.LENGTHMOM + 1)]
+        mtms = np.concatenate([self.mtms[:, 1:], mtm[:, None]], axis=1)
+
+        # squeeze: Bolling Band inside Keltner Channel
+        bb_window = closes[:, -self.LENGTHBB:]
+        middle = bb_window.mean(axis=1)
+        mean2 = (bb_window * bb_window).mean(axis=1) - middle * middle
+        stddev = np.sqrt(np.where(mean2 < 0.00000001, 0., mean2)) * self.MULT
+        ma = middle if self.LENGTHKC == self.LENGTHBB else closes[:, -self.LENGTHKC:].mean(axis=1)
+        with np.errstate(invalid='ignore'):
+            squeeze_true = (middle - stddev > ma - atr_kc * self.MULTKC) & (middle + stddev < ma + atr_kc * self.MULTKC)
+        squeeze = np.where(squeeze_true, sb.CONST_SQUEEZE_ONGOING, sb.CONST_SQUEEZE_RELEASED).astype(np.float64)
+
+        values = np.stack([squeeze, mtms.mean(axis=1), macd - ema_signal, ema_fast - ema_long, atr], axis=1)
+        new_state = {'prev_close': close, 'ema_fast': ema_fast, 'ema_mid': ema_mid, 'ema_long': ema_long,
+                     'ema_signal': ema_signal, 'atr_kc': atr_kc, 'atr': atr}
+
+        # stocks without a bar keep their state
+        for name in new_state:
+            new_state[name] = np.where(traded, new_state[name], state[name])
+        closes[~traded] = self.closes[~traded]
+        mtms[~traded] = self.mtms[~traded]
+        values[~traded] = self.values[~traded]
+        prev_squeeze = np.where(traded, self.values[:, 0], self.prev_squeeze)
+
+        return new_state, closes, mtms, values, prev_squeeze, traded
+
+    def scan(self, high, low = None, close = None, commit = False, top_n = None):
+        ''' Function to apply the buy rule to a new bar, or quote snapshot, of all stocks
+
+        Explain
+        =======
+        Same RULE as stockbasic.squeeze_buy_points(): TTM Wave C ('HIST5'
+        and 'MACD6') above 0, and 'SQUEEZE' ongoing or on its first bar of
+        release. Candidates are ranked by squeeze momentum in ATRs, ie.
+        'MTMMA' / 'ATR', highest first. The stop price is
+        close - multi_atr * 'ATR', as stockbasic.get_sell_points().
+
+        Input
+        =====
+        high, low, close: numpy.ndarray
+            prices of the bar, one per stock in codes order, NaN for a stock
+            without a bar. Or high is a DataFrame indexed by code, with
+            'high', 'low' and 'close' (or 'price'), such as tushare's
+            get_realtime_quotes(). Its values may be strings; a blank or
+            non-positive price means no bar.
+        commit: bool
+            keep the bar as the new latest bar, eg. after the close. A
+            snapshot of a bar still forming is not committed, so the next
+            snapshot of the same bar starts from the same state.
+        top_n: int, optional
+            return only the first top_n candidates
+
+        Output
+        ======
+        Return: DataFrame
+            one row per candidate, ranked, with 'code', 'close', 'ATR',
+            'stop_price', 'rank', 'first_release' (bool: on the first bar of
+            squeeze release) and 'HIST5', 'MACD6', 'MTMMA'
+        '''
+        high, low, close = self._bar_arrays(high, low, close)
+        state, closes, mtms, values, prev_squeeze, traded = self._step(high, low, close)
+        if commit:
+            self.state, self.closes, self.mtms = state, closes, mtms
+            self.values, self.prev_squeeze = values, prev_squeeze
+
+        squeeze, mtmma, hist5, macd6, atr = values.T
+        with np.errstate(invalid='ignore'):
+            wave_c_positive = (hist5 > 0) & (macd6 > 0)
+            first_release = (squeeze == sb.CONST_SQUEEZE_RELEASED) & (prev_squeeze == sb.CONST_SQUEEZE_ONGOING)
+            buy = traded & wave_c_positive & ((squeeze == sb.CONST_SQUEEZE_ONGOING) | first_release) & (atr > 0)
+            candidates = np.flatnonzero(buy)
+            rank = mtmma[candidates] / atr[candidates]
+        candidates = candidates[np.argsort(-rank, kind='mergesort')][:top_n]
+        rank = mtmma[candidates] / atr[candidates]
+
+        return pd.DataFrame({'code': self.codes[candidates],
+                             'close': close[candidates],
+                             'ATR': atr[candidates],
+                             'stop_price': close[candidates] - atr[candidates] * self.multi_atr,
+                             'rank': rank,
+                             'first_release': first_release[candidates],
+                             'HIST5': hist5[candidates],
+                             'MACD6': macd6[candidates],
+                             'MTMMA': mtmma[candidates]},
+                            columns=['code', 'close', 'ATR', 'stop_price', 'rank', 'first_release',
+                                     'HIST5', 'MACD6', 'MTMMA'])
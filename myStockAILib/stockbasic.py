@@ -85,7 +85,7 @@ def ttm_squeeze(stock_data, MULTKC = 1.5, MULT = 1.5, LENGTHKC = 20, LENGTHBB =
     newdf['LOWERBB'] = LOWERBB
 
     squeeze_true = (newdf['LOWERBB'] > newdf['LOWERKC']) & (newdf['UPPERBB'] < newdf['UPPERKC'])
-    newdf['SQUEEZE'] = [CONST_SQUEEZE_ONGOING if x else CONST_SQUEEZE_RELEASED for x in squeeze_true]
+    newdf['SQUEEZE'] = np.where(squeeze_true.values, CONST_SQUEEZE_ONGOING, CONST_SQUEEZE_RELEASED).astype(np.int64)
 
     MTM = stock_data['close'] - stock_data['close'].shift(LENGTHMOM)
     MTMMA = talib.MA(MTM.values, timeperiod=LENGTHMOM)
@@ -280,6 +280,348 @@ def talib_nbarlow(stock_data, N_BAR_LOWEST = 10):
     return newdf
 
 
+#
+# indicator bank
+#
+
+
+def _bank(values, periods, one_series):
+    ''' Apply one_series(series, period) for each period and each series of
+        values, into one preallocated block
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    periods = [int(period) for period in periods]
+    series = values.reshape(values.shape[0], -1).T
+    block = np.empty((values.shape[0], len(periods), series.shape[0]), dtype=np.float64)
+    for j, one in enumerate(series):
+        one = np.ascontiguousarray(one)
+        for i, period in enumerate(periods):
+            block[:, i, j] = one_series(one, period)
+    return block[:, :, 0] if values.ndim == 1 else block
+
+
+def ema_bank(values, periods):
+    ''' Function to calculate EMAs of many periods at once
+
+    Explain
+    =======
+    Same values as talib.EMA() of each period. Each period is TA-Lib's own
+    recursion, written into one block, which is faster than stepping all
+    periods together in numpy. Leading NaN is skipped, as TA-Lib does.
+
+    Input
+    =====
+    values: numpy.ndarray
+        (bars,) series, or (bars, series) array, eg. close of many stocks
+    periods: list of int
+
+    Output
+    ======
+    Return: numpy.ndarray
+        (bars, periods), or (bars, periods, series) for a 2-D values
+
+    Example
+    =======
+    >>> fan = ema_bank(stock_data['close'].values, [8, 34, 55, 89, 144, 233, 377])
+    '''
+    return _bank(values, periods, lambda one, period: talib.EMA(one, timeperiod=period))
+
+
+def ma_bank(values, periods):
+    ''' Function to calculate simple moving averages of many periods at once
+
+    Explain
+    =======
+    Same values as talib.MA() of each period. See ema_bank() for Input and
+    Output.
+    '''
+    return _bank(values, periods, lambda one, period: talib.MA(one, timeperiod=period))
+
+
+def rolling_extreme(values, window, extreme = np.minimum):
+    ''' Function to calculate the rolling minimum (or maximum) of window bars
+
+    Explain
+    =======
+    van Herk / Gil-Werman algorithm: values are cut into blocks of window
+    bars, and each window is the extreme of a suffix of one block and a
+    prefix of the next. Block prefixes and suffixes are cumulative extremes,
+    so the cost is O(n) whatever window is, in a few numpy passes instead of
+    a per-bar loop. Same values as talib.MIN() / talib.MAX(); a window with
+    a NaN is NaN.
+
+    Input
+    =====
+    values: numpy.ndarray
+        (bars,) or (bars, series) array
+    window: int
+        number of bars, ending at (and including) each bar
+    extreme: numpy.minimum or numpy.maximum
+
+    Output
+    ======
+    Return: numpy.ndarray
+        same shape as values, NaN on the first (window - 1) bars
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[0]
+    out = np.full(values.shape, np.nan)
+    if window < 1 or n < window:
+        return out
+
+    # pad to whole blocks, with a value never picked
+    padding = np.inf if extreme is np.minimum else -np.inf
+    n_blocks = -(-n // window)
+    padded = np.full((n_blocks * window,) + values.shape[1:], padding)
+    padded[:n] = values
+    blocks = padded.reshape((n_blocks, window) + values.shape[1:])
+
+    prefix = extreme.accumulate(blocks, axis=1).reshape(padded.shape)
+    suffix = extreme.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+    out[(window - 1):] = extreme(suffix[:(n - window + 1)], prefix[(window - 1):n])
+
+    return out
+
+
+def nbar_extreme_bank(values, periods, extreme = np.minimum):
+    ''' Function to calculate N-bar extremes of many N at once
+
+    Explain
+    =======
+    Extreme of the previous N bars, not including the current bar, as
+    talib_nbarlow() does for 'LOW<N>'. See rolling_extreme().
+
+    Input
+    =====
+    values: numpy.ndarray
+        (bars,) or (bars, series) array, eg. 'low' for 'LOW<N>', 'high'
+        for 'HIGH<N>'
+    periods: list of int
+        the N's
+    extreme: numpy.minimum or numpy.maximum
+
+    Output
+    ======
+    Return: numpy.ndarray
+        (bars, periods), or (bars, periods, series) for a 2-D values
+
+    Example
+    =======
+    >>> lows = nbar_extreme_bank(stock_data['low'].values, [5, 10, 20, 60])  # LOW5 ... LOW60
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    block = np.full((values.shape[0], len(periods)) + values.shape[1:], np.nan)
+    for i, period in enumerate(periods):
+        block[1:, i] = rolling_extreme(values, int(period), extreme)[:-1]
+    return block
+
+
+def indicator_bank(stock_data, ema = (), ma = (), low = (), high = ()):
+    ''' Function to calculate families of indicators, over many periods, at once
+
+    Explain
+    =======
+    Columns are named as the single-period functions name them: 'EMA<N>'
+    of close as ttm_propulsion(), 'LOW<N>' as talib_nbarlow(), and
+    likewise 'MA<N>' of close and 'HIGH<N>', the previous N bars' high.
+    One block holds all columns, so there is no join per period.
+
+    Input
+    =====
+    stock_data: DataFrame
+        with 'close', 'low' and 'high' as needed
+    ema, ma, low, high: list of int
+        periods of each family
+
+    Output
+    ======
+    Return: DataFrame
+        with 'EMA<N>', then 'MA<N>', 'LOW<N>', 'HIGH<N>' columns, use the
+        same index from Input stock_data
+
+    Example
+    =======
+    >>> stock_data = stock_data.join(indicator_bank(stock_data, ema=[8, 21, 55], low=[5, 10, 20, 60]))
+    '''
+    families = [('EMA', 'close', ema, ema_bank),
+                ('MA', 'close', ma, ma_bank),
+                ('LOW', 'low', low, lambda values, periods: nbar_extreme_bank(values, periods, np.minimum)),
+                ('HIGH', 'high', high, lambda values, periods: nbar_extreme_bank(values, periods, np.maximum))]
+
+    columns = [prefix + str(period) for prefix, _, periods, _ in families for period in periods]
+    block = np.empty((stock_data.shape[0], len(columns)), dtype=np.float64)
+    first = 0
+    for prefix, col, periods, bank in families:
+        if len(periods) > 0:
+            block[:, first:(first + len(periods))] = bank(stock_data[col].values, periods)
+            first += len(periods)
+
+    return pd.DataFrame(block, index=stock_data.index, columns=columns, copy=False)
+
+
+#
+# stock_features
+#
+
+# feature groups known by stock_features(), in the order of their columns
+CONST_FEATURE_SET_ALL = ['propulsion', 'squeeze', 'wave', 'adx', 'atr', 'nbarlow']
+
+
+def feature_columns(feature_set = CONST_FEATURE_SET_ALL, N_BAR_LOWEST = 10):
+    ''' Function to list the columns stock_features() produces
+
+    Input
+    =====
+    feature_set: list of str
+        feature groups, see stock_features()
+    N_BAR_LOWEST: int
+        N of the 'LOW<N>' column
+
+    Output
+    ======
+    Return: list of str
+        column names, in order
+    '''
+    group_columns = {'propulsion': ['EMA8', 'EMA21'],
+                     'squeeze': ['SQUEEZE', 'MTMMA'],
+                     'wave': ['HIST1', 'HIST2', 'HIST3', 'HIST4', 'HIST5', 'MACD6'],
+                     'adx': ['ADX'],
+                     'atr': ['ATR'],
+                     'nbarlow': ['LOW' + str(N_BAR_LOWEST)]}
+
+    columns = []
+    for group in CONST_FEATURE_SET_ALL:
+        if group in feature_set:
+            columns += group_columns[group]
+
+    return columns
+
+
+def stock_features(stock_data, feature_set = CONST_FEATURE_SET_ALL,
+                   MULTKC = 1.5, MULT = 1.5, LENGTHKC = 20, LENGTHBB = 20, LENGTHMOM = 12,
+                   SHORT = 8, MID_A = 34, LONG_A = 55, MID_B = 89, LONG_B = 144, MID_C = 233, LONG_C = 377,
+                   ADX_LENGTH = 14, ATR_LENGTH = 14, N_BAR_LOWEST = 10, compact = False):
+    ''' Function to calculate a set of features in one pass
+
+    Explain
+    =======
+    Fused version of ttm_propulsion(), ttm_squeeze(), ttm_wave(), talib_adx(),
+    talib_atr() and talib_nbarlow(). Intermediates shared by several features,
+    such as EMA(close, 8), MA(close, 20) and ATR of the same length, are
+    computed only once, and all float features are written into one
+    preallocated block.
+
+    Same column names and values as joining the separate functions, when
+    called with the same parameters.
+
+    Input
+    =====
+    stock_data: DataFrame
+        with OHLC, 'volume' and 'code' in each row
+    feature_set: list of str
+        feature groups to calculate, any of CONST_FEATURE_SET_ALL:
+            'propulsion': 'EMA8', 'EMA21', as ttm_propulsion()
+            'squeeze': 'SQUEEZE', 'MTMMA', as ttm_squeeze(MULTKC, MULT,
+                LENGTHKC, LENGTHBB, LENGTHMOM)
+            'wave': 'HIST1' to 'HIST5', 'MACD6', as ttm_wave(SHORT, MID_A,
+                LONG_A, MID_B, LONG_B, MID_C, LONG_C)
+            'adx': 'ADX', as talib_adx(ADX_LENGTH)
+            'atr': 'ATR', as talib_atr(ATR_LENGTH)
+            'nbarlow': 'LOW<N>', as talib_nbarlow(N_BAR_LOWEST)
+    compact: bool
+        store float features as float32 and 'SQUEEZE' as int8, instead of
+        float64 and int64. Indicators are still computed in float64.
+
+    Output
+    ======
+    Return: DataFrame
+        with the features in each row, use the same index from Input
+        stock_data
+
+    Example
+    =======
+    >>> # same as the six joins of ttm_propulsion() ... talib_nbarlow()
+    >>> stock_data = stock_data.join(stock_features(stock_data))
+    '''
+    columns = feature_columns(feature_set, N_BAR_LOWEST)
+    float_columns = [col for col in columns if col != 'SQUEEZE']
+
+    # one preallocated block for all float features
+    block = np.empty((stock_data.shape[0], len(float_columns)), dtype=np.float32 if compact else np.float64)
+    out = {col: block[:, i] for i, col in enumerate(float_columns)}
+
+    close = np.ascontiguousarray(stock_data['close'].values, dtype=np.float64)
+    if ('squeeze' in feature_set) or ('adx' in feature_set) or ('atr' in feature_set):
+        high = np.ascontiguousarray(stock_data['high'].values, dtype=np.float64)
+        low = np.ascontiguousarray(stock_data['low'].values, dtype=np.float64)
+
+    # shared intermediates, computed on first use
+    cache = {}
+
+    def ema_close(period):
+        if ('EMA', period) not in cache:
+            cache[('EMA', period)] = talib.EMA(close, timeperiod=period)
+        return cache[('EMA', period)]
+
+    def atr(period):
+        if ('ATR', period) not in cache:
+            cache[('ATR', period)] = talib.ATR(high, low, close, timeperiod=period)
+        return cache[('ATR', period)]
+
+    squeeze = None
+
+    if 'propulsion' in feature_set:
+        out['EMA8'][:] = ema_close(8)
+        out['EMA21'][:] = ema_close(21)
+
+    if 'squeeze' in feature_set:
+        # Bolling Band. Its middle band is MA(close, LENGTHBB)
+        UPPERBB, BOLL, LOWERBB = talib.BBANDS(close,
+                                              timeperiod=LENGTHBB,
+                                              nbdevup=MULT,
+                                              nbdevdn=MULT)
+        # Keltner Channel
+        MA = BOLL if LENGTHKC == LENGTHBB else talib.MA(close, timeperiod=LENGTHKC)
+        ATR = atr(LENGTHKC)
+        UPPERKC = MA + ATR * MULTKC
+        LOWERKC = MA - ATR * MULTKC
+
+        with np.errstate(invalid='ignore'):
+            squeeze_true = (LOWERBB > LOWERKC) & (UPPERBB < UPPERKC)
+        squeeze = np.where(squeeze_true, CONST_SQUEEZE_ONGOING, CONST_SQUEEZE_RELEASED).astype(
+            np.int8 if compact else np.int64)
+
+        MTM = np.full(close.shape, np.nan)
+        MTM[LENGTHMOM:] = close[LENGTHMOM:] - close[:-LENGTHMOM]
+        out['MTMMA'][:] = talib.MA(MTM, timeperiod=LENGTHMOM)
+
+    if 'wave' in feature_set:
+        FASTMA = ema_close(SHORT)
+        for col, period in [('HIST1', MID_A), ('HIST2', LONG_A), ('HIST3', MID_B),
+                            ('HIST4', LONG_B), ('HIST5', MID_C)]:
+            MACD = FASTMA - ema_close(period)
+            out[col][:] = MACD - talib.EMA(MACD, timeperiod=period)
+        out['MACD6'][:] = FASTMA - ema_close(LONG_C)
+
+    if 'adx' in feature_set:
+        out['ADX'][:] = talib.ADX(high, low, close, timeperiod=ADX_LENGTH)
+
+    if 'atr' in feature_set:
+        out['ATR'][:] = atr(ATR_LENGTH)
+
+    if 'nbarlow' in feature_set:
+        nbar_lowest = out['LOW' + str(N_BAR_LOWEST)]
+        nbar_lowest[0] = np.nan
+        nbar_lowest[1:] = talib.MIN(np.ascontiguousarray(stock_data['low'].values, dtype=np.float64),
+                                    timeperiod=N_BAR_LOWEST)[:-1]
+
+    newdf = pd.DataFrame(block, index=stock_data.index, columns=float_columns, copy=False)
+    if squeeze is not None:
+        newdf.insert(columns.index('SQUEEZE'), 'SQUEEZE', squeeze)
+
+    return newdf
+
+
 # define squeeze CONST
 CONST_SQUEEZE_RELEASED = -1
 CONST_SQUEEZE_ONGOING = 1
@@ -311,28 +653,17 @@ def is_squeeze_buy_point(stock_data, index):
         True or False
     '''
     ret = False
-    
-    #debug
-    verbose = False
 
     # test TTM Wave C > 0
     if (np.isnan(stock_data.loc[index, 'HIST5']) or  # Handle NaN
         np.isnan(stock_data.loc[index, 'MACD6']) or
         (stock_data.loc[index, 'HIST5'] <= 0) or
         (stock_data.loc[index, 'MACD6'] <= 0)):
-        
-        if verbose:
-            print(stock_data.loc[index, 'HIST5'], stock_data.loc[index, 'MACD6'])
-            print(index, 'HIST5 or MACD6 <= 0, return False')
-            
         ret = False
         return ret
     
     # test whether 'SQUEEZE' is on-going
     if (stock_data.loc[index, 'SQUEEZE'] == CONST_SQUEEZE_ONGOING):
-
-        if verbose:
-            print(index, ' Squeeze is on-going. return True')
         ret = True
         return ret
     
@@ -340,20 +671,95 @@ def is_squeeze_buy_point(stock_data, index):
     if (stock_data.loc[index, 'SQUEEZE'] == CONST_SQUEEZE_RELEASED):
         # check previous bar is 'SQUEEZE' ongoing?
         if (stock_data['SQUEEZE'].shift(1)[index] == CONST_SQUEEZE_ONGOING):
-            
-            if verbose:
-                print(index, ' squeeze is released. But yesterday it is ongoing. return True')
             ret = True
             return ret
     
-    if verbose:
-        print(index, ' nothing hit. return False')
-
     return ret
 
 
+#
+# squeeze_buy_points
+#
+
+
+def squeeze_buy_points(stock_data):
+    ''' Function to find all squeeze buy-points of a stock in one pass
+
+    Explain
+    =======
+    Vectorized version of is_squeeze_buy_point(). The same RULE is evaluated
+    over the whole series at once, instead of one index per call.
+
+    RULE
+    ====
+    Same as is_squeeze_buy_point():
+        a) TTM Wave C, ie. 'HIST5' and 'MACD6', must be greater than '0'. Then,
+        b) 'SQUEEZE' should be either ongoing, or on the first bar of releasing.
+    NaN in 'HIST5' or 'MACD6' is never a buy-point. The first bar has no
+    previous bar, so it can only be a buy-point when 'SQUEEZE' is ongoing.
+
+    Input
+    =====
+    stock_data: DataFrame
+        with features 'SQUEEZE', 'HIST5' and 'MACD6' ready
+
+    Output
+    ======
+    Return: numpy.ndarray of bool
+        one element per bar of stock_data, True for a buy-point.
+        Use numpy.flatnonzero() on it to get the integer positions.
+
+    Example
+    =======
+    >>> mask = squeeze_buy_points(stock_data)
+    >>> expected = [is_squeeze_buy_point(stock_data, i) for i in stock_data.index]
+    >>> (mask == np.array(expected)).all()
+    True
+    '''
+    return squeeze_buy_mask(stock_data['HIST5'].values,
+                            stock_data['MACD6'].values,
+                            stock_data['SQUEEZE'].values)
+
+
+def squeeze_buy_mask(hist5, macd6, squeeze):
+    ''' Function to find squeeze buy-points from plain arrays
+
+    Explain
+    =======
+    Array version of squeeze_buy_points(), along the last axis. So a
+    (stocks, bars) array of each input gives the buy-points of all stocks
+    at once.
+
+    Input
+    =====
+    hist5, macd6, squeeze: numpy.ndarray
+        'HIST5', 'MACD6' and 'SQUEEZE', bars along the last axis
+
+    Output
+    ======
+    Return: numpy.ndarray of bool
+        same shape as the inputs, True for a buy-point
+    '''
+    # test TTM Wave C > 0. NaN compares as False, so it is never a buy-point.
+    with np.errstate(invalid='ignore'):
+        wave_c_positive = (hist5 > 0) & (macd6 > 0)
+
+    # 'SQUEEZE' is on-going
+    squeeze_ongoing = (squeeze == CONST_SQUEEZE_ONGOING)
+
+    # first bar of 'SQUEEZE' release: previous bar is 'SQUEEZE' ongoing
+    prev_squeeze_ongoing = np.zeros(squeeze_ongoing.shape, dtype=bool)
+    prev_squeeze_ongoing[..., 1:] = squeeze_ongoing[..., :-1]
+    squeeze_first_release = (squeeze == CONST_SQUEEZE_RELEASED) & prev_squeeze_ongoing
+
+    return wave_c_positive & (squeeze_ongoing | squeeze_first_release)
+
+
+CONST_SELL_REASON_NONE = 0
 CONST_SELL_REASON_STOP_LOSS = 1
 CONST_SELL_REASON_N_LOW =2
+CONST_SELL_REASON_TIME_STOP = 3
+CONST_SELL_REASON_TRAILING_STOP = 4
 
 #
 # get_sell_point
@@ -430,3 +836,251 @@ def get_sell_point(stock_data, buy_index, multi_atr = 2., n_low = 10):
     return sell_index, sell_reason
 
 
+#
+# first_close_at_or_below
+#
+
+
+def first_close_at_or_below(close, start_locations, thresholds):
+    ''' Function to find, for many entries at once, the first bar whose close
+        is at or below the entry's threshold
+
+    Explain
+    =======
+    Build a sparse table of range-minimum of 'close', then binary-search all
+    entries together, one table level at a time. Cost is O(n log n) to build
+    and O(m log n) to query m entries, without a Python loop over entries.
+
+    Input
+    =====
+    close: numpy.ndarray
+        close prices. NaN never triggers.
+    start_locations: numpy.ndarray of int
+        first bar to check, per entry
+    thresholds: numpy.ndarray of float
+        trigger level, per entry. NaN never triggers.
+
+    Output
+    ======
+    Return: numpy.ndarray of int
+        position of the first hit, per entry, or len(close) if never hit.
+    '''
+    n = close.shape[0]
+    pos = np.asarray(start_locations, dtype=np.int64).copy()
+    thresholds = np.where(np.isnan(thresholds), -np.inf, thresholds)
+    if n == 0 or pos.size == 0:
+        return np.minimum(pos, n)
+
+    # min_tables[k][i] = min(close[i:i + 2**k])
+    min_tables = [np.where(np.isnan(close), np.inf, close)]
+    while (1 << len(min_tables)) <= n:
+        prev = min_tables[-1]
+        half = 1 << (len(min_tables) - 1)
+        level = prev.copy()
+        level[:n - half] = np.minimum(prev[:n - half], prev[half:])
+        min_tables.append(level)
+
+    # skip forward over blocks that have no close at or below the threshold
+    for k in range(len(min_tables) - 1, -1, -1):
+        step = 1 << k
+        can_skip = pos + step <= n
+        probe = np.minimum(pos, n - 1)
+        can_skip &= min_tables[k][probe] > thresholds
+        pos[can_skip] += step
+
+    return np.minimum(pos, n)
+
+
+#
+# exit rules
+#
+
+
+def time_stop_rule(max_hold_bars):
+    ''' Function to create a time stop exit rule, for get_sell_points()
+
+    Input
+    =====
+    max_hold_bars: int
+        sell on the max_hold_bars'th bar after the buy-point
+
+    Output
+    ======
+    Return: tuple
+        (CONST_SELL_REASON_TIME_STOP, rule function)
+    '''
+    def rule(close, atr, buy_locations, limit_locations):
+        hit = np.asarray(buy_locations, dtype=np.int64) + max_hold_bars
+        return np.minimum(hit, close.shape[0])
+
+    return CONST_SELL_REASON_TIME_STOP, rule
+
+
+def trailing_atr_stop_rule(multi_atr = 3.):
+    ''' Function to create a trailing ATR stop exit rule, for get_sell_points()
+
+    Explain
+    =======
+    The stop starts at (close - multi_atr * ATR) of the buy-point, and is
+    raised to (close - multi_atr * ATR) of each later bar when that is higher.
+    Sell on the first bar whose close is at or below the stop of the
+    previous bar.
+
+    The rule sweeps forward one bar offset at a time, vectorized over all
+    entries which are still open, and stops as soon as every entry either
+    hit the stop or reached the sell point found by the other rules.
+
+    Input
+    =====
+    multi_atr: float
+        multiple of ATR below each bar's close to put that bar's stop level at
+
+    Output
+    ======
+    Return: tuple
+        (CONST_SELL_REASON_TRAILING_STOP, rule function)
+    '''
+    def rule(close, atr, buy_locations, limit_locations):
+        n = close.shape[0]
+        buy_locations = np.asarray(buy_locations, dtype=np.int64)
+        hit = np.full(buy_locations.shape, n, dtype=np.int64)
+        if n == 0 or buy_locations.size == 0:
+            return hit
+
+        stop_levels = close - atr * multi_atr
+        stop_levels[np.isnan(stop_levels)] = -np.inf
+
+        stops = stop_levels[buy_locations]
+        active = np.arange(buy_locations.shape[0])
+        offset = 1
+        while active.size > 0:
+            locations = buy_locations[active] + offset
+            # stop at the end of data, or where another rule already sells
+            still_open = (locations < n) & (locations <= limit_locations[active])
+            active = active[still_open]
+            locations = locations[still_open]
+
+            with np.errstate(invalid='ignore'):
+                triggered = close[locations] <= stops[active]
+            hit[active[triggered]] = locations[triggered]
+
+            active = active[~triggered]
+            locations = locations[~triggered]
+            stops[active] = np.maximum(stops[active], stop_levels[locations])
+            offset += 1
+
+        return hit
+
+    return CONST_SELL_REASON_TRAILING_STOP, rule
+
+
+#
+# get_sell_points
+#
+
+
+def get_sell_points(stock_data, buy_locations, multi_atr = 2., n_low = 10, exit_rules = None):
+    ''' Function to get sell points of many buy-points in one pass
+
+    Explain
+    =======
+    Batched version of get_sell_point(). All entries are resolved together,
+    so overlapping entries do not rescan the same bars.
+
+    Input
+    =====
+    stock_data: DataFrame
+        stock data with features
+    buy_locations: array of int
+        integer positions of the buy-points in stock_data, such as
+        numpy.flatnonzero(squeeze_buy_points(stock_data))
+    multi_atr: float
+        multiple of ATR as stop loss at
+    n_low: int
+        close breaks n_low bar's low
+    exit_rules: list of tuple, optional
+        extra exit rules, as returned by time_stop_rule() or
+        trailing_atr_stop_rule(). Each is (sell_reason, rule), where
+        rule(close, atr, buy_locations, limit_locations) returns the first
+        hit position per entry, or len(close) if not hit.
+
+    Output
+    ======
+    sell_locations: numpy.ndarray of int
+        integer position of the sell point per entry, or
+        -1, if cannot find sell point before the end
+    sell_reasons: numpy.ndarray of int
+        CONST_SELL_REASON_* per entry.
+        CONST_SELL_REASON_NONE if not reaching any sell point.
+
+    Features Required
+    =================
+    'close', 'ATR', 'LOW<n_low>'
+
+    RULE
+    ====
+    Same as get_sell_point(), checking each bar after the buy-point,
+        a) close price is lower than (multi_atr * ATR)
+        b) close lower than prvious n_low bars' low
+        c) then each extra exit rule, in the given order
+    When several rules hit on the same bar, the first one in this order wins.
+    '''
+    n_low_col_name = 'LOW' + str(n_low)
+
+    return resolve_sell_points(stock_data['close'].values,
+                               stock_data['ATR'].values,
+                               stock_data[n_low_col_name].values,
+                               buy_locations,
+                               multi_atr=multi_atr,
+                               exit_rules=exit_rules)
+
+
+def resolve_sell_points(close, atr, nbar_low, buy_locations, multi_atr = 2., exit_rules = None):
+    ''' Function to resolve sell points from plain arrays
+
+    Explain
+    =======
+    Array version of get_sell_points(). See get_sell_points() for RULE and
+    Output.
+
+    Input
+    =====
+    close, atr, nbar_low: numpy.ndarray
+        'close', 'ATR' and 'LOW<n>' of one stock
+    buy_locations: array of int
+        integer positions of the buy-points
+    multi_atr: float
+        multiple of ATR as stop loss at
+    exit_rules: list of tuple, optional
+        extra exit rules, see get_sell_points()
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    atr = np.asarray(atr, dtype=np.float64)
+    nbar_low = np.asarray(nbar_low, dtype=np.float64)
+    buy_locations = np.asarray(buy_locations, dtype=np.int64)
+    n = close.shape[0]
+
+    # a) stop loss: close at or below buy price - multi_atr * ATR
+    stop_prices = close[buy_locations] - atr[buy_locations] * multi_atr
+    sell_locations = first_close_at_or_below(close, buy_locations + 1, stop_prices)
+    sell_reasons = np.where(sell_locations < n, CONST_SELL_REASON_STOP_LOSS, CONST_SELL_REASON_NONE)
+
+    # b) N-bar low: close at or below previous n_low bars' low
+    with np.errstate(invalid='ignore'):
+        n_low_hits = np.flatnonzero(close <= nbar_low)
+    next_hit = np.searchsorted(n_low_hits, buy_locations, side='right')
+    n_low_locations = np.append(n_low_hits, n)[next_hit]
+    earlier = n_low_locations < sell_locations
+    sell_locations[earlier] = n_low_locations[earlier]
+    sell_reasons[earlier] = CONST_SELL_REASON_N_LOW
+
+    # c) extra exit rules
+    for sell_reason, rule in (exit_rules or []):
+        rule_locations = rule(close, atr, buy_locations, sell_locations)
+        earlier = rule_locations < sell_locations
+        sell_locations[earlier] = rule_locations[earlier]
+        sell_reasons[earlier] = sell_reason
+
+    sell_locations[sell_reasons == CONST_SELL_REASON_NONE] = -1
+
+    return sell_locations, sell_reasons
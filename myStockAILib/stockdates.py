@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+'''
+Vectorized date handling for the data layer.
+
+Dates are carried as int32 day numbers (days since 1970-01-01) from
+ingestion onward. Conversions to 'YYYY-MM-DD' strings and to matplotlib
+date numbers are vectorized, and date lookups are binary searches over the
+sorted day numbers of a stock, instead of string matching.
+'''
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+#
+# conversions
+#
+
+
+def dates_to_days(dates):
+    ''' Function to convert 'YYYY-MM-DD' strings (or datetime64) to int days since 1970-01-01
+
+    Input
+    =====
+    dates: array-like of str or numpy.datetime64, or of int day numbers
+
+    Output
+    ======
+    Return: numpy.ndarray of int32
+    '''
+    dates = np.asarray(dates)
+    if np.issubdtype(dates.dtype, np.integer):
+        # already day numbers, eg. the 'date' level of a compact frame
+        return dates.astype(np.int32)
+    return dates.astype('datetime64[D]').astype(np.int64).astype(np.int32)
+
+
+def days_to_dates(days):
+    ''' Function to convert int days since 1970-01-01 to 'YYYY-MM-DD' strings
+
+    Input
+    =====
+    days: array-like of int
+
+    Output
+    ======
+    Return: numpy.ndarray of str
+    '''
+    return np.datetime_as_string(np.asarray(days, dtype=np.int64).astype('datetime64[D]'), unit='D')
+
+
+# matplotlib date number of 1970-01-01 with the legacy epoch (0000-12-31),
+# the default before matplotlib 3.3. Since 3.3 the default epoch is 1970-01-01.
+CONST_MPL_LEGACY_EPOCH_OFFSET = 719163.
+
+_mpl_default_epoch_offset = None
+
+
+def _mpl_epoch_offset():
+    ''' Return the matplotlib date number of 1970-01-01, without importing matplotlib
+    '''
+    global _mpl_default_epoch_offset
+    mpl_dates = sys.modules.get('matplotlib.dates')
+    if mpl_dates is not None and hasattr(mpl_dates, 'get_epoch'):
+        # the epoch matplotlib.dates has settled on, at its first use
+        epoch = mpl_dates.get_epoch()
+        return (np.datetime64('1970-01-01T00:00:00', 'us') - np.datetime64(epoch, 'us')) / np.timedelta64(1, 'D')
+    rcParams = getattr(sys.modules.get('matplotlib'), 'rcParams', None)
+    if rcParams is not None:
+        epoch = rcParams.get('date.epoch')
+        if epoch is None:
+            return CONST_MPL_LEGACY_EPOCH_OFFSET
+        return (np.datetime64('1970-01-01T00:00:00', 'us') - np.datetime64(epoch, 'us')) / np.timedelta64(1, 'D')
+
+    # not imported: the default epoch of the installed version
+    if _mpl_default_epoch_offset is None:
+        from importlib import metadata
+        try:
+            version = tuple(int(part) for part in metadata.version('matplotlib').split('.')[:2])
+        except (metadata.PackageNotFoundError, ValueError):
+            version = (3, 3)
+        _mpl_default_epoch_offset = CONST_MPL_LEGACY_EPOCH_OFFSET if version < (3, 3) else 0.
+    return _mpl_default_epoch_offset
+
+
+def days_to_mpl_dates(days):
+    ''' Function to convert int days since 1970-01-01 to matplotlib date numbers
+
+    Explain
+    =======
+    Vectorized, and matplotlib is not imported. When matplotlib is already
+    imported, its rcParams['date.epoch'] is used, else the default epoch of
+    the installed matplotlib version.
+    '''
+    return np.asarray(days, dtype=np.float64) + _mpl_epoch_offset()
+
+
+def index_days(index):
+    ''' Function to get int day numbers of the dates of an index
+
+    Explain
+    =======
+    For a MultiIndex, the last level holds the dates. Only its unique values
+    are converted, then spread by the level codes.
+
+    Input
+    =====
+    index: Index or MultiIndex
+        dates as 'YYYY-MM-DD' strings or datetime64
+
+    Output
+    ======
+    Return: numpy.ndarray of int32
+        one element per index entry
+    '''
+    if isinstance(index, pd.MultiIndex):
+        level_days = dates_to_days(index.levels[-1].values)
+        return level_days[np.asarray(index.codes[-1])]
+    return dates_to_days(index.values)
+
+
+#
+# lookups
+#
+
+
+def date_locations(days, dates):
+    ''' Function to find positions of dates in a stock's sorted day numbers
+
+    Input
+    =====
+    days: numpy.ndarray of int
+        sorted day numbers of one stock, eg. index_days(stock_data.index)
+    dates: str, or array-like of str / int day numbers
+
+    Output
+    ======
+    Return: int, or numpy.ndarray of int
+        position of each date, -1 where the stock has no bar on that date
+    '''
+    scalar = np.ndim(dates) == 0
+    dates = np.atleast_1d(dates)
+    if not np.issubdtype(dates.dtype, np.integer):
+        dates = dates_to_days(dates)
+
+    locations = np.searchsorted(days, dates, side='left')
+    found = locations < days.shape[0]
+    found[found] = days[locations[found]] == dates[found]
+    locations = np.where(found, locations, -1)
+
+    return int(locations[0]) if scalar else locations
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+
+'''
+Fast rendering of stock charts.
+
+Same seven panels as dataprep.plot_stock_data() used to draw (k-line and
+EMAs, volume, MTMMA and SQUEEZE, TTM Wave C/B/A, ADX), but each series is
+drawn as one matplotlib collection instead of one patch per bar, and a
+range longer than the axes' pixel width is downsampled first.
+
+export_sample_charts() renders many sample windows to PNG files, over a
+pool of processes, on matplotlib's headless Agg canvas.
+'''
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import stockbasic as sb
+from stockdates import days_to_mpl_dates, index_days
+
+
+# columns drawn, besides 'mpl.date'
+CONST_CHART_COLUMNS = ['open', 'close', 'high', 'low', 'volume', 'EMA8', 'EMA21', 'MTMMA', 'SQUEEZE',
+                       'MACD6', 'HIST5', 'HIST4', 'HIST3', 'HIST2', 'HIST1', 'ADX']
+
+# histogram series, downsampled by keeping the value of largest magnitude
+CONST_CHART_HIST_COLUMNS = ['MTMMA', 'MACD6', 'HIST5', 'HIST4', 'HIST3', 'HIST2', 'HIST1']
+
+CONST_CHART_FIGSIZE = (15, 14)
+
+
+#
+# chart_arrays
+#
+
+
+def chart_arrays(stock_data):
+    ''' Function to extract the chart series of one stock, as numpy arrays
+
+    Input
+    =====
+    stock_data: DataFrame
+        one stock, indexed by 'date' (or 'code' and 'date'), with
+        CONST_CHART_COLUMNS, and optionally 'mpl.date'
+
+    Output
+    ======
+    Return: dict
+        column name to float array, including 'mpl.date'
+    '''
+    arrays = {col: np.asarray(stock_data[col].values, dtype=np.float64) for col in CONST_CHART_COLUMNS}
+    if 'mpl.date' in stock_data.columns:
+        arrays['mpl.date'] = np.asarray(stock_data['mpl.date'].values, dtype=np.float64)
+    else:
+        arrays['mpl.date'] = days_to_mpl_dates(index_days(stock_data.index))
+    return arrays
+
+
+#
+# downsample_chart
+#
+
+
+def downsample_chart(arrays, bucket):
+    ''' Function to merge every bucket consecutive bars into one
+
+    Explain
+    =======
+    OHLC merge as bars do (first open, highest high, lowest low, last close),
+    volume is summed, SQUEEZE is ongoing if ongoing on any bar, histograms
+    keep their value of largest magnitude, other lines keep their last
+    value. A merged bar is placed at the mean date of its bars.
+    '''
+    n = arrays['close'].shape[0]
+    starts = np.arange(0, n, bucket)
+    ends = np.append(starts[1:], n)
+    counts = ends - starts
+
+    merged = {'mpl.date': np.add.reduceat(arrays['mpl.date'], starts) / counts,
+              'open': arrays['open'][starts],
+              'close': arrays['close'][ends - 1],
+              'high': np.fmax.reduceat(arrays['high'], starts),
+              'low': np.fmin.reduceat(arrays['low'], starts),
+              'volume': np.add.reduceat(np.nan_to_num(arrays['volume']), starts),
+              'SQUEEZE': np.where(np.maximum.reduceat(arrays['SQUEEZE'] == sb.CONST_SQUEEZE_ONGOING, starts),
+                                  sb.CONST_SQUEEZE_ONGOING, sb.CONST_SQUEEZE_RELEASED)}
+    for col in CONST_CHART_HIST_COLUMNS:
+        with np.errstate(invalid='ignore'):
+            highest = np.fmax.reduceat(arrays[col], starts)
+            lowest = np.fmin.reduceat(arrays[col], starts)
+            merged[col] = np.where(np.abs(lowest) > np.abs(highest), lowest, highest)
+    for col in arrays:
+        if col not in merged:
+            merged[col] = arrays[col][ends - 1]
+
+    return merged
+
+
+#
+# ChartRenderer
+#
+
+
+def _rectangles(x, bottom, top, width):
+    ''' (n, 4, 2) vertices of n rectangles, centered on x
+    '''
+    left = x - width / 2.
+    right = x + width / 2.
+    return np.stack([np.stack([left, bottom], axis=1),
+                     np.stack([left, top], axis=1),
+                     np.stack([right, top], axis=1),
+                     np.stack([right, bottom], axis=1)], axis=1)
+
+
+class ChartRenderer(object):
+    ''' The seven chart panels on a matplotlib Figure, redrawable with new data
+
+    Explain
+    =======
+    Axes and artists are created once; draw() only replaces their data, so
+    rendering many charts on one figure skips the costly axes set up. Each
+    histogram is one PolyCollection, the candles are one LineCollection
+    (wicks) and one PolyCollection (bodies).
+
+    Input
+    =====
+    fig: matplotlib.figure.Figure
+        empty figure to draw on
+
+    Example
+    =======
+    >>> fig = Figure(figsize=(12, 10)); FigureCanvasAgg(fig)
+    >>> renderer = ChartRenderer(fig)
+    >>> for arrays, path in charts:
+    ...     renderer.draw(arrays)
+    ...     fig.savefig(path)
+    '''
+
+    def __init__(self, fig):
+        from matplotlib.collections import LineCollection, PolyCollection
+        from matplotlib.ticker import MaxNLocator
+
+        self.fig = fig
+        self.axes = fig.subplots(7, sharex=True, gridspec_kw={'height_ratios': [3, 1, 1, 1, 1, 1, 1]})
+        axes = self.axes
+        empty = np.zeros((0, 4, 2))
+
+        # axes[0]: k-line, EMA8, EMA21
+        self.wicks = LineCollection([], linewidths=0.5)
+        self.bodies = PolyCollection(empty, linewidths=0.5)
+        axes[0].add_collection(self.wicks)
+        axes[0].add_collection(self.bodies)
+        self.ema8, = axes[0].plot([], [], 'm', label='EMA8')
+        self.ema21, = axes[0].plot([], [], 'c', label='EMA21')
+        axes[0].legend(loc=0)
+        axes[0].set_ylabel('Price')
+        axes[0].xaxis_date()
+
+        # axes[1]: volume; axes[2]: MTMMA, and SQUEEZE; axes[3..5]: TTM WAVE C, B, A
+        # (axes, column, color, alpha, width), color None for green/red by sign
+        self.histograms = [(axes[1], 'volume', 'C0', 1., 0.5),
+                           (axes[2], 'MTMMA', None, 1., 0.8),
+                           (axes[3], 'MACD6', 'red', 0.8, 0.8),
+                           (axes[3], 'HIST5', 'orange', 0.8, 0.8),
+                           (axes[4], 'HIST4', 'magenta', 0.8, 0.8),
+                           (axes[4], 'HIST3', 'teal', 0.8, 0.8),
+                           (axes[5], 'HIST2', 'lawngreen', 0.8, 0.8),
+                           (axes[5], 'HIST1', 'yellow', 0.8, 0.8)]
+        self.bars = []
+        for ax, col, color, alpha, width in self.histograms:
+            collection = PolyCollection(empty, facecolors=color or 'g', edgecolors='none', alpha=alpha)
+            ax.add_collection(collection)
+            self.bars.append(collection)
+        self.squeeze, = axes[2].plot([], [], 'ko', label='SQUEEZE')
+
+        # axes[6]: ADX
+        self.adx, = axes[6].plot([], [], 'm', label='ADX')
+
+        for ax, label in zip(axes[1:], ['Volume', 'SQZ', 'WAVE C', 'WAVE B', 'WAVE A', 'ADX']):
+            ax.set_ylabel(label)
+            ax.yaxis.set_major_locator(MaxNLocator(3))
+        for ax in axes:
+            ax.grid(True)
+        self.marks = []
+
+    def draw(self, arrays, title = '', marks = None, downsample = True):
+        ''' Replace the charted data
+
+        Input
+        =====
+        arrays: dict
+            as returned by chart_arrays()
+        title: str
+            title of the k-line panel
+        marks: list of float, optional
+            matplotlib dates to mark with a vertical line, eg. buy and sell dates
+        downsample: bool
+            merge bars (see downsample_chart()) when there are more bars than
+            pixels across the figure
+
+        Output
+        ======
+        Return: list of Axes
+        '''
+        n = arrays['close'].shape[0]
+        pixels = int(self.fig.get_figwidth() * self.fig.dpi)
+        bucket = int(math.ceil(float(n) / pixels)) if downsample and pixels > 0 else 1
+        if bucket > 1:
+            arrays = downsample_chart(arrays, bucket)
+
+        x = arrays['mpl.date']
+        # width of one day, or most of the spacing of merged bars
+        step = 0.8 * float(np.median(np.diff(x))) if bucket > 1 and x.shape[0] > 1 else 1.
+        limits = {ax: [] for ax in self.axes}
+
+        # candles, green when close >= open
+        open_, close, high, low = arrays['open'], arrays['close'], arrays['high'], arrays['low']
+        drawn = ~(np.isnan(open_) | np.isnan(close) | np.isnan(high) | np.isnan(low))
+        cx, open_, close, high, low = x[drawn], open_[drawn], close[drawn], high[drawn], low[drawn]
+        colors = np.where(close >= open_, 'g', 'r').tolist()
+        self.wicks.set_segments(np.stack([np.stack([cx, low], axis=1), np.stack([cx, high], axis=1)], axis=1))
+        self.wicks.set_color(colors)
+        self.bodies.set_verts(_rectangles(cx, np.minimum(open_, close), np.maximum(open_, close), step))
+        self.bodies.set_facecolor(colors)
+        self.bodies.set_edgecolor(colors)
+        if cx.shape[0] > 0:
+            limits[self.axes[0]] += [(cx.min() - step, low.min()), (cx.max() + step, high.max())]
+        self.ema8.set_data(x, arrays['EMA8'])
+        self.ema21.set_data(x, arrays['EMA21'])
+        self.axes[0].set_title(title)
+
+        # histograms
+        for (ax, col, color, alpha, width), collection in zip(self.histograms, self.bars):
+            heights = arrays[col]
+            drawn = ~np.isnan(heights)
+            hx, heights = x[drawn] - 0.25 * step, heights[drawn]
+            collection.set_verts(_rectangles(hx, np.zeros(hx.shape), heights, width * step))
+            if color is None:
+                collection.set_facecolor(np.where(heights > 0, 'g', 'r').tolist())
+            if hx.shape[0] > 0:
+                limits[ax] += [(hx.min() - step, min(heights.min(), 0)), (hx.max() + step, max(heights.max(), 0))]
+
+        squeeze_ongoing = arrays['SQUEEZE'] == sb.CONST_SQUEEZE_ONGOING
+        self.squeeze.set_data(x[squeeze_ongoing] - 0.25 * step, np.zeros(np.count_nonzero(squeeze_ongoing)))
+        self.adx.set_data(x, arrays['ADX'])
+
+        for mark in self.marks:
+            mark.remove()
+        self.marks = [ax.axvline(mark, color='k', linestyle='--', linewidth=0.8)
+                      for ax in self.axes for mark in (marks or [])]
+
+        # lines by relim(), collections by their limits
+        for ax in self.axes:
+            ax.relim()
+            if limits[ax]:
+                ax.update_datalim(limits[ax])
+            ax.autoscale_view()
+
+        return self.axes
+
+
+#
+# render_chart
+#
+
+
+def render_chart(fig, arrays, title = '', marks = None, downsample = True):
+    ''' Function to draw the seven chart panels on an empty matplotlib Figure
+
+    Explain
+    =======
+    One-off use of ChartRenderer. See ChartRenderer.draw() for Input.
+
+    Output
+    ======
+    Return: list of Axes
+    '''
+    return ChartRenderer(fig).draw(arrays, title, marks, downsample)
+
+
+#
+# plot_stock_chart
+#
+
+
+def plot_stock_chart(stock_data, title_postfix = '', figsize = CONST_CHART_FIGSIZE, downsample = True):
+    ''' Function to plot one stock, with pyplot
+
+    Input
+    =====
+    stock_data: DataFrame
+        one stock, see chart_arrays()
+    title_postfix: str
+        appended to the code, in the title
+    figsize: tuple
+        figure size, in inches
+    downsample: bool
+        see render_chart()
+
+    Output
+    ======
+    Return: matplotlib.figure.Figure
+
+    Example
+    =======
+    >>> plot_stock_chart(all_data_and_features.loc[['601318']].iloc[860:960], title_postfix='中国平安')
+    '''
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=figsize)
+    render_chart(fig, chart_arrays(stock_data), stock_data['code'].iloc[0] + ' ' + title_postfix,
+                 downsample=downsample)
+    return fig
+
+
+#
+# export_sample_charts
+#
+
+
+def export_sample_charts(samples, out_dir, sample_ids = None, after_bars = None, n_workers = None,
+                         chunk_size = 32, figsize = (12, 10), dpi = 80):
+    ''' Function to render sample windows of a SampleSet to PNG files, in parallel
+
+    Explain
+    =======
+    Each chart shows the lookback bars of a sample up to its buy-point, then
+    the bars of the trade up to the sell-point (or after_bars bars, when
+    given), with the buy and sell dates marked. Charts are drawn on Agg
+    canvases, without pyplot, by a pool of processes; each task gets only
+    the arrays of its own windows.
+
+    Input
+    =====
+    samples: dataprep.SampleSet
+        with CONST_CHART_COLUMNS among its feature_columns
+    out_dir: str
+        directory of the PNG files, created if needed
+    sample_ids: array of int, optional
+        samples to render, default all
+    after_bars: int, optional
+        bars to show after the buy-point, default up to the sell-point
+    n_workers: int, optional
+        number of processes. Default os.cpu_count().
+    chunk_size: int
+        number of charts per task
+    figsize, dpi:
+        size of each PNG
+
+    Output
+    ======
+    Return: list of str
+        paths of the PNG files, named '<code>_<buy date>_<sample id>.png',
+        in the order of sample_ids
+
+    Example
+    =======
+    >>> good = np.flatnonzero(table['profit.per.day'].values > 0.004)
+    >>> paths = export_sample_charts(samples, 'charts/good', sample_ids=good)
+    '''
+    from stockdates import days_to_dates
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    if sample_ids is None:
+        sample_ids = np.arange(len(samples))
+    sample_ids = np.asarray(sample_ids, dtype=np.int64)
+
+    positions = [samples.feature_columns.index(col) for col in CONST_CHART_COLUMNS]
+    stocks = samples.index['stock'].values
+    buy_locations = samples.index['buy_location'].values
+    sell_locations = samples.index['sell_location'].values
+
+    charts = []
+    paths = []
+    for sample in sample_ids:
+        stock, buy_location = stocks[sample], buy_locations[sample]
+        last = buy_location + after_bars if after_bars is not None else sell_locations[sample]
+        first = buy_location - samples.lookback + 1
+        last = min(last, samples.features[stock].shape[0] - 1)
+
+        days = samples.dates[stock]
+        window = samples.features[stock][first:(last + 1), positions]
+        arrays = {col: window[:, i] for i, col in enumerate(CONST_CHART_COLUMNS)}
+        arrays['mpl.date'] = days_to_mpl_dates(days[first:(last + 1)])
+        marks = days_to_mpl_dates(days[[buy_location, sell_locations[sample]]]).tolist()
+
+        code = samples.codes[stock]
+        buy_date = str(days_to_dates(days[buy_location:(buy_location + 1)])[0])
+        path = os.path.join(out_dir, '%s_%s_%d.png' % (code, buy_date, sample))
+        charts.append((path, arrays, code + ' ' + buy_date, marks))
+        paths.append(path)
+
+    tasks = [(charts[i:(i + chunk_size)], figsize, dpi) for i in range(0, len(charts), chunk_size)]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(_export_charts_worker, tasks))
+
+    return paths
+
+
+def _export_charts_worker(task):
+    ''' Render a chunk of charts to PNG files, on Agg canvases
+    '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    charts, figsize, dpi = task
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    renderer = ChartRenderer(fig)
+    for path, arrays, title, marks in charts:
+        renderer.draw(arrays, title, marks=marks)
+        fig.savefig(path, dpi=dpi)
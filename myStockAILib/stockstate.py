@@ -0,0 +1,514 @@
+# -*- coding: utf-8 -*-
+
+'''
+Incremental counterparts of the stockbasic indicators.
+
+Each state object is seeded once from history, then accepts one bar at a
+time. update() costs O(1) per bar (amortized for the N-bar low window),
+and emits the same values the stockbasic batch functions produce for that
+bar, as they follow TA-Lib's own arithmetic step by step. Where TA-Lib was
+compiled with fused multiply-add, EMA/ATR style recursions may differ from
+it in the last bit only.
+
+States are plain Python objects. to_dict() / state_from_dict() turn them
+into JSON friendly dicts, so a daily job can resume without replaying
+years of data.
+'''
+
+import collections
+import math
+
+import stockbasic as sb
+
+
+# TA-Lib's TA_IS_ZERO() and TA_IS_ZERO_OR_NEG()
+def _is_zero(value):
+    return (-0.00000001 < value) and (value < 0.00000001)
+
+
+def _is_zero_or_neg(value):
+    return value < 0.00000001
+
+
+def _true_range(high, low, prev_close):
+    ''' TA-Lib's TRUE_RANGE(), in the same order of operations
+    '''
+    greatest = high - low
+    value = abs(prev_close - high)
+    if value > greatest:
+        greatest = value
+    value = abs(prev_close - low)
+    if value > greatest:
+        greatest = value
+    return greatest
+
+
+#
+# _State
+#
+
+
+class _State(object):
+    ''' Base class of all states, with dict serialization
+    '''
+
+    # attributes kept as collections.deque, serialized as lists
+    _deques = ()
+
+    def to_dict(self):
+        ''' Return the state as a JSON friendly dict
+        '''
+        return {'type': type(self).__name__,
+                'attrs': {name: _encode(value) for name, value in self.__dict__.items()}}
+
+
+def _encode(value):
+    if isinstance(value, _State):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return {'dict': {k: _encode(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple, collections.deque)):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict) and 'type' in value:
+        return state_from_dict(value)
+    if isinstance(value, dict):
+        return {k: _decode(v) for k, v in value['dict'].items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def state_from_dict(state_dict):
+    ''' Function to rebuild a state from to_dict() output
+
+    Input
+    =====
+    state_dict: dict
+        as returned by to_dict() of any state in this module
+
+    Output
+    ======
+    Return: state object
+    '''
+    cls = _STATE_TYPES[state_dict['type']]
+    state = cls.__new__(cls)
+    for name, value in state_dict['attrs'].items():
+        value = _decode(value)
+        if name in cls._deques:
+            value = collections.deque(value)
+        setattr(state, name, value)
+    return state
+
+
+#
+# primitive states, one per TA-Lib function
+#
+
+
+class SmaState(_State):
+    ''' talib.SMA() / talib.MA(), one value at a time. Leading NaN is skipped.
+    '''
+
+    _deques = ('window',)
+
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+        self.window = collections.deque()  # values still to be subtracted from total
+        self.total = 0.0
+
+    def update(self, value):
+        if self.count == 0 and math.isnan(value):
+            return float('nan')
+        self.count += 1
+        self.total += value
+        self.window.append(value)
+        if len(self.window) < self.period:
+            return float('nan')
+        out = self.total / self.period
+        self.total -= self.window.popleft()
+        return out
+
+
+class EmaState(_State):
+    ''' talib.EMA(), one value at a time. Leading NaN is skipped.
+    '''
+
+    def __init__(self, period):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.count = 0
+        self.prev = 0.0
+
+    def update(self, value):
+        if self.count == 0 and math.isnan(value):
+            return float('nan')
+        self.count += 1
+        if self.count < self.period:
+            self.prev += value
+            return float('nan')
+        if self.count == self.period:
+            self.prev = (self.prev + value) / self.period
+            return self.prev
+        self.prev = ((value - self.prev) * self.k) + self.prev
+        return self.prev
+
+
+class AtrState(_State):
+    ''' talib.ATR(), one bar at a time
+    '''
+
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+        self.prev_close = None
+        self.prev = 0.0
+
+    def update(self, high, low, close):
+        prev_close = self.prev_close
+        self.prev_close = close
+        if prev_close is None:
+            return float('nan')
+
+        true_range = _true_range(high, low, prev_close)
+        self.count += 1
+        if self.count < self.period:
+            self.prev += true_range
+            return float('nan')
+        if self.count == self.period:
+            self.prev = (self.prev + true_range) / self.period
+            return self.prev
+        self.prev *= self.period - 1
+        self.prev += true_range
+        self.prev /= self.period
+        return self.prev
+
+
+class AdxState(_State):
+    ''' talib.ADX(), one bar at a time
+    '''
+
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+        self.prev_high = None
+        self.prev_low = None
+        self.prev_close = None
+        self.prev_minus_dm = 0.0
+        self.prev_plus_dm = 0.0
+        self.prev_tr = 0.0
+        self.sum_dx = 0.0
+        self.prev_adx = float('nan')
+
+    def update(self, high, low, close):
+        if self.prev_high is None:
+            self.prev_high, self.prev_low, self.prev_close = high, low, close
+            return float('nan')
+
+        period = self.period
+        self.count += 1
+        diff_p = high - self.prev_high
+        diff_m = self.prev_low - low
+        self.prev_high, self.prev_low = high, low
+
+        # the first (period - 1) bars only accumulate DM and TR
+        if self.count >= period:
+            self.prev_minus_dm -= self.prev_minus_dm / period
+            self.prev_plus_dm -= self.prev_plus_dm / period
+        if (diff_m > 0) and (diff_p < diff_m):
+            self.prev_minus_dm += diff_m
+        elif (diff_p > 0) and (diff_p > diff_m):
+            self.prev_plus_dm += diff_p
+
+        true_range = _true_range(high, low, self.prev_close)
+        if self.count >= period:
+            self.prev_tr = self.prev_tr - (self.prev_tr / period) + true_range
+        else:
+            self.prev_tr += true_range
+        self.prev_close = close
+
+        if self.count < period:
+            return float('nan')
+
+        dx = None
+        if not _is_zero(self.prev_tr):
+            minus_di = 100.0 * (self.prev_minus_dm / self.prev_tr)
+            plus_di = 100.0 * (self.prev_plus_dm / self.prev_tr)
+            di_sum = minus_di + plus_di
+            if not _is_zero(di_sum):
+                dx = 100.0 * (abs(minus_di - plus_di) / di_sum)
+
+        # the next period bars sum DX, to seed ADX
+        if self.count < 2 * period - 1:
+            if dx is not None:
+                self.sum_dx += dx
+            return float('nan')
+        if self.count == 2 * period - 1:
+            if dx is not None:
+                self.sum_dx += dx
+            self.prev_adx = self.sum_dx / period
+            return self.prev_adx
+
+        if dx is not None:
+            self.prev_adx = ((self.prev_adx * (period - 1)) + dx) / period
+        return self.prev_adx
+
+
+class BbandsState(_State):
+    ''' talib.BBANDS() with SMA middle band, one value at a time
+    '''
+
+    _deques = ('window',)
+
+    def __init__(self, period, nbdevup, nbdevdn):
+        self.period = period
+        self.nbdevup = nbdevup
+        self.nbdevdn = nbdevdn
+        self.sma = SmaState(period)
+        self.window = collections.deque()
+        self.total2 = 0.0
+
+    def update(self, value):
+        ''' Return (upper, middle, lower)
+        '''
+        middle = self.sma.update(value)
+        square = value * value
+        self.total2 += square
+        self.window.append(square)
+        if len(self.window) < self.period:
+            return float('nan'), float('nan'), float('nan')
+
+        mean2 = self.total2 / self.period
+        self.total2 -= self.window.popleft()
+        mean2 -= middle * middle
+        stddev = math.sqrt(mean2) if not _is_zero_or_neg(mean2) else 0.0
+
+        if self.nbdevup == self.nbdevdn:
+            if self.nbdevup != 1.0:
+                stddev = stddev * self.nbdevup
+            return middle + stddev, middle, middle - stddev
+        return middle + stddev * self.nbdevup, middle, middle - stddev * self.nbdevdn
+
+
+class NBarLowState(_State):
+    ''' talib.MIN() of 'low', shifted by one bar, as stockbasic.talib_nbarlow()
+
+    A monotonic window keeps update() O(1) amortized.
+    '''
+
+    _deques = ('window',)
+
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+        self.window = collections.deque()  # [position, low], lows increasing
+
+    def update(self, low):
+        # LOW<N> of today is the lowest of the previous N bars
+        out = self.window[0][1] if self.count >= self.period else float('nan')
+
+        while self.window and self.window[-1][1] >= low:
+            self.window.pop()
+        self.window.append([self.count, low])
+        if self.window[0][0] <= self.count - self.period:
+            self.window.popleft()
+        self.count += 1
+
+        return out
+
+
+#
+# indicator states, one per stockbasic function
+#
+
+
+class PropulsionState(_State):
+    ''' Incremental stockbasic.ttm_propulsion(): 'EMA8', 'EMA21'
+    '''
+
+    def __init__(self):
+        self.ema8 = EmaState(8)
+        self.ema21 = EmaState(21)
+
+    def update(self, high, low, close):
+        return {'EMA8': self.ema8.update(close), 'EMA21': self.ema21.update(close)}
+
+
+class SqueezeState(_State):
+    ''' Incremental stockbasic.ttm_squeeze(): 'SQUEEZE', 'MTMMA'
+    '''
+
+    _deques = ('closes',)
+
+    def __init__(self, MULTKC = 1.5, MULT = 1.5, LENGTHKC = 20, LENGTHBB = 20, LENGTHMOM = 12):
+        self.MULTKC = MULTKC
+        self.LENGTHMOM = LENGTHMOM
+        self.atr = AtrState(LENGTHKC)
+        self.ma = SmaState(LENGTHKC)
+        self.bbands = BbandsState(LENGTHBB, MULT, MULT)
+        self.closes = collections.deque()  # last LENGTHMOM closes
+        self.mtm_ma = SmaState(LENGTHMOM)
+
+    def update(self, high, low, close):
+        ATR = self.atr.update(high, low, close)
+        MA = self.ma.update(close)
+        UPPERKC = MA + ATR * self.MULTKC
+        LOWERKC = MA - ATR * self.MULTKC
+        UPPERBB, BOLL, LOWERBB = self.bbands.update(close)
+
+        if (LOWERBB > LOWERKC) and (UPPERBB < UPPERKC):
+            squeeze = sb.CONST_SQUEEZE_ONGOING
+        else:
+            squeeze = sb.CONST_SQUEEZE_RELEASED
+
+        MTM = float('nan')
+        if len(self.closes) == self.LENGTHMOM:
+            MTM = close - self.closes.popleft()
+        self.closes.append(close)
+
+        return {'SQUEEZE': squeeze, 'MTMMA': self.mtm_ma.update(MTM)}
+
+
+class WaveState(_State):
+    ''' Incremental stockbasic.ttm_wave(): 'HIST1' to 'HIST5', 'MACD6'
+    '''
+
+    def __init__(self, SHORT = 8, MID_A = 34, LONG_A = 55, MID_B = 89, LONG_B = 144, MID_C = 233, LONG_C = 377):
+        self.fast = EmaState(SHORT)
+        self.hists = []
+        for col, period in [('HIST1', MID_A), ('HIST2', LONG_A), ('HIST3', MID_B),
+                            ('HIST4', LONG_B), ('HIST5', MID_C)]:
+            self.hists.append([col, EmaState(period), EmaState(period)])
+        self.slow6 = EmaState(LONG_C)
+
+    def update(self, high, low, close):
+        FASTMA = self.fast.update(close)
+        out = {}
+        for col, slow, signal in self.hists:
+            MACD = FASTMA - slow.update(close)
+            out[col] = MACD - signal.update(MACD)
+        out['MACD6'] = FASTMA - self.slow6.update(close)
+        return out
+
+
+class AdxFeatureState(_State):
+    ''' Incremental stockbasic.talib_adx(): 'ADX'
+    '''
+
+    def __init__(self, LENGTH = 14):
+        self.adx = AdxState(LENGTH)
+
+    def update(self, high, low, close):
+        return {'ADX': self.adx.update(high, low, close)}
+
+
+class AtrFeatureState(_State):
+    ''' Incremental stockbasic.talib_atr(): 'ATR'
+    '''
+
+    def __init__(self, LENGTH = 14):
+        self.atr = AtrState(LENGTH)
+
+    def update(self, high, low, close):
+        return {'ATR': self.atr.update(high, low, close)}
+
+
+class NBarLowFeatureState(_State):
+    ''' Incremental stockbasic.talib_nbarlow(): 'LOW<N>'
+    '''
+
+    def __init__(self, N_BAR_LOWEST = 10):
+        self.col = 'LOW' + str(N_BAR_LOWEST)
+        self.low = NBarLowState(N_BAR_LOWEST)
+
+    def update(self, high, low, close):
+        return {self.col: self.low.update(low)}
+
+
+#
+# FeatureState
+#
+
+
+class FeatureState(_State):
+    ''' Incremental stockbasic.stock_features()
+
+    Explain
+    =======
+    Holds one indicator state per feature group, and emits the same columns
+    as stockbasic.stock_features() with the same parameters.
+
+    Example
+    =======
+    >>> state = FeatureState.from_history(stock_data)
+    >>> saved = json.dumps(state.to_dict())
+    >>> # ... next day
+    >>> state = state_from_dict(json.loads(saved))
+    >>> row = state.update(high=10.5, low=10.1, close=10.3)
+    >>> row['SQUEEZE'], row['ATR'], row['LOW10']
+    '''
+
+    def __init__(self, feature_set = sb.CONST_FEATURE_SET_ALL,
+                 MULTKC = 1.5, MULT = 1.5, LENGTHKC = 20, LENGTHBB = 20, LENGTHMOM = 12,
+                 SHORT = 8, MID_A = 34, LONG_A = 55, MID_B = 89, LONG_B = 144, MID_C = 233, LONG_C = 377,
+                 ADX_LENGTH = 14, ATR_LENGTH = 14, N_BAR_LOWEST = 10):
+        self.columns = sb.feature_columns(feature_set, N_BAR_LOWEST)
+        self.states = {}
+        if 'propulsion' in feature_set:
+            self.states['propulsion'] = PropulsionState()
+        if 'squeeze' in feature_set:
+            self.states['squeeze'] = SqueezeState(MULTKC, MULT, LENGTHKC, LENGTHBB, LENGTHMOM)
+        if 'wave' in feature_set:
+            self.states['wave'] = WaveState(SHORT, MID_A, LONG_A, MID_B, LONG_B, MID_C, LONG_C)
+        if 'adx' in feature_set:
+            self.states['adx'] = AdxFeatureState(ADX_LENGTH)
+        if 'atr' in feature_set:
+            self.states['atr'] = AtrFeatureState(ATR_LENGTH)
+        if 'nbarlow' in feature_set:
+            self.states['nbarlow'] = NBarLowFeatureState(N_BAR_LOWEST)
+
+    @classmethod
+    def from_history(cls, stock_data, **params):
+        ''' Create a state, and feed it all bars of stock_data
+
+        Input
+        =====
+        stock_data: DataFrame
+            with 'high', 'low', 'close' in each row, oldest first
+        params:
+            parameters of FeatureState()
+
+        Output
+        ======
+        Return: FeatureState
+        '''
+        state = cls(**params)
+        for high, low, close in zip(stock_data['high'].values.tolist(),
+                                    stock_data['low'].values.tolist(),
+                                    stock_data['close'].values.tolist()):
+            state.update(high, low, close)
+        return state
+
+    def update(self, high, low, close):
+        ''' Feed one new bar
+
+        Output
+        ======
+        Return: dict
+            column name to value, for all columns of the feature set
+        '''
+        high, low, close = float(high), float(low), float(close)
+        row = {}
+        for state in self.states.values():
+            row.update(state.update(high, low, close))
+        return row
+
+
+_STATE_TYPES = {cls.__name__: cls for cls in [SmaState, EmaState, AtrState, AdxState, BbandsState,
+                                              NBarLowState, PropulsionState, SqueezeState, WaveState,
+                                              AdxFeatureState, AtrFeatureState, NBarLowFeatureState,
+                                              FeatureState]}
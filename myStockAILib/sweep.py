@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+'''
+Parameter sweep of the squeeze buy rule and the sell rules.
+
+Every combination of a grid of ttm_squeeze() and get_sell_points()
+parameters is evaluated over a universe of stocks. Each stock is handled
+by one worker, which computes every distinct indicator only once (eg. one
+ATR and one MA per length, one LOW<n> per n) and then evaluates all
+combinations from those cached arrays.
+'''
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import talib
+
+import stockbasic as sb
+from stockdates import index_days
+
+
+# parameters a grid may sweep, and their defaults
+CONST_SWEEP_DEFAULTS = {'MULTKC': 1.5,
+                        'MULT': 1.5,
+                        'LENGTHKC': 20,
+                        'LENGTHBB': 20,
+                        'multi_atr': 2.,
+                        'n_low': 10}
+
+# statistics reported per combination
+CONST_SWEEP_STATS = ['samples', 'win_rate', 'label_rate', 'stop_loss_rate',
+                     'profit_mean', 'profit_std', 'profit_p10', 'profit_p50', 'profit_p90',
+                     'hold_days_mean', 'hold_days_p50', 'hold_days_max', 'hold_bars_mean']
+
+
+#
+# _IndicatorCache
+#
+
+
+class _IndicatorCache(object):
+    ''' Indicators of one stock, each computed on first use only
+    '''
+
+    def __init__(self, high, low, close):
+        self.high = high
+        self.low = low
+        self.close = close
+        self.cache = {}
+
+    def get(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def atr(self, length):
+        return self.get(('ATR', length),
+                        lambda: talib.ATR(self.high, self.low, self.close, timeperiod=length))
+
+    def ma(self, length):
+        return self.get(('MA', length), lambda: talib.MA(self.close, timeperiod=length))
+
+    def bbands(self, length, mult):
+        return self.get(('BBANDS', length, mult),
+                        lambda: talib.BBANDS(self.close, timeperiod=length, nbdevup=mult, nbdevdn=mult))
+
+    def squeeze_ongoing(self, MULTKC, MULT, LENGTHKC, LENGTHBB):
+        def compute():
+            UPPERBB, BOLL, LOWERBB = self.bbands(LENGTHBB, MULT)
+            MA = self.ma(LENGTHKC)
+            ATR = self.atr(LENGTHKC)
+            with np.errstate(invalid='ignore'):
+                return (LOWERBB > (MA - ATR * MULTKC)) & (UPPERBB < (MA + ATR * MULTKC))
+        return self.get(('SQUEEZE', MULTKC, MULT, LENGTHKC, LENGTHBB), compute)
+
+    def ema(self, period):
+        return self.get(('EMA', period), lambda: talib.EMA(self.close, timeperiod=period))
+
+    def wave_hist(self, SHORT, period):
+        def compute():
+            MACD = self.ema(SHORT) - self.ema(period)
+            return MACD - talib.EMA(MACD, timeperiod=period)
+        return self.get(('HIST', SHORT, period), compute)
+
+    def mtm_ma(self, length):
+        def compute():
+            MTM = np.full(self.close.shape, np.nan)
+            MTM[length:] = self.close[length:] - self.close[:-length]
+            return talib.MA(MTM, timeperiod=length)
+        return self.get(('MTMMA', length), compute)
+
+    def adx(self, length):
+        return self.get(('ADX', length),
+                        lambda: talib.ADX(self.high, self.low, self.close, timeperiod=length))
+
+    def nbar_low(self, n_low):
+        def compute():
+            nbar_lowest = np.full(self.low.shape, np.nan)
+            nbar_lowest[1:] = talib.MIN(self.low, timeperiod=n_low)[:-1]
+            return nbar_lowest
+        return self.get(('LOW', n_low), compute)
+
+
+#
+# run_sweep
+#
+
+
+def run_sweep(all_data, grid, lookback = 120, atr_length = 14, profit_threshold = 0.2239,
+              drop_threshold = 1000, n_workers = None, use_threads = False, chunk_size = 8):
+    ''' Function to evaluate buy/sell rules for every combination of a parameter grid
+
+    Explain
+    =======
+    For every combination, samples are found as dataprep.generate_sample_index()
+    does: squeeze buy-points, their sell points, and only the buy-points
+    with a sell point and lookback NaN free bars before. Stocks are spread
+    over a pool of workers, in chunks of plain numpy arrays.
+
+    'LENGTHMOM' is not swept: it only changes 'MTMMA', which the rules do
+    not use.
+
+    Input
+    =====
+    all_data: MultiIndex DataFrame
+        indexed by 'code' and 'date', with OHLC, as fetch_raw_data() returns
+    grid: dict
+        parameter name to list of values. Keys are any of
+        CONST_SWEEP_DEFAULTS; missing ones use the default.
+    lookback: int
+        number of bars to look back to form a sample
+    atr_length: int
+        period of the 'ATR' used by the stop loss
+    profit_threshold: float
+        'label_rate' is the share of samples with profit above it
+    drop_threshold: int
+        skip a stock, if it has less than drop_threshold bars
+    n_workers, use_threads, chunk_size:
+        worker pool, see dataprep.build_features()
+
+    Output
+    ======
+    Return: DataFrame
+        one row per combination, with the parameters, then CONST_SWEEP_STATS.
+        'win_rate' is the share of samples with profit > 0, 'hold_days' are
+        calendar days, 'hold_bars' trading days.
+
+    Example
+    =======
+    >>> report = run_sweep(all_data, {'MULTKC': [1.25, 1.5, 2.], 'LENGTHBB': [14, 20],
+    ...                               'multi_atr': [1.5, 2., 3.], 'n_low': [5, 10, 20]})
+    >>> report.sort_values('profit_mean', ascending=False).head()
+    '''
+    names = list(CONST_SWEEP_DEFAULTS)
+    unknown = set(grid) - set(names)
+    if unknown:
+        raise ValueError('unknown sweep parameters: ' + ', '.join(sorted(unknown)))
+    values = [list(grid.get(name, [CONST_SWEEP_DEFAULTS[name]])) for name in names]
+    combinations = [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+    # one task per chunk of stocks, as plain arrays
+    stocks = []
+    for _, stock_data in all_data.groupby(level=0, sort=True):
+        if stock_data.shape[0] < drop_threshold:
+            continue
+        stocks.append((np.ascontiguousarray(stock_data['high'].values, dtype=np.float64),
+                       np.ascontiguousarray(stock_data['low'].values, dtype=np.float64),
+                       np.ascontiguousarray(stock_data['close'].values, dtype=np.float64),
+                       index_days(stock_data.index)))
+    tasks = [(stocks[i:(i + chunk_size)], combinations, lookback, atr_length)
+             for i in range(0, len(stocks), chunk_size)]
+
+    executor = ThreadPoolExecutor(max_workers=n_workers) if use_threads else ProcessPoolExecutor(max_workers=n_workers)
+    with executor:
+        results = list(executor.map(_sweep_worker, tasks))
+
+    rows = []
+    for i, combination in enumerate(combinations):
+        outcome = {key: np.concatenate([result[i][key] for result in results]) if results else np.zeros(0)
+                   for key in ['profit', 'hold_days', 'hold_bars', 'sell_reason']}
+        row = dict(combination)
+        row.update(_summarize(outcome, profit_threshold))
+        rows.append(row)
+
+    return pd.DataFrame(rows, columns=names + CONST_SWEEP_STATS)
+
+
+def _summarize(outcome, profit_threshold):
+    ''' Statistics of one combination's samples, NaN when there is none
+    '''
+    profit = outcome['profit']
+    if profit.shape[0] == 0:
+        stats = dict.fromkeys(CONST_SWEEP_STATS, np.nan)
+        stats['samples'] = 0
+        return stats
+
+    hold_days = outcome['hold_days']
+    p10, p50, p90 = np.percentile(profit, [10, 50, 90])
+    return {'samples': profit.shape[0],
+            'win_rate': np.mean(profit > 0),
+            'label_rate': np.mean(profit > profit_threshold),
+            'stop_loss_rate': np.mean(outcome['sell_reason'] == sb.CONST_SELL_REASON_STOP_LOSS),
+            'profit_mean': profit.mean(),
+            'profit_std': profit.std(),
+            'profit_p10': p10,
+            'profit_p50': p50,
+            'profit_p90': p90,
+            'hold_days_mean': hold_days.mean(),
+            'hold_days_p50': np.median(hold_days),
+            'hold_days_max': hold_days.max(),
+            'hold_bars_mean': outcome['hold_bars'].mean()}
+
+
+def _sweep_worker(task):
+    ''' Evaluate all combinations on a chunk of stocks
+
+    Output
+    ======
+    Return: list, per combination, of dict of arrays
+        'profit', 'hold_days', 'hold_bars', 'sell_reason' of its samples
+    '''
+    stocks, combinations, lookback, atr_length = task
+    outcomes = [{'profit': [], 'hold_days': [], 'hold_bars': [], 'sell_reason': []} for _ in combinations]
+
+    for high, low, close, days in stocks:
+        cache = _IndicatorCache(high, low, close)
+
+        # parameter free part: TTM Wave C > 0, and NaN free bars of the
+        # features of stock_features() with its default parameters
+        HIST5 = cache.wave_hist(8, 233)
+        MACD6 = cache.ema(8) - cache.ema(377)
+        with np.errstate(invalid='ignore'):
+            wave_c_positive = (HIST5 > 0) & (MACD6 > 0)
+        default_features = [cache.ema(8), cache.ema(21), cache.mtm_ma(12),
+                            cache.wave_hist(8, 34), cache.wave_hist(8, 55), cache.wave_hist(8, 89),
+                            cache.wave_hist(8, 144), HIST5, MACD6,
+                            cache.adx(14), cache.atr(14), cache.nbar_low(10)]
+        row_has_null = np.isnan(close)
+        for values in default_features:
+            row_has_null |= np.isnan(values)
+        positions = np.arange(close.shape[0])
+        first_valid = np.maximum.accumulate(np.where(row_has_null, positions, -1)) + 1
+        atr = cache.atr(atr_length)
+
+        for outcome, params in zip(outcomes, combinations):
+            squeeze_ongoing = cache.squeeze_ongoing(params['MULTKC'], params['MULT'],
+                                                    params['LENGTHKC'], params['LENGTHBB'])
+            first_release = np.zeros(squeeze_ongoing.shape, dtype=bool)
+            first_release[1:] = ~squeeze_ongoing[1:] & squeeze_ongoing[:-1]
+            buy_locations = np.flatnonzero(wave_c_positive & (squeeze_ongoing | first_release))
+
+            first_locations = buy_locations - lookback + 1
+            buy_locations = buy_locations[(first_locations >= 0) &
+                                          (first_locations >= first_valid[buy_locations])]
+
+            sell_locations, sell_reasons = sb.resolve_sell_points(close, atr, cache.nbar_low(params['n_low']),
+                                                                  buy_locations, multi_atr=params['multi_atr'])
+            sold = (sell_reasons != sb.CONST_SELL_REASON_NONE) & ~np.isnan(close[sell_locations])
+            buy_locations = buy_locations[sold]
+            sell_locations = sell_locations[sold]
+
+            outcome['profit'].append(close[sell_locations] / close[buy_locations] - 1)
+            outcome['hold_days'].append((days[sell_locations] - days[buy_locations]).astype(np.float64))
+            outcome['hold_bars'].append(sell_locations - buy_locations)
+            outcome['sell_reason'].append(sell_reasons[sold])
+
+    return [{key: np.concatenate(values) if values else np.zeros(0) for key, values in outcome.items()}
+            for outcome in outcomes]
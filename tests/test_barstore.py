@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark
+import dataprep as dp
+from barstore import CONST_BAR_COLUMNS, BarStore
+from stockdates import dates_to_days
+
+
+CODES = ['000000', '000001']
+
+
+@pytest.fixture
+def k_data():
+    ''' {code: bars} in tushare's get_k_data() layout
+    '''
+    all_data = benchmark.synthetic_market(len(CODES), 100)
+    return {code: all_data.loc[code].reset_index()[['date', 'open', 'close', 'high', 'low', 'volume', 'code']]
+            for code in CODES}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BarStore(str(tmp_path / 'bars'))
+
+
+def fetch_raw_data_frame(k_data):
+    ''' The frame fetch_raw_data() builds from get_k_data() frames
+    '''
+    all_frames = []
+    for code, bars in k_data.items():
+        onestock = bars.copy()
+        onestock['mpl.date'] = dp.date_to_num(onestock['date'].values)
+        onestock.set_index('date', inplace=True)
+        all_frames.append(onestock)
+    all_data = pd.concat(all_frames)
+    all_data.set_index([all_data['code'], all_data.index], drop=True, inplace=True)
+    return all_data
+
+
+def assert_stored(store, code, bars):
+    stored = store.read(code)
+    assert store.rows(code) == bars.shape[0]
+    assert store.last_date(code) == bars['date'].iloc[-1]
+    np.testing.assert_array_equal(stored['date'], dates_to_days(bars['date'].values))
+    for col in ['open', 'close', 'high', 'low', 'volume']:
+        np.testing.assert_array_equal(stored[col], bars[col].values)
+
+
+#
+# append
+#
+
+
+def test_append_drops_bars_on_or_before_last_date(store, k_data):
+    bars = k_data['000000']
+    appended = []
+    store.on_append.append(appended.append)
+
+    assert store.append('000000', bars.iloc[:50]) == 50
+    # overlapping bars, out of order
+    assert store.append('000000', bars.iloc[40:60].iloc[::-1]) == 10
+    assert store.append('000000', bars.iloc[:60]) == 0
+    assert store.append('000000', bars.iloc[59:60]) == 0
+
+    assert_stored(store, '000000', bars.iloc[:60])
+    assert appended == ['000000', '000000']
+    assert store.codes() == ['000000']
+    assert store.rows('000001') == 0
+    assert store.last_date('000001') is None
+
+
+def test_append_truncates_failed_append(store, k_data):
+    bars = k_data['000000']
+    store.append('000000', bars.iloc[:50])
+
+    # an append which wrote its columns, but failed before updating meta.json
+    for col, dtype in CONST_BAR_COLUMNS:
+        with open(os.path.join(store.root, '000000', col + '.bin'), 'ab') as f:
+            f.write(np.ones(7, dtype=dtype).tobytes())
+    assert store.rows('000000') == 50
+    assert_stored(store, '000000', bars.iloc[:50])
+
+    assert store.append('000000', bars.iloc[50:60]) == 10
+
+    for col, dtype in CONST_BAR_COLUMNS:
+        assert os.path.getsize(os.path.join(store.root, '000000', col + '.bin')) == 60 * np.dtype(dtype).itemsize
+    assert_stored(store, '000000', bars.iloc[:60])
+
+
+#
+# read
+#
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_read_date_range(store, k_data, mmap):
+    bars = k_data['000000']
+    store.append('000000', bars)
+    start, end = bars['date'].iloc[10], bars['date'].iloc[19]
+
+    stored = store.read('000000', start, end, mmap=mmap)
+
+    assert isinstance(stored['close'], np.memmap) == mmap
+    np.testing.assert_array_equal(stored['close'], bars['close'].values[10:20])
+    # dates out of the stored ones
+    stored = store.read('000000', '2000-01-01', '2010-01-05', mmap=mmap)
+    np.testing.assert_array_equal(stored['close'], bars['close'].values[:2])
+
+
+#
+# load_frame
+#
+
+
+def test_load_frame_matches_fetch_raw_data_layout(store, k_data):
+    expected = fetch_raw_data_frame(k_data)
+    for code, bars in k_data.items():
+        store.append(code, bars)
+
+    all_data = store.load_frame()
+
+    assert all_data.columns.tolist() == ['open', 'close', 'high', 'low', 'volume', 'code', 'mpl.date']
+    assert all_data.index.names == ['code', 'date']
+    # 'YYYY-MM-DD' strings, as get_k_data() dates
+    assert all_data.index.levels[1].dtype == object
+    assert all_data.index.get_level_values('date')[0] == '2010-01-04'
+    pd.testing.assert_frame_equal(all_data, expected, check_index_type=False)
+    assert all_data.index.equals(expected.index)
+
+
+def test_load_frame_codes_and_date_range(store, k_data):
+    for code, bars in k_data.items():
+        store.append(code, bars)
+    start, end = k_data['000000']['date'].iloc[10], k_data['000000']['date'].iloc[19]
+
+    all_data = store.load_frame(codes=['000001'], start=start, end=end, mpl_date=False)
+
+    expected = fetch_raw_data_frame({'000001': k_data['000001'].iloc[10:20]}).drop(columns='mpl.date')
+    pd.testing.assert_frame_equal(all_data, expected, check_index_type=False)
+
+
+def test_write_frame_round_trip(store, k_data):
+    expected = fetch_raw_data_frame(k_data)
+
+    store.write_frame(expected)
+
+    pd.testing.assert_frame_equal(store.load_frame(), expected, check_index_type=False)
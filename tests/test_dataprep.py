@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark
+import dataprep as dp
+
+
+@pytest.fixture(scope='module')
+def samples_and_table():
+    all_data_and_features = dp.build_features(benchmark.synthetic_market(3, 1200), n_workers=1, use_threads=True)
+    samples = dp.build_sample_set(all_data_and_features)
+    assert len(samples) > 0
+    return samples, dp.label_samples(samples)
+
+
+def edit_meta(path, edit):
+    meta_path = os.path.join(path, dp.CONST_SAMPLE_SET_META)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    edit(meta)
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+
+def meta_dtype(path, name):
+    return dp.read_sample_set_meta(path)['arrays'][name]['dtype']
+
+
+#
+# save_sample_set, load_sample_set
+#
+
+
+@pytest.mark.parametrize('compress', [False, True])
+@pytest.mark.parametrize('mmap', [False, True])
+def test_save_load_round_trip(tmp_path, samples_and_table, compress, mmap):
+    samples, table = samples_and_table
+    path = str(tmp_path / 'sample_set')
+
+    dp.save_sample_set(samples, path, table=table, params={'LENGTHKC': 20}, compress=compress)
+    loaded, loaded_table = dp.load_sample_set(path, mmap=mmap, feature_columns=samples.feature_columns,
+                                              lookback=samples.lookback)
+
+    assert os.path.isfile(os.path.join(path, dp.CONST_SAMPLE_SET_ARCHIVE)) == compress
+    assert loaded.codes == samples.codes
+    assert loaded.feature_columns == samples.feature_columns
+    assert loaded.lookback == samples.lookback
+    assert loaded.params == dict(samples.params, LENGTHKC=20)
+    pd.testing.assert_frame_equal(loaded.index, samples.index)
+    for values, expected in zip(loaded.features, samples.features):
+        assert isinstance(values, np.memmap) == (mmap and not compress)
+        assert values.dtype == expected.dtype
+        np.testing.assert_array_equal(values, expected)
+    for days, expected in zip(loaded.dates, samples.dates):
+        np.testing.assert_array_equal(days, expected)
+    pd.testing.assert_frame_equal(loaded_table, table)
+    np.testing.assert_array_equal(loaded.to_tensor(), samples.to_tensor())
+
+
+def test_save_replaces_earlier_save(tmp_path, samples_and_table):
+    samples, table = samples_and_table
+    path = str(tmp_path / 'sample_set')
+
+    dp.save_sample_set(samples, path, table=table, compress=True)
+    dp.save_sample_set(samples, path)
+    loaded, loaded_table = dp.load_sample_set(path)
+
+    assert not os.path.isfile(os.path.join(path, dp.CONST_SAMPLE_SET_ARCHIVE))
+    assert loaded_table is None
+    pd.testing.assert_frame_equal(loaded.index, samples.index)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_load_rejects_changed_feature_columns(tmp_path, samples_and_table, compress):
+    samples, table = samples_and_table
+    path = str(tmp_path / 'sample_set')
+    dp.save_sample_set(samples, path, table=table, compress=compress)
+
+    with pytest.raises(ValueError):
+        dp.load_sample_set(path, feature_columns=samples.feature_columns[::-1])
+    with pytest.raises(ValueError):
+        dp.load_sample_set(path, lookback=samples.lookback + 1)
+
+    edit_meta(path, lambda meta: meta['feature_columns'].pop())
+    with pytest.raises(ValueError):
+        dp.load_sample_set(path)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_load_rejects_changed_dtype(tmp_path, samples_and_table, compress):
+    samples, table = samples_and_table
+    path = str(tmp_path / 'sample_set')
+    dp.save_sample_set(samples, path, table=table, compress=compress)
+    dtype = np.dtype(meta_dtype(path, 'features'))
+    changed = np.float64 if dtype == np.float32 else np.float32
+
+    edit_meta(path, lambda meta: meta['arrays']['features'].update(dtype=np.dtype(changed).str))
+    with pytest.raises(ValueError):
+        dp.load_sample_set(path)
+
+
+def test_load_rejects_other_format(tmp_path, samples_and_table):
+    samples, table = samples_and_table
+    path = str(tmp_path / 'sample_set')
+    dp.save_sample_set(samples, path)
+
+    edit_meta(path, lambda meta: meta.update(version=meta['version'] + 1))
+    with pytest.raises(ValueError):
+        dp.load_sample_set(path)
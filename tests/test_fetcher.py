@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import barstore
+import benchmark
+import fetcher
+import instrument
+from fetcher import CONST_K_DATA_COLUMNS, Fetcher, FileSource
+
+
+CODES = ['000000', '000001', '000002']
+
+# last date of the source bars, so codes fetched up to it are up to date
+END = pd.bdate_range('2010-01-04', periods=60)[-1].strftime('%Y-%m-%d')
+
+
+@pytest.fixture
+def source(tmp_path):
+    ''' FileSource of a directory of <code>.csv, 60 bars from 2010-01-04
+    '''
+    all_data = benchmark.synthetic_market(len(CODES), 60)
+    csv_dir = tmp_path / 'csv'
+    csv_dir.mkdir()
+    for code in CODES:
+        all_data.loc[code].reset_index()[CONST_K_DATA_COLUMNS].to_csv(str(csv_dir / (code + '.csv')), index=False)
+    return FileSource(str(csv_dir))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return barstore.BarStore(str(tmp_path / 'bars'))
+
+
+class FlakySource(fetcher.DataSource):
+    ''' Source failing the first n_failures requests of each code in codes,
+        and recording all requests
+    '''
+
+    def __init__(self, source, n_failures, codes = None, error = IOError):
+        self.source = source
+        self.n_failures = n_failures
+        self.codes = codes
+        self.error = error
+        self.requests = []
+
+    def get_bars(self, code, start_date, end_date):
+        self.requests.append((code, start_date, end_date))
+        if self.codes is None or code in self.codes:
+            if sum(1 for request in self.requests if request[0] == code) <= self.n_failures:
+                raise self.error('request failed: ' + code)
+        return self.source.get_bars(code, start_date, end_date)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    ''' Seconds passed to time.sleep() by the fetcher, which does not sleep
+    '''
+    sleeps = []
+    monkeypatch.setattr(fetcher.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def assert_stored(store, source, code, start_date, end_date):
+    bars = source.get_bars(code, start_date, end_date)
+    stored = store.read(code)
+    assert store.last_date(code) == bars['date'].iloc[-1]
+    for col in ['open', 'close', 'high', 'low', 'volume']:
+        np.testing.assert_array_equal(stored[col], bars[col].values)
+
+
+#
+# missing_range
+#
+
+
+def test_missing_range(source, store):
+    bars = source.get_bars('000000', '2010-01-01', END)
+    fetch = Fetcher(source, store)
+
+    assert fetch.missing_range('000000', '2010-01-01', END) == ('2010-01-01', END)
+
+    store.append('000000', bars.iloc[:20])
+    last_date = bars['date'].iloc[19]
+    next_date = str(np.datetime64(last_date, 'D') + 1)
+    assert fetch.missing_range('000000', '2010-01-01', END) == (next_date, END)
+    # never backfilled before the first stored bar
+    assert fetch.missing_range('000000', '2009-01-01', END) == (next_date, END)
+    assert fetch.missing_range('000000', '2010-01-01', last_date) is None
+
+
+#
+# fetch
+#
+
+
+def test_fetch_appends_bars_of_all_codes(source, store):
+    result = Fetcher(source, store).fetch(CODES, '2010-01-01', END)
+
+    assert result == {'fetched': 3, 'bars': 180, 'skipped': 0, 'failed': {}}
+    for code in CODES:
+        assert_stored(store, source, code, '2010-01-01', END)
+
+
+def test_fetch_retries_with_backoff(source, store, sleeps):
+    flaky = FlakySource(source, n_failures=2, codes=['000001'])
+
+    with instrument.Instrument() as ins:
+        result = Fetcher(flaky, store, retries=3, backoff=0.5).fetch(CODES, '2010-01-01', END)
+
+    assert result == {'fetched': 3, 'bars': 180, 'skipped': 0, 'failed': {}}
+    assert sleeps == [0.5, 1.]
+    assert ins.report()['counters'] == {'fetch.errors': 2}
+    assert_stored(store, source, '000001', '2010-01-01', END)
+
+
+def test_fetch_reports_failed_codes(source, store, sleeps):
+    flaky = FlakySource(source, n_failures=10, codes=['000001'])
+
+    result = Fetcher(flaky, store, retries=2, backoff=0.5).fetch(CODES, '2010-01-01', END)
+
+    assert result['fetched'] == 2
+    assert result['bars'] == 120
+    assert list(result['failed']) == ['000001']
+    assert 'request failed: 000001' in result['failed']['000001']
+    assert sleeps == [0.5, 1.]
+    assert store.rows('000001') == 0
+
+    # a second run resumes the failed code only
+    flaky.n_failures = 0
+    del flaky.requests[:]
+    result = Fetcher(flaky, store).fetch(CODES, '2010-01-01', END)
+
+    assert result == {'fetched': 1, 'bars': 60, 'skipped': 2, 'failed': {}}
+    assert [request[0] for request in flaky.requests] == ['000001']
+
+
+def test_fetch_resumes_from_checkpoint(source, store):
+    flaky = FlakySource(source, n_failures=1, codes=['000001'], error=KeyboardInterrupt)
+
+    with pytest.raises(KeyboardInterrupt):
+        Fetcher(flaky, store, max_workers=1).fetch(CODES, '2010-01-01', END)
+
+    with open(store.root + '/fetch_checkpoint.json') as f:
+        checkpoint = json.load(f)
+    assert checkpoint['range'] == ['2010-01-01', END]
+    assert '000001' not in checkpoint['done']
+
+    flaky.n_failures = 0
+    del flaky.requests[:]
+    result = Fetcher(flaky, store, max_workers=1).fetch(CODES, '2010-01-01', END)
+
+    assert result == {'fetched': 1, 'bars': 60, 'skipped': 2, 'failed': {}}
+    assert flaky.requests == [('000001', '2010-01-01', END)]
+    for code in CODES:
+        assert_stored(store, source, code, '2010-01-01', END)
+
+
+def test_fetch_checkpoints_codes_without_bars(source, store):
+    flaky = FlakySource(source, n_failures=0)
+
+    result = Fetcher(flaky, store).fetch(CODES + ['999999'], '2010-01-01', END)
+    assert result == {'fetched': 4, 'bars': 180, 'skipped': 0, 'failed': {}}
+
+    del flaky.requests[:]
+    result = Fetcher(flaky, store).fetch(CODES + ['999999'], '2010-01-01', END)
+
+    assert result == {'fetched': 0, 'bars': 0, 'skipped': 4, 'failed': {}}
+    assert flaky.requests == []
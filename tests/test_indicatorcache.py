@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pandas as pd
+import pytest
+
+import barstore
+import benchmark
+import stockbasic as sb
+from indicatorcache import IndicatorCache, bar_fingerprint
+
+
+@pytest.fixture
+def all_data():
+    return benchmark.synthetic_market(3, 300)
+
+
+def stocks(all_data):
+    return [(code, stock_data.droplevel(0)) for code, stock_data in all_data.groupby(level=0)]
+
+
+def result_bytes(result):
+    return sum(result[col].values.nbytes for col in result.columns)
+
+
+#
+# call
+#
+
+
+def test_cached_equals_uncached(all_data):
+    cache = IndicatorCache()
+    ttm_squeeze = cache.cached(sb.ttm_squeeze)
+
+    for code, stock_data in stocks(all_data):
+        expected = sb.ttm_squeeze(stock_data, LENGTHKC=14)
+        pd.testing.assert_frame_equal(ttm_squeeze(stock_data, LENGTHKC=14), expected)
+        pd.testing.assert_frame_equal(ttm_squeeze(stock_data, LENGTHKC=14), expected)
+        pd.testing.assert_frame_equal(cache.call(sb.talib_atr, stock_data), sb.talib_atr(stock_data))
+
+    assert cache.stats()['hits'] == 3
+    assert cache.stats()['misses'] == 6
+
+
+def test_defaults_share_one_entry(all_data):
+    cache = IndicatorCache()
+    code, stock_data = stocks(all_data)[0]
+
+    cache.call(sb.ttm_squeeze, stock_data)
+    cache.call(sb.ttm_squeeze, stock_data, LENGTHKC=20)
+    cache.call(sb.ttm_squeeze, stock_data, 1.5, LENGTHKC=20)
+
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['hits'] == 2
+
+
+def test_changed_bars_miss(all_data):
+    cache = IndicatorCache()
+    code, stock_data = stocks(all_data)[0]
+    cache.call(sb.talib_atr, stock_data)
+
+    changed = stock_data.copy()
+    changed.iloc[-1, changed.columns.get_loc('close')] *= 1.01
+    assert bar_fingerprint(changed) != bar_fingerprint(stock_data)
+    # columns other than bars do not change the fingerprint
+    assert bar_fingerprint(stock_data.join(sb.talib_atr(stock_data))) == bar_fingerprint(stock_data)
+
+    pd.testing.assert_frame_equal(cache.call(sb.talib_atr, changed), sb.talib_atr(changed))
+    assert cache.stats()['misses'] == 2
+
+
+#
+# eviction and disk tier
+#
+
+
+def test_eviction_spills_to_disk(all_data, tmp_path):
+    spill_dir = str(tmp_path / 'cache')
+    stock_list = stocks(all_data)
+    nbytes = result_bytes(sb.ttm_squeeze(stock_list[0][1]))
+    cache = IndicatorCache(max_bytes=2 * nbytes, spill_dir=spill_dir)
+
+    for code, stock_data in stock_list:
+        cache.call(sb.ttm_squeeze, stock_data)
+
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['spills'] == 1
+    assert stats['entries'] == 2
+    assert stats['bytes'] == 2 * nbytes
+    # least recently used is the first stock
+    assert os.listdir(spill_dir) == [stock_list[0][0]]
+
+    new_cache = IndicatorCache(spill_dir=spill_dir)
+    code, stock_data = stock_list[0]
+    pd.testing.assert_frame_equal(new_cache.call(sb.ttm_squeeze, stock_data), sb.ttm_squeeze(stock_data))
+    assert new_cache.stats()['disk_hits'] == 1
+    assert new_cache.stats()['misses'] == 0
+
+    # the result is back in memory
+    new_cache.call(sb.ttm_squeeze, stock_data)
+    assert new_cache.stats()['hits'] == 1
+
+
+def test_eviction_without_disk_tier_drops(all_data):
+    stock_list = stocks(all_data)
+    nbytes = result_bytes(sb.ttm_squeeze(stock_list[0][1]))
+    cache = IndicatorCache(max_bytes=2 * nbytes)
+
+    for code, stock_data in stock_list + stock_list[:1]:
+        cache.call(sb.ttm_squeeze, stock_data)
+
+    assert cache.stats()['misses'] == 4
+    assert cache.stats()['evictions'] == 2
+    assert cache.stats()['spills'] == 0
+
+
+#
+# invalidate
+#
+
+
+def test_invalidate_on_append_drops_only_that_stock(tmp_path):
+    all_data = benchmark.synthetic_market(3, 301)
+    store = barstore.BarStore(str(tmp_path / 'bars'))
+    store.write_frame(all_data.groupby(level=0).head(300))
+    spill_dir = str(tmp_path / 'cache')
+    cache = IndicatorCache(spill_dir=spill_dir)
+    store.on_append.append(cache.invalidate)
+
+    stock_list = stocks(store.load_frame(mpl_date=False))
+    for code, stock_data in stock_list:
+        cache.call(sb.ttm_squeeze, stock_data)
+        cache.call(sb.talib_atr, stock_data)
+    cache.flush()
+
+    code = stock_list[0][0]
+    assert store.append(code, all_data.loc[code].iloc[-1:]) == 1
+
+    stats = cache.stats()
+    assert stats['invalidations'] == 2
+    assert stats['entries'] == 4
+    assert sorted(os.listdir(spill_dir)) == [other for other, stock_data in stock_list[1:]]
+
+    for other, stock_data in stock_list[1:]:
+        cache.call(sb.ttm_squeeze, stock_data)
+    cache.call(sb.ttm_squeeze, stock_list[0][1])
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 7
+
+
+#
+# stats
+#
+
+
+def test_stats(all_data):
+    cache = IndicatorCache()
+    stock_list = stocks(all_data)
+    assert cache.stats() == {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'spills': 0,
+                             'invalidations': 0, 'entries': 0, 'bytes': 0, 'hit_rate': 0.}
+
+    for code, stock_data in stock_list:
+        cache.call(sb.talib_atr, stock_data)
+    code, stock_data = stock_list[0]
+    cache.call(sb.talib_atr, stock_data)
+
+    assert cache.stats() == {'hits': 1, 'disk_hits': 0, 'misses': 3, 'evictions': 0, 'spills': 0,
+                             'invalidations': 0, 'entries': 3,
+                             'bytes': 3 * result_bytes(sb.talib_atr(stock_data)), 'hit_rate': 0.25}
+
+    assert cache.invalidate(code) == 1
+    cache.clear()
+    assert cache.stats()['invalidations'] == 1
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['bytes'] == 0
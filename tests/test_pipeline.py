@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import barstore
+import benchmark
+import dataprep as dp
+from pipeline import Pipeline
+
+
+def market_store(tmp_path, n_stocks = 4, n_bars = 1200, held_bars = 0):
+    ''' BarStore of a synthetic market, without the last held_bars bars of
+        the first stock. Return (store, held back bars)
+    '''
+    all_data = benchmark.synthetic_market(n_stocks, n_bars)
+    first = all_data.index.levels[0][0]
+    held = all_data.loc[first].iloc[all_data.loc[first].shape[0] - held_bars:]
+    store = barstore.BarStore(str(tmp_path / 'bars'))
+    store.write_frame(all_data.drop(index=[(first, date) for date in held.index]))
+    return store, held
+
+
+def run_summary(run = 0, reused = 0, skipped = 0):
+    return {'run': run, 'reused': reused, 'skipped': skipped}
+
+
+def assert_equals_in_memory_build(pipeline, store, profit_threshold = dp.CONST_PROFIT_THRESHOLD):
+    ''' pipeline outputs equal build_features, build_sample_set,
+        label_samples and normalize_samples of the bars of store
+    '''
+    samples, table = pipeline.sample_set(mmap=False)
+    all_data_and_features = dp.build_features(store.load_frame(mpl_date=False), n_workers=1, use_threads=True)
+    expected = dp.build_sample_set(all_data_and_features, feature_columns=samples.feature_columns)
+
+    assert samples.codes == expected.codes
+    np.testing.assert_array_equal(samples.index.values, expected.index.values)
+    for values, expected_values in zip(samples.features, expected.features):
+        np.testing.assert_array_equal(values, expected_values)
+    pd.testing.assert_frame_equal(table, dp.label_samples(expected, profit_threshold))
+    np.testing.assert_array_equal(pipeline.normalized(mmap=False), dp.normalize_samples(expected, dtype=np.float32))
+
+
+@pytest.fixture
+def store_and_held(tmp_path):
+    return market_store(tmp_path, held_bars=20)
+
+
+def test_run_equals_in_memory_build(tmp_path, store_and_held):
+    store, held = store_and_held
+    pipeline = Pipeline(store, str(tmp_path / 'work'), n_workers=1, use_threads=True)
+
+    summary = pipeline.run()
+
+    assert summary == {'fetch': run_summary(),
+                       'features': run_summary(run=4),
+                       'samples': run_summary(run=4),
+                       'labels': run_summary(run=1),
+                       'normalization': run_summary(run=1)}
+    assert len(pipeline.sample_set()[0]) > 0
+    assert_equals_in_memory_build(pipeline, store)
+
+
+def test_second_run_reuses_everything(tmp_path, store_and_held):
+    store, held = store_and_held
+    Pipeline(store, str(tmp_path / 'work'), n_workers=1, use_threads=True).run()
+    pipeline = Pipeline(store, str(tmp_path / 'work'), n_workers=1, use_threads=True)
+
+    summary = pipeline.run()
+
+    assert summary == {'fetch': run_summary(),
+                       'features': run_summary(reused=4),
+                       'samples': run_summary(reused=4),
+                       'labels': run_summary(reused=1),
+                       'normalization': run_summary(reused=1)}
+    assert_equals_in_memory_build(pipeline, store)
+
+
+def test_append_rebuilds_only_that_stock(tmp_path, store_and_held):
+    store, held = store_and_held
+    pipeline = Pipeline(store, str(tmp_path / 'work'), n_workers=1, use_threads=True)
+    pipeline.run()
+
+    assert store.append('000000', held) == held.shape[0]
+    summary = pipeline.run()
+
+    assert summary == {'fetch': run_summary(),
+                       'features': run_summary(run=1, reused=3),
+                       'samples': run_summary(run=1, reused=3),
+                       'labels': run_summary(run=1),
+                       'normalization': run_summary(run=1)}
+    assert_equals_in_memory_build(pipeline, store)
+
+
+def test_label_parameter_reuses_stock_checkpoints(tmp_path, store_and_held):
+    store, held = store_and_held
+    Pipeline(store, str(tmp_path / 'work'), n_workers=1, use_threads=True).run()
+    pipeline = Pipeline(store, str(tmp_path / 'work'), params={'labels': {'profit_threshold': 0.1}},
+                        n_workers=1, use_threads=True)
+
+    summary = pipeline.run()
+
+    assert summary == {'fetch': run_summary(),
+                       'features': run_summary(reused=4),
+                       'samples': run_summary(reused=4),
+                       'labels': run_summary(run=1),
+                       'normalization': run_summary(run=1)}
+    assert_equals_in_memory_build(pipeline, store, profit_threshold=0.1)
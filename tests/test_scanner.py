@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark
+import stockbasic as sb
+from scanner import CONST_SCANNER_COLUMNS, Scanner
+
+
+# bars scanned one by one, after the history the scanner is seeded from
+CONST_N_SCANNED = 40
+
+
+@pytest.fixture(scope='module')
+def market():
+    ''' (all_data, {column: (stocks, bars) array of the batch features})
+    '''
+    all_data = benchmark.synthetic_market(20, 1000)
+    features = [sb.stock_features(stock_data.droplevel(0), ['squeeze', 'wave', 'atr'])
+                for code, stock_data in all_data.groupby(level=0)]
+    arrays = {col: np.stack([stock_features[col].values.astype(np.float64) for stock_features in features])
+              for col in CONST_SCANNER_COLUMNS}
+    for col in ['high', 'low', 'close']:
+        arrays[col] = all_data[col].unstack(0).values.T
+    return all_data, arrays
+
+
+def seeded_scanner(all_data):
+    n_bars = all_data.loc[all_data.index.levels[0][0]].shape[0]
+    return Scanner.from_frame(all_data.groupby(level=0).head(n_bars - CONST_N_SCANNED))
+
+
+def candidate_mask(scanner, candidates):
+    mask = np.zeros(len(scanner.codes), dtype=bool)
+    mask[np.searchsorted(scanner.codes, candidates['code'].values)] = True
+    return mask
+
+
+def test_committed_scans_equal_squeeze_buy_mask(market):
+    all_data, arrays = market
+    scanner = seeded_scanner(all_data)
+    expected = sb.squeeze_buy_mask(arrays['HIST5'], arrays['MACD6'], arrays['SQUEEZE'])
+    n_bars = expected.shape[1]
+
+    n_candidates = 0
+    for bar in range(n_bars - CONST_N_SCANNED, n_bars):
+        candidates = scanner.scan(arrays['high'][:, bar], arrays['low'][:, bar], arrays['close'][:, bar],
+                                  commit=True)
+        np.testing.assert_array_equal(candidate_mask(scanner, candidates), expected[:, bar])
+        for j, col in enumerate(scanner.columns):
+            np.testing.assert_allclose(scanner.values[:, j], arrays[col][:, bar], rtol=1e-9, atol=1e-9,
+                                       err_msg=col)
+        n_candidates += len(candidates)
+
+        # ranked by squeeze momentum in ATRs, with the ATR stop
+        assert (np.diff(candidates['rank'].values) <= 0).all()
+        np.testing.assert_allclose(candidates['stop_price'].values,
+                                   candidates['close'].values - 2. * candidates['ATR'].values)
+    assert n_candidates > 0
+
+
+def test_uncommitted_scan_keeps_state(market):
+    all_data, arrays = market
+    scanner = seeded_scanner(all_data)
+    bar = arrays['close'].shape[1] - CONST_N_SCANNED
+    values = scanner.values.copy()
+
+    first = scanner.scan(arrays['high'][:, bar] * 1.05, arrays['low'][:, bar], arrays['close'][:, bar] * 1.05)
+    np.testing.assert_array_equal(scanner.values, values)
+    second = scanner.scan(arrays['high'][:, bar], arrays['low'][:, bar], arrays['close'][:, bar])
+
+    committed = scanner.scan(arrays['high'][:, bar], arrays['low'][:, bar], arrays['close'][:, bar], commit=True)
+    pd.testing.assert_frame_equal(second, committed)
+    assert not np.array_equal(scanner.values, values, equal_nan=True)
+
+
+def test_scan_of_string_quotes_with_price(market):
+    all_data, arrays = market
+    scanner = seeded_scanner(all_data)
+    bar = arrays['close'].shape[1] - CONST_N_SCANNED
+    high, low, close = arrays['high'][:, bar], arrays['low'][:, bar], arrays['close'][:, bar]
+
+    # as tushare's get_realtime_quotes(): strings, 'price' for the last price, in any order
+    quotes = pd.DataFrame({'high': ['%.4f' % value for value in high],
+                           'low': ['%.4f' % value for value in low],
+                           'price': ['%.4f' % value for value in close]},
+                          index=pd.Index(scanner.codes, name='code'))[::-1]
+    expected = scanner.scan(np.round(high, 4), np.round(low, 4), np.round(close, 4))
+
+    pd.testing.assert_frame_equal(scanner.scan(quotes), expected)
+
+    # a suspended stock is quoted at 0, and a blank price is no bar
+    suspended = expected['code'].iloc[0]
+    quotes.loc[suspended, ['high', 'low', 'price']] = '0.000'
+    quotes.loc[scanner.codes[-1], 'price'] = ''
+    candidates = scanner.scan(quotes, commit=True)
+    assert suspended not in candidates['code'].values
+    assert scanner.codes[-1] not in candidates['code'].values
+    row = np.searchsorted(scanner.codes, suspended)
+    np.testing.assert_array_equal(scanner.values[row], seeded_scanner(all_data).values[row])
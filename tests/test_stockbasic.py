@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import stockbasic as sb
+
+
+def random_bars(n_bars = 600, seed = 0):
+    ''' Random walk OHLC bars of one stock, indexed by 'YYYY-MM-DD' dates
+    '''
+    rng = np.random.default_rng(seed)
+    close = 10. * np.exp(np.cumsum(rng.normal(0.001, 0.02, n_bars)))
+    spread = np.abs(rng.normal(0., 0.01, n_bars)) * close
+    dates = pd.bdate_range('2010-01-01', periods=n_bars).strftime('%Y-%m-%d')
+    return pd.DataFrame({'open': close + rng.normal(0., 0.005, n_bars) * close,
+                         'close': close,
+                         'high': close + spread,
+                         'low': close - spread,
+                         'volume': rng.uniform(1e5, 1e6, n_bars)},
+                        index=pd.Index(dates, name='date'))
+
+
+def stock_data_and_features(n_bars = 1000, seed = 0):
+    stock_data = random_bars(n_bars, seed)
+    return stock_data.join(sb.stock_features(stock_data))
+
+
+def per_row_buy_points(stock_data):
+    return np.array([sb.is_squeeze_buy_point(stock_data, index) for index in stock_data.index])
+
+
+#
+# squeeze_buy_points
+#
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_squeeze_buy_points_equals_per_row_on_features(seed):
+    stock_data = stock_data_and_features(seed=seed)
+    expected = per_row_buy_points(stock_data)
+
+    # leading rows have NaN indicators, and some buy-points are on the
+    # first bar of a squeeze release
+    squeeze = stock_data['SQUEEZE'].values
+    first_release = np.append(False, (squeeze[1:] == sb.CONST_SQUEEZE_RELEASED) &
+                                     (squeeze[:-1] == sb.CONST_SQUEEZE_ONGOING))
+    assert np.isnan(stock_data['HIST5'].values[0])
+    assert (expected & first_release).any()
+    np.testing.assert_array_equal(sb.squeeze_buy_points(stock_data), expected)
+
+
+def test_squeeze_buy_points_equals_per_row_on_edge_cases():
+    ON, OFF = sb.CONST_SQUEEZE_ONGOING, sb.CONST_SQUEEZE_RELEASED
+    nan = np.nan
+    stock_data = pd.DataFrame({'HIST5':   [1.,  nan, 1.,  1.,  1.,  1.,  1., -1.,  1.,  1.],
+                               'MACD6':   [1.,  1.,  nan, 1.,  1.,  1.,  1.,  1.,  1.,  0.],
+                               'SQUEEZE': [ON,  ON,  ON,  ON,  OFF, OFF, ON,  ON,  OFF, ON]},
+                              index=['2010-01-%02d' % day for day in range(1, 11)])
+    # bar 0: first bar, shifted 'SQUEEZE' is NaN, ongoing is a buy-point
+    # bars 1, 2: NaN wave C; bar 4: first bar of release; bar 5: second bar of release
+    # bar 7: HIST5 < 0; bar 8: first bar of release; bar 9: MACD6 == 0
+    expected = [True, False, False, True, True, False, True, False, True, False]
+
+    np.testing.assert_array_equal(per_row_buy_points(stock_data), expected)
+    np.testing.assert_array_equal(sb.squeeze_buy_points(stock_data), expected)
+
+
+def test_squeeze_buy_points_first_bar_released_is_not_a_buy_point():
+    stock_data = pd.DataFrame({'HIST5': [1., 1.],
+                               'MACD6': [1., 1.],
+                               'SQUEEZE': [sb.CONST_SQUEEZE_RELEASED, sb.CONST_SQUEEZE_RELEASED]},
+                              index=['2010-01-01', '2010-01-02'])
+
+    assert not per_row_buy_points(stock_data).any()
+    assert not sb.squeeze_buy_points(stock_data).any()
+
+
+#
+# get_sell_points
+#
+
+
+def per_bar_sell_points(stock_data, buy_locations, multi_atr = 2., n_low = 10, max_hold_bars = None,
+                        trailing_multi_atr = None):
+    ''' Reference exits: walk the bars after each buy-point, checking the
+        rules in get_sell_points() order
+    '''
+    close = stock_data['close'].values
+    atr = stock_data['ATR'].values
+    nbar_low = stock_data['LOW' + str(n_low)].values
+    sell_locations, sell_reasons = [], []
+    for buy in buy_locations:
+        stop_price = close[buy] - atr[buy] * multi_atr
+        trailing_stop = close[buy] - atr[buy] * trailing_multi_atr if trailing_multi_atr else None
+        if trailing_stop is not None and np.isnan(trailing_stop):
+            trailing_stop = -np.inf
+        location, reason = -1, sb.CONST_SELL_REASON_NONE
+        for i in range(buy + 1, close.shape[0]):
+            if close[i] <= stop_price:
+                location, reason = i, sb.CONST_SELL_REASON_STOP_LOSS
+            elif close[i] <= nbar_low[i]:
+                location, reason = i, sb.CONST_SELL_REASON_N_LOW
+            elif max_hold_bars is not None and i == buy + max_hold_bars:
+                location, reason = i, sb.CONST_SELL_REASON_TIME_STOP
+            elif trailing_stop is not None and close[i] <= trailing_stop:
+                location, reason = i, sb.CONST_SELL_REASON_TRAILING_STOP
+            if location >= 0:
+                break
+            if trailing_stop is not None and not np.isnan(atr[i]):
+                trailing_stop = max(trailing_stop, close[i] - atr[i] * trailing_multi_atr)
+        sell_locations.append(location)
+        sell_reasons.append(reason)
+    return np.array(sell_locations), np.array(sell_reasons)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_get_sell_points_equals_get_sell_point(seed):
+    stock_data = stock_data_and_features(seed=seed)
+    buy_locations = np.flatnonzero(sb.squeeze_buy_points(stock_data))
+
+    sell_locations, sell_reasons = sb.get_sell_points(stock_data, buy_locations)
+
+    for buy, location, reason in zip(buy_locations, sell_locations, sell_reasons):
+        sell_index, sell_reason = sb.get_sell_point(stock_data, stock_data.index[buy])
+        assert reason == sell_reason
+        if sell_reason == sb.CONST_SELL_REASON_NONE:
+            assert location == -1
+        else:
+            assert stock_data.index[location] == sell_index
+
+
+def test_get_sell_points_reasons():
+    stock_data = stock_data_and_features(seed=0)
+    buy_locations = np.arange(300, stock_data.shape[0])
+
+    sell_locations, sell_reasons = sb.get_sell_points(stock_data, buy_locations)
+    expected_locations, expected_reasons = per_bar_sell_points(stock_data, buy_locations)
+
+    np.testing.assert_array_equal(sell_locations, expected_locations)
+    np.testing.assert_array_equal(sell_reasons, expected_reasons)
+    # stop loss, N-bar low, and no sell point before the end are all covered
+    assert set(sell_reasons) == {sb.CONST_SELL_REASON_NONE, sb.CONST_SELL_REASON_STOP_LOSS,
+                                 sb.CONST_SELL_REASON_N_LOW}
+
+
+def test_get_sell_points_time_stop():
+    stock_data = stock_data_and_features(seed=1)
+    buy_locations = np.arange(300, stock_data.shape[0])
+
+    sell_locations, sell_reasons = sb.get_sell_points(stock_data, buy_locations,
+                                                      exit_rules=[sb.time_stop_rule(3)])
+    expected_locations, expected_reasons = per_bar_sell_points(stock_data, buy_locations, max_hold_bars=3)
+
+    np.testing.assert_array_equal(sell_locations, expected_locations)
+    np.testing.assert_array_equal(sell_reasons, expected_reasons)
+    assert (sell_reasons == sb.CONST_SELL_REASON_TIME_STOP).any()
+
+
+def test_get_sell_points_trailing_stop():
+    stock_data = stock_data_and_features(seed=2)
+    buy_locations = np.arange(300, stock_data.shape[0])
+
+    # a wide stop loss, so the trailing stop gets to sell
+    sell_locations, sell_reasons = sb.get_sell_points(stock_data, buy_locations, multi_atr=6., n_low=10,
+                                                      exit_rules=[sb.trailing_atr_stop_rule(1.)])
+    expected_locations, expected_reasons = per_bar_sell_points(stock_data, buy_locations, multi_atr=6.,
+                                                               trailing_multi_atr=1.)
+
+    np.testing.assert_array_equal(sell_locations, expected_locations)
+    np.testing.assert_array_equal(sell_reasons, expected_reasons)
+    assert (sell_reasons == sb.CONST_SELL_REASON_TRAILING_STOP).any()
+
+
+def test_get_sell_points_no_buy_point():
+    stock_data = stock_data_and_features(seed=0)
+
+    sell_locations, sell_reasons = sb.get_sell_points(stock_data, np.zeros(0, dtype=np.int64))
+
+    assert sell_locations.shape == (0,) and sell_reasons.shape == (0,)
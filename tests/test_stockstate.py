@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark
+import stockbasic as sb
+import stockstate as ss
+
+
+# incremental sums differ from TA-Lib's in the last bits, about 1e-14 relative
+CONST_RTOL = 1e-9
+
+
+def stock_bars(n_bars = 1200, seed = 0):
+    return benchmark.synthetic_market(1, n_bars, seed=seed).droplevel(0)
+
+
+def assert_rows_equal_features(rows, expected):
+    assert all(sorted(row) == sorted(expected.columns) for row in rows)
+    actual = pd.DataFrame(rows, index=expected.index, columns=expected.columns)
+    for col in expected.columns:
+        np.testing.assert_allclose(actual[col].values.astype(np.float64), expected[col].values.astype(np.float64),
+                                   rtol=CONST_RTOL, atol=1e-12, err_msg=col)
+
+
+def updates(state, stock_data):
+    return [state.update(high, low, close) for high, low, close in
+            zip(stock_data['high'].values, stock_data['low'].values, stock_data['close'].values)]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_round_tripped_state_updates_equal_stock_features(seed):
+    stock_data = stock_bars(seed=seed)
+    expected = sb.stock_features(stock_data)
+    n_history = 800
+
+    state = ss.FeatureState.from_history(stock_data.iloc[:n_history])
+    state = ss.state_from_dict(json.loads(json.dumps(state.to_dict())))
+    rows = updates(state, stock_data.iloc[n_history:])
+
+    assert_rows_equal_features(rows, expected.iloc[n_history:])
+
+
+def test_updates_from_first_bar_equal_stock_features():
+    stock_data = stock_bars(600)
+    rows = updates(ss.FeatureState(), stock_data)
+
+    assert_rows_equal_features(rows, sb.stock_features(stock_data))
+
+
+def test_parameters_and_feature_set():
+    stock_data = stock_bars(600)
+    params = {'feature_set': ['squeeze', 'atr', 'nbarlow'], 'LENGTHKC': 14, 'N_BAR_LOWEST': 20}
+    expected = sb.stock_features(stock_data, params['feature_set'], LENGTHKC=14, N_BAR_LOWEST=20)
+
+    state = ss.FeatureState.from_history(stock_data.iloc[:400], **params)
+    state = ss.state_from_dict(json.loads(json.dumps(state.to_dict())))
+    rows = updates(state, stock_data.iloc[400:])
+
+    assert_rows_equal_features(rows, expected.iloc[400:])
+
+
+def test_round_trip_keeps_state():
+    stock_data = stock_bars(600)
+    state = ss.FeatureState.from_history(stock_data)
+    state_dict = state.to_dict()
+
+    assert ss.state_from_dict(json.loads(json.dumps(state_dict))).to_dict() == json.loads(json.dumps(state_dict))